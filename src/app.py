@@ -8,7 +8,9 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from eba_benchmarking.config import DB_NAME
 from eba_benchmarking.config import DB_NAME
-from eba_benchmarking.data import get_master_data, get_financial_data, get_profitability_kpis, get_liquidity_kpis
+from eba_benchmarking.data import get_master_data, get_financial_data, get_profitability_kpis, get_liquidity_kpis, get_data_versions
+from eba_benchmarking.data.peers import PEER_STRATEGIES, get_peer_index, strategy_peers
+from eba_benchmarking.data.cache import clear_caches
 
 # Import UI Tabs
 # Import UI Tabs
@@ -39,8 +41,13 @@ df_master = get_master_data()
 
 if st.sidebar.button("🔄 Clear Data Cache"):
     st.cache_data.clear()
+    clear_caches()
     st.rerun()
 
+data_version = get_data_versions().get('__global__')
+if data_version:
+    st.sidebar.caption(f"Data version {data_version}")
+
 if df_master.empty: 
     st.error("⚠️ Database empty or commercial names missing. Run pipeline.")
     st.stop()
@@ -48,7 +55,6 @@ if df_master.empty:
 # Hardcoded base bank - National Bank of Greece (use LEI for reliable matching)
 # Bank of Cyprus is included in domestic peers as it's listed on ATHEX
 BASE_BANK_LEI = "5UMCZOEYKCVFAW8ZLO05"  # National Bank of Greece
-ATHEX_PEER_LEIS = ['635400L14KNHZXPUZM19']  # Bank of Cyprus Holdings
 
 base_row_matches = df_master[df_master['lei'] == BASE_BANK_LEI]
 if base_row_matches.empty:
@@ -73,71 +79,14 @@ st.sidebar.info(f"""
 ⚖️ {base_size} (Assets: {base_assets/1000:,.1f}bn)
 """)
 
-peer_strategy = st.sidebar.radio("Peer Group", [
-    "Domestic Peers (incl. BoC)",
-    "Regional (Same Size)",
-    "Regional (All but Small)",
-    "Core (Same Size)",
-    "Core (All but Small)",
-    "CEE (All)",
-    "Manual Selection"
-])
+peer_strategy = st.sidebar.radio("Peer Group", PEER_STRATEGIES + ["Manual Selection"])
 selected_leis = [base_lei]
 
-CORE_REGIONS = ['Western Europe', 'Northern Europe']
-SMALL_SIZE = 'Small (<50bn)'
-
-if peer_strategy == "Domestic Peers (incl. BoC)":
-    # Domestic peers (GR) + Bank of Cyprus (listed on ATHEX)
-    peers = df_master[
-        (
-            (df_master['country_iso'] == base_country) |
-            (df_master['lei'].isin(ATHEX_PEER_LEIS))
-        ) &
-        (df_master['lei'] != base_lei) &
-        (df_master['Systemic_Importance'].isin(['GSIB', 'OSII']))
-    ]
-    selected_leis.extend(peers['lei'].tolist())
-
-elif peer_strategy == "Regional (Same Size)":
-    peers = df_master[
-        (df_master['region'] == base_region) &
-        (df_master['size_category'] == base_size) &
-        (df_master['lei'] != base_lei)
-    ]
-    selected_leis.extend(peers['lei'].tolist())
-
-elif peer_strategy == "Regional (All but Small)":
-    peers = df_master[
-        (df_master['region'] == base_region) &
-        (df_master['size_category'] != SMALL_SIZE) &
-        (df_master['lei'] != base_lei)
-    ]
-    selected_leis.extend(peers['lei'].tolist())
-
-elif peer_strategy == "Core (Same Size)":
-    peers = df_master[
-        (df_master['region'].isin(CORE_REGIONS)) &
-        (df_master['size_category'] == base_size) &
-        (df_master['lei'] != base_lei)
-    ]
-    selected_leis.extend(peers['lei'].tolist())
-
-elif peer_strategy == "Core (All but Small)":
-    peers = df_master[
-        (df_master['region'].isin(CORE_REGIONS)) &
-        (df_master['size_category'] != SMALL_SIZE) &
-        (df_master['lei'] != base_lei)
-    ]
-    selected_leis.extend(peers['lei'].tolist())
-
-elif peer_strategy == "CEE (All)":
-    # Database uses 'CEE' for Central and Eastern Europe
-    peers = df_master[
-        (df_master['region'] == 'CEE') &
-        (df_master['lei'] != base_lei)
-    ]
-    selected_leis.extend(peers['lei'].tolist())
+if peer_strategy in PEER_STRATEGIES:
+    # Bitset lookup in the shared peer index (see data/peers.py)
+    peer_index = get_peer_index()
+    if peer_index is not None:
+        selected_leis.extend(peer_index.leis(strategy_peers(peer_index, peer_strategy, base_lei)))
 
 elif peer_strategy == "Manual Selection":
     avail = df_master[df_master['lei'] != base_lei]
@@ -6,6 +6,80 @@ ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__fil
 # Path to the database
 DB_NAME = os.path.join(ROOT_DIR, 'data', 'eba_data.db')
 
+# =============================================================================
+# DATABASE CONNECTION SETTINGS
+# =============================================================================
+
+# PRAGMAs applied to every pooled read-only connection (see data/connection.py)
+DB_READ_PRAGMAS = {
+    'mmap_size': 268435456,   # 256MB memory-mapped I/O
+    'cache_size': -65536,     # 64MB page cache (negative = KiB)
+    'temp_store': 'MEMORY',
+    'query_only': 'ON',
+}
+
+# Number of prepared statements kept per connection
+DB_STATEMENT_CACHE_SIZE = 256
+
+# Bulk-load mode of the tr_* parsers (see ingestion/parsers/bulk_load.py): the
+# loaded table's indexes are dropped and rebuilt once at the end, and these
+# PRAGMAs apply for the load (the previous values are restored afterwards).
+# journal_mode 'OFF' is faster still, but a crash mid-load can corrupt the file.
+BULK_LOAD = os.environ.get('EBA_BULK_LOAD', '1') != '0'
+DB_BULK_LOAD_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'OFF',
+    'cache_size': -524288,    # 512MB page cache (negative = KiB)
+    'temp_store': 'MEMORY',
+}
+
+# Worker processes parsing tr_* CSVs while the parser writes (see
+# ingestion/parsers/parallel.py; 1 parses inline) and the parsed chunks each
+# worker may queue ahead of the writer
+INGEST_WORKERS = int(os.environ.get('EBA_INGEST_WORKERS', min(4, os.cpu_count() or 1)))
+INGEST_QUEUE_SIZE = 4
+
+# Optional dictionary-encoded layout for the largest facts tables
+# (see ingestion/processors/compact_facts.py). The original table names stay
+# queryable through compatibility views.
+COMPACT_FACTS_LAYOUT = False
+COMPACT_FACTS_TABLES = ['facts_oth', 'facts_cre']
+COMPACT_TABLE_SUFFIX = '_compact'
+
+# Engine for data-layer queries: 'sqlite' (default) or 'duckdb'
+# (optional dependency, see data/duckdb_backend.py)
+DATA_BACKEND = os.environ.get('EBA_DATA_BACKEND', 'sqlite')
+
+# If set, DuckDB reads tables from this Parquet export instead of attaching DB_NAME
+# (e.g. COLUMNAR_DIR below)
+DUCKDB_PARQUET_DIR = None
+
+# Columnar snapshots: Parquet copies of the facts tables and institutions written
+# at the end of the pipeline (see ingestion/processors/export_columnar.py) and
+# read through Arrow by data/base.py. Facts tables are partitioned by period.
+COLUMNAR_DIR = os.path.join(ROOT_DIR, 'data', 'columnar')
+COLUMNAR_TABLES = ['facts_oth', 'facts_cre', 'facts_sov', 'facts_mrk', 'institutions']
+COLUMNAR_SNAPSHOTS = True
+
+# All-bank KPI frames kept in memory by data/superset.py and sliced per LEI
+# set. Least recently used frames are dropped beyond this budget; a frame
+# larger than the whole budget is not kept.
+KPI_SUPERSET_MAX_MB = 256
+
+# In-process cache of data functions (see data/cache.py): 'auto' uses
+# st.cache_data inside a running Streamlit app and an LRU dict elsewhere;
+# also 'streamlit', 'memory', 'disk' (disk cache only) or 'none'
+CACHE_BACKEND = os.environ.get('EBA_CACHE_BACKEND', 'auto')
+MEMORY_CACHE_MAX_ENTRIES = 128
+
+# On-disk result cache shared by server processes and restarts (see
+# data/disk_cache.py): results of cached data functions keyed by function,
+# arguments and data version. Least recently used entries are evicted
+# beyond DISK_CACHE_MAX_MB.
+DISK_CACHE_ENABLED = os.environ.get('EBA_DISK_CACHE', '1') != '0'
+DISK_CACHE_DIR = os.environ.get('EBA_DISK_CACHE_DIR', os.path.join(ROOT_DIR, 'data', 'cache'))
+DISK_CACHE_MAX_MB = 1024
+
 # =============================================================================
 # ITEM ID MAPPINGS
 # =============================================================================
@@ -1,3 +1,8 @@
+from .connection import get_connection, get_connection_stats, close_connection
+from .query import get_query_stats
+from .versions import get_data_versions
+from .superset import get_superset_stats
+from .cache import set_cache_backend, clear_caches
 from .base import get_master_data, MIN_PERIOD
 from .solvency import get_solvency_kpis, get_solvency_averages, get_regional_peers_raw_data, get_solvency_with_texas_ratio, get_rwa_composition_averages, get_rwa_composition
 from .asset_quality import get_aq_breakdown, get_asset_quality_averages, get_aq_breakdown_averages
@@ -1,19 +1,37 @@
 import pandas as pd
-import sqlite3
-import streamlit as st
 import os
-from ..config import DB_NAME
+import json
+import threading
+from ..config import DB_NAME, COLUMNAR_DIR
+from .connection import get_connection
+from .peers import get_peer_index, benchmark_groups
+from .versions import versioned_cache
+from .notify import notify_error, notify_warning
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as pa_ds
+    import pyarrow.fs as pa_fs
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
 
 MIN_PERIOD = '2020-01-01'
 
-@st.cache_data
+# Manifest written by ingestion/processors/export_columnar.py next to each snapshot
+SNAPSHOT_FILE = '_snapshot.json'
+
+_datasets_lock = threading.Lock()
+_datasets = {}
+
+@versioned_cache('institutions')
 def get_master_data():
     """Load the master list of banks with their metadata."""
     if not os.path.exists(DB_NAME):
-        st.error(f"Database file '{DB_NAME}' not found.")
+        notify_error(f"Database file '{DB_NAME}' not found.")
         return pd.DataFrame()
         
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     try:
         query = """
         SELECT
@@ -34,13 +52,11 @@ def get_master_data():
         df = pd.read_sql(query, conn)
         df = df[df['commercial_name'].notna()].copy()
     except Exception as e:
-        st.warning(f"Note: Could not load business models ({e}). Defaulting to basic list.")
+        notify_warning(f"Note: Could not load business models ({e}). Defaulting to basic list.")
         df = pd.read_sql("SELECT lei, name, commercial_name, short_name, country_iso, country_name, region, 'Other' as Systemic_Importance, 'Unknown' as business_model FROM institutions WHERE commercial_name IS NOT NULL ORDER BY commercial_name", conn)
-    finally:
-        conn.close()
     return df
 
-@st.cache_data
+@versioned_cache('institutions')
 def get_benchmark_leis(country_iso, region, systemic_importance, size_category=None):
     """
     Returns dict of peer group LEI lists based on size classification.
@@ -51,68 +67,88 @@ def get_benchmark_leis(country_iso, region, systemic_importance, size_category=N
     - EU (Same Size): All EU banks with same size category
     - EU Large: All EU banks with Large + Huge size categories
     
-    Excludes banks with no size_category data.
+    Excludes banks with no size_category data. Groups come from the shared
+    peer index (see peers.py) instead of a read of institutions per call.
     """
-    # Bank of Cyprus LEI (ATHEX-listed, treated as domestic for Greek banks)
-    ATHEX_PEER_LEIS = ['635400L14KNHZXPUZM19']
-    
-    if not os.path.exists(DB_NAME):
+    index = get_peer_index()
+    if index is None or not len(index):
         return {}
-    
-    conn = sqlite3.connect(DB_NAME)
+    groups = benchmark_groups(index, country_iso, region, size_category)
+    return {name: index.leis(bits) for name, bits in groups.items()}
+
+def peer_union(groups):
+    """
+    Sorted union of a peer-groups dict's LEI lists. Averages functions fetch
+    these banks once and split them by group in memory, so a bank in several
+    groups is read once.
+    """
+    return sorted({lei for leis in groups.values() for lei in leis})
+
+
+# =============================================================================
+# COLUMNAR SNAPSHOTS
+# =============================================================================
+
+def _read_manifest(table):
     try:
-        query = """
-            SELECT lei, country_iso, region, Systemic_Importance, size_category
-            FROM institutions
-            WHERE size_category IS NOT NULL
-        """
-        df = pd.read_sql(query, conn)
-    except:
-        conn.close()
-        return {}
-    conn.close()
-    
-    if df.empty:
-        return {}
-    
-    # Domestic: Same country OR Bank of Cyprus for Greek banks
-    if country_iso == 'GR':
-        dom = df[
-            (df['country_iso'] == country_iso) | 
-            (df['lei'].isin(ATHEX_PEER_LEIS))
-        ]['lei'].tolist()
-    else:
-        dom = df[
-            df['country_iso'] == country_iso
-        ]['lei'].tolist()
-    
-    # Regional (Same Size): Same region, different country, same size
-    if size_category:
-        reg_same_size = df[
-            (df['region'] == region) & 
-            (df['country_iso'] != country_iso) &
-            (df['size_category'] == size_category)
-        ]['lei'].tolist()
-    else:
-        reg_same_size = []
-    
-    # EU (Same Size): All EU with same size category
-    if size_category:
-        eu_same_size = df[
-            df['size_category'] == size_category
-        ]['lei'].tolist()
-    else:
-        eu_same_size = []
-    
-    # EU Large: All Large + Huge banks
-    eu_large = df[
-        df['size_category'].isin(['Large (200-500bn)', 'Huge (>500bn)'])
-    ]['lei'].tolist()
-    
-    return {
-        "Domestic Avg": dom,
-        "Regional (Same Size)": reg_same_size,
-        "EU (Same Size)": eu_same_size,
-        "EU Large": eu_large
-    }
+        with open(os.path.join(COLUMNAR_DIR, table, SNAPSHOT_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_snapshot_fresh(table, conn=None, manifest=None):
+    """True if the Parquet snapshot of `table` was exported from its current contents."""
+    from .mart import get_table_signature
+    manifest = manifest or _read_manifest(table)
+    if manifest is None:
+        return False
+    return manifest.get('source_signature') == get_table_signature(conn or get_connection(), table)
+
 
+def _open_dataset(table, exported_at):
+    # File discovery is done once per export; scans memory-map the files
+    key = (table, exported_at)
+    with _datasets_lock:
+        if key not in _datasets:
+            _datasets[key] = pa_ds.dataset(
+                os.path.join(COLUMNAR_DIR, table),
+                format='parquet',
+                partitioning=pa_ds.partitioning(pa.schema([('period', pa.string())]), flavor='hive'),
+                filesystem=pa_fs.LocalFileSystem(use_mmap=True),
+            )
+        return _datasets[key]
+
+
+def read_columnar(table, leis=None, items=None, min_period=None, columns=None):
+    """
+    Reads `table` from its Parquet snapshot with the lei / item_id / period
+    filters pushed down to partitions and row groups.
+    Returns None if pyarrow is missing or the snapshot is absent or stale;
+    callers then query SQLite.
+    """
+    if not PYARROW_AVAILABLE:
+        return None
+    manifest = _read_manifest(table)
+    if manifest is None:
+        return None
+    try:
+        if not is_snapshot_fresh(table, manifest=manifest):
+            return None
+        dataset = _open_dataset(table, manifest.get('exported_at'))
+
+        conditions = []
+        if leis is not None:
+            conditions.append(pa_ds.field('lei').isin([str(v) for v in leis]))
+        if items is not None:
+            conditions.append(pa_ds.field('item_id').isin([str(v) for v in items]))
+        if min_period is not None:
+            conditions.append(pa_ds.field('period') >= str(min_period))
+        expr = None
+        for cond in conditions:
+            expr = cond if expr is None else expr & cond
+
+        return dataset.to_table(columns=columns, filter=expr).to_pandas()
+    except Exception as e:
+        print(f"Error reading columnar snapshot of {table}, falling back to SQLite: {e}")
+        return None
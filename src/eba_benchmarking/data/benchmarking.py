@@ -16,15 +16,27 @@ import pandas as pd
 
 import numpy as np
 
-import sqlite3
+import os
 
-import streamlit as st
+from ..config import DB_NAME, PROFITABILITY_ITEMS
 
-import os
+from .connection import get_connection
+
+from .query import LEI_SET, read_sql, read_wide
+
+from .fact_scan import load_fact_scans, scan_group, compute_scan_kpis
+
+from .metrics import add_annualization, evaluate_metrics
+
+from .ranking import rank_against_peers
+
+from .mart import MART_TABLE, PERCENTILES_TABLE, MART_SOURCE_TABLES, get_mart_metrics, get_mart_percentiles
 
-from ..config import DB_NAME, PROFITABILITY_ITEMS, SOLVENCY_ITEMS
+from .base import MIN_PERIOD, get_master_data, get_benchmark_leis
 
-from .base import MIN_PERIOD, get_master_data
+from .peers import PeerIndex, benchmark_groups
+
+from .versions import versioned_cache
 
 
 
@@ -68,155 +80,52 @@ def percentileofscore(values, score):
 
 
 
-@st.cache_data
-
-def get_benchmarking_peer_groups(country_iso, region, systemic_importance, size_category=None):
+# Report columns per peer group: {average column: percentile column}
 
-    """
-
-    Returns dict of peer group LEI lists based on size classification.
-
-    
+PEER_GROUP_COLUMNS = {
 
-    Groups:
-
-    - Domestic Avg: Same country banks (incl. Bank of Cyprus for GR)
-
-    - Regional (Same Size): Same region, same size category
-
-    - EU (Same Size): All EU banks with same size category
-
-    - EU Large: All EU banks with Large + Huge size categories
-
-    
-
-    Excludes banks with no size_category data.
-
-    """
-
-    # Bank of Cyprus LEI (ATHEX-listed, treated as domestic for Greek banks)
-
-    ATHEX_PEER_LEIS = ['635400L14KNHZXPUZM19']
-
-    
+    'Domestic Avg': 'Dom Pctl',
 
-    if not os.path.exists(DB_NAME):
-
-        return {}
-
-    
-
-    conn = sqlite3.connect(DB_NAME)
-
-    try:
-
-        query = """
-
-            SELECT lei, country_iso, region, Systemic_Importance, size_category
-
-            FROM institutions
-
-            WHERE size_category IS NOT NULL
-
-        """
-
-        df = pd.read_sql(query, conn)
-
-    except:
-
-        conn.close()
-
-        return {}
-
-    conn.close()
-
-    
-
-    if df.empty:
-
-        return {}
-
-    
+    'Regional (Same Size)': 'Reg Pctl',
 
-    # Domestic: Same country OR Bank of Cyprus for Greek banks
+    'EU (Same Size)': 'EU Pctl',
 
-    if country_iso == 'GR':
+    'EU Large': 'EU Large Pctl',
 
-        dom = df[
-
-            (df['country_iso'] == country_iso) | 
-
-            (df['lei'].isin(ATHEX_PEER_LEIS))
-
-        ]['lei'].tolist()
-
-    else:
-
-        dom = df[
-
-            df['country_iso'] == country_iso
-
-        ]['lei'].tolist()
-
-    
-
-    # Regional (Same Size): Same region, different country, same size
-
-    if size_category:
-
-        reg_same_size = df[
-
-            (df['region'] == region) & 
-
-            (df['country_iso'] != country_iso) &
-
-            (df['size_category'] == size_category)
-
-        ]['lei'].tolist()
+}
 
-    else:
 
-        reg_same_size = []
 
-    
 
-    # EU (Same Size): All EU with same size category
 
-    if size_category:
+@versioned_cache('institutions')
 
-        eu_same_size = df[
-
-            df['size_category'] == size_category
+def get_benchmarking_peer_groups(country_iso, region, systemic_importance, size_category=None):
 
-        ]['lei'].tolist()
+    """
 
-    else:
+    Returns dict of peer group LEI lists based on size classification
 
-        eu_same_size = []
+    (Domestic Avg, Regional (Same Size), EU (Same Size), EU Large).
 
     
 
-    # EU Large: All Large + Huge banks
+    Same groups as base.get_benchmark_leis(), both built from the peer index.
 
-    eu_large = df[
+    """
 
-        df['size_category'].isin(['Large (200-500bn)', 'Huge (>500bn)'])
+    return get_benchmark_leis(country_iso, region, systemic_importance, size_category)
 
-    ]['lei'].tolist()
 
-    
 
-    return {
 
-        "Domestic Avg": dom,
 
-        "Regional (Same Size)": reg_same_size,
+def peer_group_key(country_iso, region, size_category=None):
 
-        "EU (Same Size)": eu_same_size,
+    """Identifies the peer-group definition a report was ranked against (systemic importance is not used)."""
 
-        "EU Large": eu_large
+    return '|'.join('' if pd.isna(v) else str(v) for v in (country_iso, region, size_category))
 
-    }
 
 
 
@@ -230,95 +139,69 @@ def get_benchmarking_peer_groups(country_iso, region, systemic_importance, size_
 
 
 
-@st.cache_data
-
+@versioned_cache(*MART_SOURCE_TABLES, MART_TABLE)
 def get_all_benchmarking_metrics(lei_list):
-
     """
-
-    Fetches and calculates ALL benchmarking metrics for a list of LEIs.
-
+    Fetches ALL benchmarking metrics for a list of LEIs.
+    Reads from the materialized mart_bank_metrics table while it is fresh,
+    otherwise falls back to live computation.
     Returns a DataFrame with one row per bank per period.
-
     """
-
     if not lei_list or not os.path.exists(DB_NAME):
-
         return pd.DataFrame()
 
-    
-
-    conn = sqlite3.connect(DB_NAME)
-
-    leis_str = "'" + "','".join([str(lei) for lei in lei_list]) + "'"
-
-    
-
-    # =================================================================
-
-    # 1. PROFITABILITY & BALANCE SHEET DATA
+    df_mart = get_mart_metrics(lei_list)
+    if df_mart is not None:
+        return df_mart
 
-    # =================================================================
+    return compute_all_benchmarking_metrics(lei_list)
 
-    prof_items = list(PROFITABILITY_ITEMS.keys())
-
-    prof_items_str = "'" + "','".join(prof_items) + "'"
-
-    
 
-    query_prof = f"""
+def compute_all_benchmarking_metrics(lei_list):
 
-    SELECT f.lei, COALESCE(i.short_name, i.commercial_name) as name, f.period, f.item_id, SUM(f.amount) as amount
-
-    FROM facts_oth f
-
-    JOIN institutions i ON f.lei = i.lei
-
-    WHERE f.lei IN ({leis_str}) 
+    """
 
-      AND f.item_id IN ({prof_items_str})
+    Calculates ALL benchmarking metrics for a list of LEIs from the facts tables.
 
-      AND f.period >= '{MIN_PERIOD}'
+    Used by the mart build step and as the live fallback.
 
-    GROUP BY f.lei, f.period, f.item_id
+    Returns a DataFrame with one row per bank per period.
 
     """
 
-    
+    if not lei_list or not os.path.exists(DB_NAME):
 
-    try:
+        return pd.DataFrame()
 
-        df_prof = pd.read_sql(query_prof, conn)
+    
 
-    except:
+    # =================================================================
 
-        df_prof = pd.DataFrame()
+    # 0. ONE SCAN PER FACTS TABLE (shared by every section below)
 
-    
-
-    if df_prof.empty:
+    # =================================================================
 
-        conn.close()
+    scans = load_fact_scans(lei_list)
 
-        return pd.DataFrame()
+    df_oth = scans['facts_oth']
 
     
 
-    # Pivot profitability data
+    # =================================================================
 
-    df_prof_pivot = df_prof.pivot_table(
+    # 1. PROFITABILITY & BALANCE SHEET DATA
 
-        index=['lei', 'name', 'period'],
+    # =================================================================
 
-        columns='item_id',
+    # One row per bank-period, one column per PROFITABILITY_ITEMS label
 
-        values='amount',
+    df_prof_pivot = scan_group(df_oth, 'profitability')
 
-        aggfunc='sum'
+    
 
-    ).reset_index()
+    if df_prof_pivot.empty:
 
-    df_prof_pivot.rename(columns=PROFITABILITY_ITEMS, inplace=True)
+        return pd.DataFrame()
 
     
 
@@ -338,57 +221,11 @@ def get_all_benchmarking_metrics(lei_list):
 
     # =================================================================
 
-    solv_items = list(SOLVENCY_ITEMS.keys())
-
-    solv_items_str = "'" + "','".join(solv_items) + "'"
-
-    
-
-    query_solv = f"""
-
-    SELECT f.lei, f.period, f.item_id, SUM(f.amount) as amount
-
-    FROM facts_oth f
-
-    WHERE f.lei IN ({leis_str}) 
-
-      AND f.item_id IN ({solv_items_str})
-
-      AND f.period >= '{MIN_PERIOD}'
-
-    GROUP BY f.lei, f.period, f.item_id
-
-    """
+    df_solv_pivot = scan_group(df_oth, 'solvency', with_name=False)
 
     
 
-    try:
-
-        df_solv = pd.read_sql(query_solv, conn)
-
-    except:
-
-        df_solv = pd.DataFrame()
-
-    
-
-    if not df_solv.empty:
-
-        df_solv_pivot = df_solv.pivot_table(
-
-            index=['lei', 'period'],
-
-            columns='item_id',
-
-            values='amount',
-
-            aggfunc='sum'
-
-        ).reset_index()
-
-        df_solv_pivot.rename(columns=SOLVENCY_ITEMS, inplace=True)
-
-        
+    if not df_solv_pivot.empty:
 
         # Remove TREA from profitability if it exists (to avoid conflict, use solvency TREA)
 
@@ -440,640 +277,259 @@ def get_all_benchmarking_metrics(lei_list):
 
     if 'Leverage Ratio' not in df.columns:
 
-        df['Leverage Ratio'] = 0
-
-    
-
-    # =================================================================
-
-    # 3. RWA COMPOSITION
-
-    # =================================================================
-
-    query_rwa = f"""
-
-    SELECT f.lei, f.period, d.label, SUM(f.amount) as amount
-
-    FROM facts_oth f
-
-    JOIN dictionary d ON f.item_id = d.item_id
-
-    WHERE f.lei IN ({leis_str})
-
-      AND d.tab_name = 'RWA'
-
-      AND f.period >= '{MIN_PERIOD}'
-
-    GROUP BY f.lei, f.period, d.label
-
-    """
-
-    
-
-    try:
-
-        df_rwa = pd.read_sql(query_rwa, conn)
-
-    except:
-
-        df_rwa = pd.DataFrame()
-
-    
-
-    if not df_rwa.empty:
-
-        # Pivot RWA data
-
-        df_rwa_pivot = df_rwa.pivot_table(
-
-            index=['lei', 'period'],
-
-            columns='label',
-
-            values='amount',
-
-            aggfunc='sum'
-
-        ).reset_index()
-
-        
-
-        # Merge with main df
-
-        df = pd.merge(df, df_rwa_pivot, on=['lei', 'period'], how='left')
-
-    
-
-    # =================================================================
-
-    # 4. CASH DATA (for Cash/Deposits ratio)
-
-    # =================================================================
-
-    query_cash = f"""
-
-    SELECT lei, period, SUM(amount) as cash
-
-    FROM facts_oth
-
-    WHERE lei IN ({leis_str})
-
-      AND item_id = '2521001'
-
-      AND f.period >= '{MIN_PERIOD}'
-
-    GROUP BY lei, period
-
-    """
-
-    
-
-    try:
-
-        df_cash = pd.read_sql(query_cash, conn)
-
-        if not df_cash.empty:
-
-            df = pd.merge(df, df_cash, on=['lei', 'period'], how='left')
-
-    except:
-
-        df['cash'] = 0
-
-    
-
-    # =================================================================
-
-    # 5. CUSTOMER DEPOSITS
-
-    # =================================================================
-
-    query_deposits = f"""
-
-    SELECT lei, period, SUM(amount) as customer_deposits
-
-    FROM facts_oth
-
-    WHERE lei IN ({leis_str})
-
-      AND item_id = '2521215'
-
-      AND financial_instruments = 30
-
-      AND exposure IN (301, 401)
-
-      AND period >= '{MIN_PERIOD}'
-
-    GROUP BY lei, period
-
-    """
-
-    
-
-    try:
-
-        df_deposits = pd.read_sql(query_deposits, conn)
-
-        if not df_deposits.empty:
-
-            df = pd.merge(df, df_deposits, on=['lei', 'period'], how='left')
-
-    except:
-
-        df['customer_deposits'] = 0
-
-    
-
-    # =================================================================
-
-    # 5. WHOLESALE FUNDING (Debt Securities Issued)
-
-    # =================================================================
-
-    query_wholesale = f"""
-
-    SELECT lei, period, SUM(amount) as debt_securities_issued
-
-    FROM facts_oth
-
-    WHERE lei IN ({leis_str})
-
-      AND item_id = '2521215'
-
-      AND financial_instruments = 40
-
-      AND period >= '{MIN_PERIOD}'
-
-    GROUP BY lei, period
-
-    """
-
-    
-
-    try:
-
-        df_wholesale = pd.read_sql(query_wholesale, conn)
-
-        if not df_wholesale.empty:
-
-            df = pd.merge(df, df_wholesale, on=['lei', 'period'], how='left')
-
-    except:
-
-        df['debt_securities_issued'] = 0
-
-    
-
-    # =================================================================
-
-    # 6. ASSET QUALITY (NPL Ratio & Coverage)
-
-    # =================================================================
-
-    # Note: perf_status is numeric: 1=Performing, 2=Non-Performing
-
-    query_aq = f"""
-
-    SELECT lei, period,
-
-           SUM(CASE WHEN item_id='2520603' AND perf_status=1 THEN amount ELSE 0 END) as performing_loans,
-
-           SUM(CASE WHEN item_id='2520603' AND perf_status=2 THEN amount ELSE 0 END) as npl_amount,
-
-           SUM(CASE WHEN item_id='2520613' AND perf_status=2 THEN ABS(amount) ELSE 0 END) as npl_provisions,
-
-           SUM(CASE WHEN item_id='2520613' THEN ABS(amount) ELSE 0 END) as total_provisions
-
-    FROM facts_cre
-
-    WHERE lei IN ({leis_str})
-
-      AND item_id IN ('2520603', '2520613')
-
-      AND period >= '{MIN_PERIOD}'
-
-    GROUP BY lei, period
-
-    """
-
-    
-
-    try:
-
-        df_aq = pd.read_sql(query_aq, conn)
-
-        if not df_aq.empty:
-
-            df = pd.merge(df, df_aq, on=['lei', 'period'], how='left')
-
-    except:
-
-        df['performing_loans'] = 0
-
-        df['npl_amount'] = 0
-
-        df['npl_provisions'] = 0
-
-        df['total_provisions'] = 0
-
-    
-
-    # =================================================================
-
-    # 7. SOVEREIGN EXPOSURE
-
-    # =================================================================
-
-    # Total sovereign exposure (exclude maturity=8 aggregate bucket)
-
-    query_sov = f"""
-
-    SELECT f.lei, f.period, 
-
-           SUM(f.amount) as total_sovereign,
-
-           i.country_iso as bank_country
-
-    FROM facts_sov f
-
-    JOIN institutions i ON f.lei = i.lei
-
-    WHERE f.lei IN ({leis_str})
-
-      AND f.item_id IN ('2520812', '2520813', '2520814', '2520815')
-
-      AND f.country != 0
-
-      AND f.maturity != 8
-
-      AND f.period >= '{MIN_PERIOD}'
-
-    GROUP BY f.lei, f.period, i.country_iso
-
-    """
-
-    
-
-    try:
-
-        df_sov = pd.read_sql(query_sov, conn)
-
-        if not df_sov.empty:
-
-            df = pd.merge(df, df_sov, on=['lei', 'period'], how='left')
-
-    except:
-
-        df['total_sovereign'] = 0
-
-        df['bank_country'] = ''
-
-    
-
-    # Home country sovereign exposure  
-
-    # NOTE: Exclude maturity=8 (aggregate bucket) to avoid double counting
-
-    query_sov_home = f"""
-
-    SELECT f.lei, f.period, SUM(f.amount) as home_sovereign
-
-    FROM facts_sov f
-
-    JOIN institutions i ON f.lei = i.lei
-
-    JOIN dim_country c ON f.country = c.country
-
-    WHERE f.lei IN ({leis_str})
-
-      AND f.item_id IN ('2520812', '2520813', '2520814', '2520815')
-
-      AND c.iso_code = i.country_iso
-
-      AND f.maturity != 8
-
-      AND f.period >= '{MIN_PERIOD}'
-
-    GROUP BY f.lei, f.period
-
-    """
-
-    
-
-    try:
-
-        df_sov_home = pd.read_sql(query_sov_home, conn)
-
-        if not df_sov_home.empty:
-
-            df = pd.merge(df, df_sov_home, on=['lei', 'period'], how='left')
-
-    except:
-
-        df['home_sovereign'] = 0
-
-    
-
-    conn.close()
-
-    
-
-    # =================================================================
-
-    # CALCULATE DERIVED METRICS
-
-    # =================================================================
-
-    
-
-    # Fill NaN values
-
-    df = df.fillna(0)
-
-    
-
-    # Annualization factor
-
-    df['month'] = df['period'].apply(lambda x: int(str(x).split('-')[1]) if isinstance(x, str) else 12)
-
-    df['ann_factor'] = 12 / df['month']
-
-    
-
-    # --- P&L Metrics ---
-
-    df['Int Inc / Assets'] = df.apply(
+        df['Leverage Ratio'] = 0
 
-        lambda x: (x['Interest Income'] / x['Total Assets']) * x['ann_factor'] if x['Total Assets'] > 0 else 0, axis=1
+    
 
-    )
+    # =================================================================
 
-    
+    # 3. RWA COMPOSITION
 
-    df['Debt Sec Inc / Total Inc'] = df.apply(
+    # =================================================================
 
-        lambda x: x['Int Inc: Debt Securities'] / x['Total Operating Income'] if x['Total Operating Income'] > 0 else 0, axis=1
+    # One column per RWA dictionary label (items sharing a label are summed)
 
-    )
+    df_rwa_pivot = scan_group(df_oth, 'rwa', with_name=False)
 
     
 
-    df['Int Exp / Assets'] = df.apply(
+    if not df_rwa_pivot.empty:
 
-        lambda x: (x['Interest Expenses'] / x['Total Assets']) * x['ann_factor'] if x['Total Assets'] > 0 else 0, axis=1
+        # Merge with main df
 
-    )
+        df = pd.merge(df, df_rwa_pivot, on=['lei', 'period'], how='left')
 
     
 
-    df['NIM'] = df.apply(
+    # =================================================================
+
+    # 4. CASH DATA (for Cash/Deposits ratio)
 
-        lambda x: ((x['Interest Income'] - x['Interest Expenses']) / x['Total Assets']) * x['ann_factor'] if x['Total Assets'] > 0 else 0, axis=1
+    # =================================================================
 
-    )
+    df_balance = scan_group(df_oth, 'balance', with_name=False)
 
     
 
-    df['Cost of Deposits'] = df.apply(
+    if not df_balance.empty:
 
-        lambda x: (x['Int Exp: Deposits'] / x['customer_deposits']) * x['ann_factor'] if x.get('customer_deposits', 0) > 0 else 0, axis=1
+        df = pd.merge(df, df_balance[['lei', 'period', 'cash']], on=['lei', 'period'], how='left')
 
-    )
+    else:
 
-    
+        df['cash'] = 0
 
-    df['Cost of Wholesale'] = df.apply(
+    
 
-        lambda x: (x['Int Exp: Debt Securities'] / x['debt_securities_issued']) * x['ann_factor'] if x.get('debt_securities_issued', 0) > 0 else 0, axis=1
+    # =================================================================
 
-    )
+    # 5. CUSTOMER DEPOSITS & WHOLESALE FUNDING (Debt Securities Issued)
 
-    
+    # =================================================================
 
-    df['Funding Cost'] = df.apply(
-        lambda x: (x['Interest Expenses'] / (x['Total Assets'] - x['Total Equity'])) * x['ann_factor'] if (x['Total Assets'] - x['Total Equity']) > 0 else 0,
-        axis=1
-    )
+    df_funding = scan_group(df_oth, 'liabilities', with_name=False)
 
     
 
-    df['Net Fee Inc / Total Inc'] = df.apply(
+    if not df_funding.empty:
 
-        lambda x: x['Net Fee & Commission Income'] / x['Total Operating Income'] if x['Total Operating Income'] > 0 else 0, axis=1
-
-    )
+        df_funding = df_funding.rename(columns={
 
+            'Customer Deposits': 'customer_deposits',
 
+            'Debt Securities Issued': 'debt_securities_issued'
 
-    df['Net Fee Inc / Assets'] = df.apply(
+        })
 
-        lambda x: (x['Net Fee & Commission Income'] / x['Total Assets']) * x['ann_factor'] if x['Total Assets'] > 0 else 0, axis=1
+        df = pd.merge(df, df_funding[['lei', 'period', 'customer_deposits', 'debt_securities_issued']], on=['lei', 'period'], how='left')
 
-    )
+    else:
 
-    
+        df['customer_deposits'] = 0
 
-    df['Gains / Losses'] = df['Trading Income'] + df['FX Income']
+        df['debt_securities_issued'] = 0
 
     
 
-    df['Operating Expenses'] = df['Admin Expenses'] + df['Depreciation']
+    # =================================================================
 
-    
+    # 6. ASSET QUALITY (NPL Ratio & Coverage)
 
-    df['Cost / Income'] = df.apply(
+    # =================================================================
 
-        lambda x: x['Operating Expenses'] / x['Total Operating Income'] if x['Total Operating Income'] > 0 else 0, axis=1
+    # Note: perf_status is numeric: 1=Performing, 2=Non-Performing
 
-    )
+    df_cre = scans['facts_cre']
 
     
 
-    df['Admin / Total Exp'] = df.apply(
+    if not df_cre.empty:
 
-        lambda x: x['Admin Expenses'] / x['Operating Expenses'] if x['Operating Expenses'] > 0 else 0, axis=1
+        status = pd.to_numeric(df_cre['perf_status'], errors='coerce')
 
-    )
-
-    
+        is_exp = df_cre['item_id'] == '2520603'
 
-    df['Depr / Total Exp'] = df.apply(
+        is_prov = df_cre['item_id'] == '2520613'
 
-        lambda x: x['Depreciation'] / x['Operating Expenses'] if x['Operating Expenses'] > 0 else 0, axis=1
+        df_aq = pd.DataFrame({
 
-    )
+            'lei': df_cre['lei'],
 
-    
+            'period': df_cre['period'],
 
-    df['Cost of Risk'] = df.apply(
+            'performing_loans': df_cre['amount'].where(is_exp & (status == 1), 0),
 
-        lambda x: (x['Impairment Cost'] / x['Total Assets']) * x['ann_factor'] if x['Total Assets'] > 0 else 0, axis=1
+            'npl_amount': df_cre['amount'].where(is_exp & (status == 2), 0),
 
-    )
+            'npl_provisions': df_cre['abs_amount'].where(is_prov & (status == 2), 0),
 
-    
+            'total_provisions': df_cre['abs_amount'].where(is_prov, 0),
 
-    df['RoA'] = df.apply(
+        })[is_exp | is_prov].groupby(['lei', 'period'], as_index=False).sum()
 
-        lambda x: (x['Net Profit'] / x['Total Assets']) * x['ann_factor'] if x['Total Assets'] > 0 else 0, axis=1
+        df = pd.merge(df, df_aq, on=['lei', 'period'], how='left')
 
-    )
+    else:
 
-    
+        df['performing_loans'] = 0
 
-    df['RoRWA'] = df.apply(
+        df['npl_amount'] = 0
 
-        lambda x: (x['Net Profit'] / x['TREA']) * x['ann_factor'] if x.get('TREA', 0) > 0 else 0, axis=1
+        df['npl_provisions'] = 0
 
-    )
+        df['total_provisions'] = 0
 
     
 
-    df['RoE'] = df.apply(
-
-        lambda x: (x['Net Profit'] / x['Total Equity']) * x['ann_factor'] if x['Total Equity'] > 0 else 0, axis=1
-
-    )
-
-    
+    # =================================================================
 
-    # --- Capital Metrics ---
+    # 7. SOVEREIGN EXPOSURE
 
-    df['Tier 1 Ratio'] = df.apply(
+    # =================================================================
 
-        lambda x: (x.get('CET1 Capital', 0) + x.get('AT1 Capital', 0)) / x['TREA'] if x.get('TREA', 0) > 0 else 0, axis=1
+    # Total (excl. country 0) and home-country exposure, maturity=8 aggregate bucket excluded
 
-    )
+    df_sov = scans['facts_sov']
 
     
 
-    df['RWA Density'] = df.apply(
+    if not df_sov.empty:
 
-        lambda x: x.get('TREA', 0) / x['Total Assets'] if x['Total Assets'] > 0 and x.get('TREA', 0) > 0 else 0, axis=1
+        df = pd.merge(df, df_sov[['lei', 'period', 'total_sovereign', 'bank_country', 'home_sovereign']], on=['lei', 'period'], how='left')
 
-    )
+    else:
 
-    
+        df['total_sovereign'] = 0
 
-    # RWA composition ratios
+        df['bank_country'] = ''
 
-    trea_col = 'TREA' if 'TREA' in df.columns else 'Total Risk exposure amount'
+        df['home_sovereign'] = 0
 
     
 
-    # Map RWA component columns
-
-    rwa_mappings = {
+    
 
-        'Credit RWA / Total': 'Credit risk (excluding CCR and Securitisations)',
+    # =================================================================
 
-        'Market RWA / Total': 'Position, foreign exchange and commodities risks (Market risk)',
+    # CALCULATE DERIVED METRICS
 
-        'Op RWA / Total': 'Operational risk',
+    # =================================================================
 
-        'IRB RWA / Total': ['Credit risk (excluding CCR and Securitisations): Of which the foundation IRB (FIRB) approach',
+    
 
-                           'Credit risk (excluding CCR and Securitisations): Of which the advanced IRB (AIRB) approach']
+    # Fill NaN values
 
-    }
+    df = df.fillna(0)
 
     
 
-    for ratio_name, source_cols in rwa_mappings.items():
-
-        if isinstance(source_cols, list):
-
-            # Sum multiple columns
+    # Annualization factor
 
-            df[ratio_name] = 0
+    add_annualization(df)
 
-            for col in source_cols:
+    
 
-                if col in df.columns:
+    # --- Derived metrics (data/metrics.py registry) ---
 
-                    df[ratio_name] += df[col].fillna(0)
+    # Returns, margins and costs are reported annualized here
 
-        else:
+    evaluate_metrics(df, {
 
-            if source_cols in df.columns:
+        # P&L
 
-                df[ratio_name] = df[source_cols].fillna(0)
+        'Int Inc / Assets': 'Int Inc / Assets',
 
-            else:
+        'Debt Sec Inc / Total Inc': 'Debt Sec Inc / Total Inc',
 
-                df[ratio_name] = 0
+        'Int Exp / Assets': 'Int Exp / Assets',
 
-        
+        'NIM': 'NIM (Annualized)',
 
-        # Convert to ratio
+        'Cost of Deposits': 'Cost of Deposits',
 
-        df[ratio_name] = df.apply(
+        'Cost of Wholesale': 'Cost of Wholesale',
 
-            lambda x: x[ratio_name] / x[trea_col] if x.get(trea_col, 0) > 0 else 0, axis=1
+        'Funding Cost': 'Funding Cost',
 
-        )
+        'Net Fee Inc / Total Inc': 'Net Fee Inc / Total Inc',
 
-    
+        'Net Fee Inc / Assets': 'Net Fees / Assets (Annualized)',
 
-    # --- Liquidity Metrics ---
+        'Gains / Losses': 'Net Trading Income',
 
-    df['Cash / Deposits'] = df.apply(
+        'Operating Expenses': 'Operating Expenses',
 
-        lambda x: x.get('cash', 0) / x.get('customer_deposits', 0) if x.get('customer_deposits', 0) > 0 else 0, axis=1
+        'Cost / Income': 'Cost to Income',
 
-    )
+        'Admin / Total Exp': 'Admin / Total Exp',
 
-    
+        'Depr / Total Exp': 'Depr / Total Exp',
 
-    # --- Credit / Asset Quality Metrics ---
+        'Cost of Risk': 'Cost of Risk (Annualized)',
 
-    df['NPE Ratio'] = df.apply(
+        'RoA': 'RoA (Annualized)',
 
-        lambda x: x.get('npl_amount', 0) / (x.get('performing_loans', 0) + x.get('npl_amount', 0)) 
+        'RoRWA': 'RoRWA (Annualized)',
 
-        if (x.get('performing_loans', 0) + x.get('npl_amount', 0)) > 0 else 0, axis=1
+        'RoE': 'RoE (Annualized)',
 
-    )
+        # Capital
 
-    
+        'Tier 1 Ratio': 'Tier 1 Ratio',
 
-    # NPL Coverage Ratio = NPL Provisions / NPL Amount
+        'RWA Density': 'RWA Density',
 
-    df['NPL Coverage'] = df.apply(
+        # Liquidity
 
-        lambda x: x.get('npl_provisions', 0) / x.get('npl_amount', 0) 
+        'Cash / Deposits': 'Cash / Deposits',
 
-        if x.get('npl_amount', 0) > 0 else 0, axis=1
+        # Credit / Asset Quality
 
-    )
+        'NPE Ratio': 'NPE Ratio',
 
-    
+        'NPL Coverage': 'NPL Coverage',
 
-    # Total Coverage = Total Provisions / Total Gross Loans
+        'Total Coverage': 'Total Coverage',
 
-    df['Total Coverage'] = df.apply(
+        # Concentration
 
-        lambda x: x.get('total_provisions', 0) / (x.get('performing_loans', 0) + x.get('npl_amount', 0))
+        'Sovereign / CET1': 'Sovereign / CET1',
 
-        if (x.get('performing_loans', 0) + x.get('npl_amount', 0)) > 0 else 0, axis=1
+        'Home Bias Ratio': 'Home Bias Ratio',
 
-    )
+    }, aliases={'Customer Deposits': 'customer_deposits', 'Debt Securities Issued': 'debt_securities_issued'})
 
     
 
-    df['Sovereign / CET1'] = df.apply(
-
-        lambda x: x.get('total_sovereign', 0) / x.get('CET1 Capital', 0) if x.get('CET1 Capital', 0) > 0 else 0, axis=1
+    # RWA composition ratios
 
-    )
+    trea_col = 'TREA' if 'TREA' in df.columns else 'Total Risk exposure amount'
 
-    
+    evaluate_metrics(df, ['Credit RWA / Total', 'Market RWA / Total', 'Op RWA / Total', 'IRB RWA / Total'],
 
-    df['Home Bias Ratio'] = df.apply(
+                     aliases={'TREA': trea_col})
 
-        lambda x: x.get('home_sovereign', 0) / x.get('CET1 Capital', 0) if x.get('CET1 Capital', 0) > 0 else 0, axis=1
 
-    )
 
     
 
@@ -1083,19 +539,15 @@ def get_all_benchmarking_metrics(lei_list):
 
     # =================================================================
 
-    from .solvency import get_solvency_with_texas_ratio
-
-    from .asset_quality import get_aq_breakdown
+    # Module KPIs computed from the same scans instead of re-querying
 
-    from .assets import get_assets_kpis
-
-    from .liabilities import get_liabilities_kpis, get_deposit_beta
+    kpis = compute_scan_kpis(scans)
 
     
 
     # 1. Solvency (Texas Ratio)
 
-    df_texas = get_solvency_with_texas_ratio(lei_list)
+    df_texas = kpis['solvency']
 
     if not df_texas.empty and 'Texas Ratio' in df_texas.columns:
 
@@ -1105,7 +557,7 @@ def get_all_benchmarking_metrics(lei_list):
 
     # 2. Asset Quality (Forborne Ratio)
 
-    df_aq = get_aq_breakdown(lei_list)
+    df_aq = kpis['aq_breakdown']
 
     if not df_aq.empty and 'Forborne Ratio' in df_aq.columns:
 
@@ -1115,7 +567,7 @@ def get_all_benchmarking_metrics(lei_list):
 
     # 3. Balance Sheet (Loans/Assets, Sec/Assets, Cash/Assets)
 
-    df_assets = get_assets_kpis(lei_list)
+    df_assets = kpis['assets']
 
     if not df_assets.empty:
 
@@ -1131,7 +583,7 @@ def get_all_benchmarking_metrics(lei_list):
 
     # 4. Funding / Liabilities
 
-    df_liab = get_liabilities_kpis(lei_list)
+    df_liab = kpis['liabilities']
 
     if not df_liab.empty:
 
@@ -1145,9 +597,7 @@ def get_all_benchmarking_metrics(lei_list):
 
     # 5. Liquidity (LDR) - Use existing 'loans' and 'customer_deposits' if available, or fetch from liquidity
 
-    from .liquidity import get_liquidity_kpis
-
-    df_liq = get_liquidity_kpis(lei_list)
+    df_liq = kpis['liquidity']
 
     if not df_liq.empty and 'LDR' in df_liq.columns:
 
@@ -1157,7 +607,7 @@ def get_all_benchmarking_metrics(lei_list):
 
     # 6. Cumulative Deposit Beta
 
-    df_beta = get_deposit_beta(lei_list)
+    df_beta = kpis['deposit_beta']
 
     if not df_beta.empty and 'cumulative_beta' in df_beta.columns:
 
@@ -1335,229 +785,335 @@ def calculate_percentiles(base_value, peer_values, higher_is_better=True):
 
 
 
-@st.cache_data
+def _report_metrics():
 
-def get_benchmarking_report(base_lei, country_iso, region, systemic_importance, size_category=None):
+    """BENCHMARKING_METRICS flattened to (section, column, label, higher_is_better)."""
 
-    """
+    return [
 
-    Generate the complete benchmarking report.
+        (section, col, label, higher_is_better)
 
-    
+        for section, metrics in BENCHMARKING_METRICS.items()
 
-    Returns:
+        for col, label, higher_is_better in metrics
+
+    ]
 
-    - report_df: DataFrame with metrics, base value, peer averages, and percentiles
 
-    - latest_period: The period used for the report
+
+
+
+def build_report_rows(base_values, group_names, averages, percentiles):
 
     """
 
-    # Get peer groups with size-based filtering
+    Report rows for BENCHMARKING_METRICS: a header per section, then per metric
 
-    groups = get_benchmarking_peer_groups(country_iso, region, systemic_importance, size_category)
+    the base value and each group's average and percentile.
 
-    
+    base_values is indexed [metric], averages and percentiles [group, metric];
 
-    # Get all LEIs (base + all peers)
+    NaN averages / percentiles (no peer data) become None.
 
-    all_leis = set([base_lei])
+    """
 
-    for leis in groups.values():
+    report_data = []
 
-        all_leis.update(leis)
+    current_section = None
 
     
 
-    # Fetch all metrics for all banks
+    for j, (section, col, label, higher_is_better) in enumerate(_report_metrics()):
 
-    df_all = get_all_benchmarking_metrics(list(all_leis))
+        if section != current_section:
 
-    
+            current_section = section
 
-    if df_all.empty:
+            # Add section header
 
-        return pd.DataFrame(), None
+            report_data.append({
 
-    
+                'Section': section,
 
-    # Get latest period
+                'Metric': f"**{section}**",
 
-    latest_period = df_all['period'].max()
+                'Base Value': None,
 
-    df_latest = df_all[df_all['period'] == latest_period].copy()
+                'Domestic Avg': None, 'Dom Pctl': None,
 
-    
+                'Regional (Same Size)': None, 'Reg Pctl': None,
 
-    # Get base bank data
+                'EU (Same Size)': None, 'EU Pctl': None,
 
-    df_base = df_latest[df_latest['lei'] == base_lei]
+                'EU Large': None, 'EU Large Pctl': None,
 
-    if df_base.empty:
+                'is_header': True
 
-        return pd.DataFrame(), latest_period
+            })
 
-    
+        
 
-    base_row = df_base.iloc[0]
+        row_data = {
 
-    base_name = base_row.get('name', 'Base Bank')
+            'Section': section,
 
-    
+            'Metric': label,
 
-    # Build report data
+            'Base Value': base_values[j],
 
-    report_data = []
+            'is_header': False
+
+        }
+
+        
+
+        for g, group_name in enumerate(group_names):
+
+            avg_val = averages[g][j]
+
+            percentile = percentiles[g][j]
+
+            row_data[group_name] = None if pd.isna(avg_val) else avg_val
+
+            row_data[PEER_GROUP_COLUMNS.get(group_name, f'{group_name} Pctl')] = None if pd.isna(percentile) else percentile
+
+        
+
+        report_data.append(row_data)
 
     
 
-    for section, metrics in BENCHMARKING_METRICS.items():
+    return pd.DataFrame(report_data)
+
 
-        # Add section header
 
-        report_data.append({
 
-            'Section': section,
 
-            'Metric': f"**{section}**",
+def compute_percentile_cube(df_all, df_inst):
 
-            'Base Value': None,
+    """
 
-            'Domestic Avg': None, 'Dom Pctl': None,
+    Report values for every bank and period of `df_all` (benchmarking metrics),
 
-            'Regional (Same Size)': None, 'Reg Pctl': None,
+    each bank ranked within its own peer groups (institution attributes from
 
-            'EU (Same Size)': None, 'EU Pctl': None,
+    `df_inst`: lei, country_iso, region, size_category).
 
-            'EU Large': None, 'EU Large Pctl': None,
+    One row per (lei, period, metric) with the base value and every group's
 
-            'is_header': True
+    average and percentile, keyed by peer_group_key().
 
-        })
+    """
+
+    metric_list = _report_metrics()
+
+    columns = [m[1] for m in metric_list]
+
+    directions = [m[3] for m in metric_list]
+
+    missing = np.array([col not in df_all.columns for col in columns])
+
+    names = df_all.drop_duplicates('lei').set_index('lei')['name'] if 'name' in df_all.columns else pd.Series(dtype=object)
+
+    index = PeerIndex(df_inst)
+
+    
+
+    frames = []
+
+    for period, df_period in df_all.groupby('period'):
+
+        df_period = df_period.reset_index(drop=True)
+
+        banks = df_inst[df_inst['lei'].isin(df_period['lei'])]
 
         
 
-        for col, label, higher_is_better in metrics:
+        # Banks with the same attributes share their peer groups: rank them together
+
+        for (country_iso, region, size_category), df_key in banks.groupby(['country_iso', 'region', 'size_category'], dropna=False):
+
+            size_category = None if pd.isna(size_category) else size_category
+
+            groups = benchmark_groups(index, country_iso, region, size_category)
 
-            base_val = base_row.get(col, 0) if col in base_row.index else 0
+            base_leis = df_key['lei'].tolist()
+
+            group_names, averages, base_values, percentiles = rank_against_peers(
+
+                df_period, columns, directions, groups, base_leis, index=index
+
+            )
 
             
 
-            row_data = {
+            # Base value as base_row.get(col, 0): 0 for metrics missing from the frame
 
-                'Section': section,
+            base_values[:, missing] = 0
 
-                'Metric': label,
+            n_banks, n_metrics = base_values.shape
 
-                'Base Value': base_val,
+            frame = pd.DataFrame({
 
-                'is_header': False
+                'lei': np.repeat(base_leis, n_metrics),
 
-            }
+                'period': period,
 
-            
+                'peer_key': peer_group_key(country_iso, region, size_category),
+
+                'metric': np.tile(columns, n_banks),
+
+                'Base Value': base_values.ravel(),
+
+            })
+
+            for g, group_name in enumerate(group_names):
+
+                frame[group_name] = np.tile(averages[g], n_banks)
+
+                frame[PEER_GROUP_COLUMNS.get(group_name, f'{group_name} Pctl')] = percentiles[:, g, :].ravel()
+
+            frames.append(frame)
+
+    
+
+    if not frames:
+
+        return pd.DataFrame()
+
+    df_cube = pd.concat(frames, ignore_index=True)
+
+    df_cube.insert(1, 'name', df_cube['lei'].map(names))
+
+    return df_cube
 
-            # Calculate averages and percentiles for each peer group
 
-            for group_name, group_leis in groups.items():
 
-                if not group_leis:
 
-                    row_data[group_name] = None
 
-                    row_data[f'{group_name} Pctl'] = None
+@versioned_cache(*MART_SOURCE_TABLES, MART_TABLE, PERCENTILES_TABLE)
 
-                    continue
+def get_benchmarking_report(base_lei, country_iso, region, systemic_importance, size_category=None, period=None):
 
-                
+    """
+
+    Generate the complete benchmarking report.
 
-                # Get peer data
+    
 
-                df_peers = df_latest[df_latest['lei'].isin(group_leis)]
+    Served from the precomputed mart_percentiles table while it is fresh,
 
-                
+    otherwise ranked live. `period` defaults to the latest period of the
 
-                if df_peers.empty or col not in df_peers.columns:
+    base bank and its peers.
 
-                    row_data[group_name] = None
+    
 
-                    row_data[f'{group_name} Pctl'] = None
+    Returns:
 
-                    continue
+    - report_df: DataFrame with metrics, base value, peer averages, and percentiles
 
-                
+    - latest_period: The period used for the report
 
-                peer_values = df_peers[col].dropna().tolist()
+    """
 
-                
+    # Get peer groups with size-based filtering
 
-                if not peer_values:
+    groups = get_benchmarking_peer_groups(country_iso, region, systemic_importance, size_category)
 
-                    row_data[group_name] = None
+    
 
-                    row_data[f'{group_name} Pctl'] = None
+    # Get all LEIs (base + all peers)
 
-                    continue
+    all_leis = set([base_lei])
 
-                
+    for leis in groups.values():
 
-                # Weighted average (by Total Assets if available)
+        all_leis.update(leis)
 
-                if 'Total Assets' in df_peers.columns:
+    
 
-                    weights = df_peers['Total Assets'].fillna(1)
+    # Precomputed: one indexed lookup of the base bank's rows
 
-                    valid_mask = df_peers[col].notna()
+    cube = get_mart_percentiles(base_lei, list(all_leis), peer_group_key(country_iso, region, size_category), period)
 
-                    if valid_mask.sum() > 0 and weights[valid_mask].sum() > 0:
+    if cube is not None:
 
-                        avg_val = (df_peers.loc[valid_mask, col] * weights[valid_mask]).sum() / weights[valid_mask].sum()
+        df_cube, latest_period = cube
 
-                    else:
+        df_cube = df_cube.drop_duplicates('metric').set_index('metric')
 
-                        avg_val = np.mean(peer_values)
+        columns = [m[1] for m in _report_metrics()]
 
-                else:
+        group_names = [g for g in groups if g in df_cube.columns]
 
-                    avg_val = np.mean(peer_values)
+        report_df = build_report_rows(
 
-                
+            df_cube['Base Value'].reindex(columns).tolist(),
 
-                # Calculate percentile (bank's rank position within peer group)
+            group_names,
 
-                percentile = calculate_percentiles(base_val, peer_values, higher_is_better)
+            [df_cube[g].reindex(columns).tolist() for g in group_names],
 
-                
+            [df_cube[PEER_GROUP_COLUMNS.get(g, f'{g} Pctl')].reindex(columns).tolist() for g in group_names],
 
-                # Column prefix for percentile column
+        )
 
-                pctl_prefix_map = {
+        return report_df, latest_period, df_cube['name'].iloc[0]
 
-                    'Domestic Avg': 'Dom',
+    
 
-                    'Regional (Same Size)': 'Reg',
+    # Fetch all metrics for all banks
 
-                    'EU (Same Size)': 'EU',
+    df_all = get_all_benchmarking_metrics(list(all_leis))
 
-                    'EU Large': 'EU Large'
+    
 
-                }
+    if df_all.empty:
 
-                col_prefix = pctl_prefix_map.get(group_name, group_name)
+        return pd.DataFrame(), None
 
-                
+    
 
-                row_data[group_name] = avg_val
+    # Get latest period
 
-                row_data[f'{col_prefix} Pctl'] = percentile
+    latest_period = period or df_all['period'].max()
 
-            
+    df_latest = df_all[df_all['period'] == latest_period].copy()
 
-            report_data.append(row_data)
+    
+
+    # Get base bank data
+
+    df_base = df_latest[df_latest['lei'] == base_lei]
+
+    if df_base.empty:
+
+        return pd.DataFrame(), latest_period
+
+    
+
+    base_row = df_base.iloc[0]
+
+    base_name = base_row.get('name', 'Base Bank')
 
     
 
-    report_df = pd.DataFrame(report_data)
+    # Rank the base bank against every peer group on every metric in one pass
+
+    metric_list = _report_metrics()
+
+    group_names, averages, _, percentiles = rank_against_peers(
+
+        df_latest, [m[1] for m in metric_list], [m[3] for m in metric_list], groups, [base_lei]
+
+    )
+
+    base_values = [base_row.get(col, 0) if col in base_row.index else 0 for _, col, _, _ in metric_list]
+
+    report_df = build_report_rows(base_values, group_names, averages, percentiles[0])
+
+    
 
     return report_df, latest_period, base_name
 
@@ -1566,7 +1122,7 @@ def get_benchmarking_report(base_lei, country_iso, region, systemic_importance,
 
 
 
-@st.cache_data
+@versioned_cache(*MART_SOURCE_TABLES, MART_TABLE)
 def get_underlying_bank_data(country_iso, region, systemic_importance, size_category=None):
     """
     Returns raw data for all banks in all peer groups for download.
@@ -1623,51 +1179,23 @@ def get_custom_metric_data(item_ids, item_labels, lei_list):
     if not lei_list or not os.path.exists(DB_NAME):
         return pd.DataFrame()
     
-    conn = sqlite3.connect(DB_NAME)
-    leis_str = "'" + "','".join([str(lei) for lei in lei_list]) + "'"
-    
     # Handle single item case (convert to list)
     if isinstance(item_ids, str):
         item_ids = [item_ids]
     if isinstance(item_labels, str):
         item_labels = [item_labels]
-        
-    item_ids_str = "'" + "','".join([str(itm) for itm in item_ids]) + "'"
     
-    # Map item_id to label for easy renaming later
+    # Map item_id to label; the engine returns one column per label
     id_to_label = dict(zip(item_ids, item_labels))
     
     # We aggregate (SUM) over all dimensions for simplicity in this explorer
-    query = f"""
-    SELECT f.lei, COALESCE(i.short_name, i.commercial_name) as name, f.period, f.item_id, SUM(f.amount) as value
-    FROM facts_oth f
-    JOIN institutions i ON f.lei = i.lei
-    WHERE f.lei IN ({leis_str})
-      AND f.item_id IN ({item_ids_str})
-      AND f.period >= '{MIN_PERIOD}'
-    GROUP BY f.lei, f.period, f.item_id
-    """
-    
     try:
-        df = pd.read_sql(query, conn)
+        df_pivot = read_wide('facts_oth', id_to_label, lei_list)
     except:
-        conn.close()
         return pd.DataFrame()
         
-    if df.empty:
-        conn.close()
+    if df_pivot.empty:
         return pd.DataFrame()
-
-    # Pivot to wide format: One column per item
-    df_pivot = df.pivot_table(
-        index=['lei', 'name', 'period'],
-        columns='item_id',
-        values='value',
-        aggfunc='sum'
-    ).reset_index()
-    
-    # Rename columns using provided labels
-    df_pivot.rename(columns=id_to_label, inplace=True)
     
     # Ensure all requested columns exist (fill with 0 if missing)
     for lbl in item_labels:
@@ -1678,13 +1206,13 @@ def get_custom_metric_data(item_ids, item_labels, lei_list):
     query_assets = f"""
     SELECT lei, period, SUM(amount) as assets
     FROM facts_oth
-    WHERE lei IN ({leis_str})
+    WHERE lei IN {LEI_SET}
       AND item_id = '2521010'
       AND period >= '{MIN_PERIOD}'
     GROUP BY lei, period
     """
     try:
-        df_assets = pd.read_sql(query_assets, conn)
+        df_assets = read_sql(query_assets, leis=lei_list)
         # Rename assets to prevent collision if 'Total Assets' is one of the selected items
         if 'assets' in df_pivot.columns:
             # This shouldn't happen unless user selected it, but just safely merge
@@ -1696,13 +1224,12 @@ def get_custom_metric_data(item_ids, item_labels, lei_list):
     except:
         df_pivot['Total Assets (Normalization)'] = 1
         
-    conn.close()
     return df_pivot
 
 
 
 
-@st.cache_data
+@versioned_cache('dictionary', 'facts_oth')
 def get_available_metrics_for_explorer():
     """
     Returns a DataFrame of available metrics from dictionary for the explorer.
@@ -1710,16 +1237,15 @@ def get_available_metrics_for_explorer():
     if not os.path.exists(DB_NAME):
         return pd.DataFrame()
     
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     query = """
     SELECT item_id, label, category 
-    FROM dictionary 
-    WHERE item_id IN (SELECT DISTINCT item_id FROM facts_oth)
+    FROM dictionary d
+    WHERE EXISTS (SELECT 1 FROM facts_oth f WHERE f.item_id = d.item_id)
     ORDER BY category, label
     """
     try:
         df = pd.read_sql(query, conn)
     except:
         df = pd.DataFrame()
-    conn.close()
     return df
@@ -0,0 +1,154 @@
+"""
+Cache backends for the data layer.
+
+Data functions are decorated with versions.versioned_cache(); which cache
+keeps their results inside the process is chosen here, at their first call,
+so `import eba_benchmarking.data` does not import Streamlit:
+
+- 'streamlit': st.cache_data (one per server process, shared by sessions)
+- 'memory': an LRU dict per function, for batch jobs, process pools and tests
+- 'disk': no in-process tier, only the disk cache (see disk_cache.py)
+- 'none': no caching at all
+- 'auto' (CACHE_BACKEND default): 'streamlit' inside a running Streamlit
+  app, else 'memory'
+
+With 'streamlit' and 'memory', a miss is looked up in the disk cache (when
+DISK_CACHE_ENABLED) before the function runs.
+
+    EBA_CACHE_BACKEND=memory python my_batch_job.py
+    set_cache_backend('none')   # e.g. before timing cold runs
+"""
+import copy
+import time
+import threading
+from collections import OrderedDict
+from functools import wraps
+from ..config import CACHE_BACKEND, MEMORY_CACHE_MAX_ENTRIES
+from .peer_set import PeerSet, peer_set_digest
+from .disk_cache import make_key, ttl_seconds
+from .notify import streamlit_running
+
+CACHE_BACKENDS = ('auto', 'streamlit', 'memory', 'disk', 'none')
+
+_backend = {'name': CACHE_BACKEND, 'instance': None}
+_backend_lock = threading.Lock()
+
+
+class NullBackend:
+    """No in-process tier: every call reaches the disk cache (`disk`) or the function."""
+
+    def __init__(self, name='none', disk=False):
+        self.name = name
+        self.disk = disk
+
+    def wrap(self, keyed, **cache_kwargs):
+        @wraps(keyed)
+        def cached(*args, **kwargs):
+            return keyed(*args, **kwargs)
+        cached.clear = lambda: None
+        return cached
+
+    def clear_all(self):
+        pass
+
+
+class MemoryBackend:
+    """
+    One LRU dict per function (max_entries, default MEMORY_CACHE_MAX_ENTRIES,
+    and ttl as in st.cache_data). Hits return a copy, as st.cache_data does,
+    so callers may modify the frames they get.
+    """
+    name = 'memory'
+    disk = True
+
+    def __init__(self, max_entries=MEMORY_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._stores = []
+
+    def wrap(self, keyed, ttl=None, max_entries=None, **cache_kwargs):
+        store = OrderedDict()
+        lock = threading.Lock()
+        limit = max_entries or self.max_entries
+        ttl = ttl_seconds(ttl)
+        name = f"{keyed.__module__}.{keyed.__qualname__}"
+
+        @wraps(keyed)
+        def cached(*args, **kwargs):
+            key = make_key(name, (), args, kwargs)
+            now = time.time()
+            with lock:
+                entry = store.get(key)
+                if entry is not None and (entry[0] is None or entry[0] > now):
+                    store.move_to_end(key)
+                    return copy.deepcopy(entry[1])
+            value = keyed(*args, **kwargs)
+            with lock:
+                store[key] = (now + ttl if ttl is not None else None, value)
+                store.move_to_end(key)
+                while len(store) > limit:
+                    store.popitem(last=False)
+            return copy.deepcopy(value)
+
+        def clear():
+            with lock:
+                store.clear()
+
+        cached.clear = clear
+        self._stores.append(clear)
+        return cached
+
+    def clear_all(self):
+        for clear in self._stores:
+            clear()
+
+
+class StreamlitBackend:
+    """st.cache_data, with PeerSet arguments hashed by digest."""
+    name = 'streamlit'
+    disk = True
+
+    def __init__(self):
+        import streamlit as st
+        self.st = st
+
+    def wrap(self, keyed, hash_funcs=None, **cache_kwargs):
+        hash_funcs = {PeerSet: peer_set_digest, **(hash_funcs or {})}
+        return self.st.cache_data(hash_funcs=hash_funcs, **cache_kwargs)(keyed)
+
+    def clear_all(self):
+        self.st.cache_data.clear()
+
+
+def _make_backend(name):
+    if name == 'auto':
+        name = 'streamlit' if streamlit_running() is not None else 'memory'
+    if name == 'streamlit':
+        return StreamlitBackend()
+    if name == 'memory':
+        return MemoryBackend()
+    if name in ('disk', 'none'):
+        return NullBackend(name, disk=(name == 'disk'))
+    raise ValueError(f"Unknown cache backend '{name}', expected one of {CACHE_BACKENDS}")
+
+
+def cache_backend():
+    """The process-wide backend, created on first use."""
+    with _backend_lock:
+        if _backend['instance'] is None:
+            _backend['instance'] = _make_backend(_backend['name'])
+        return _backend['instance']
+
+
+def set_cache_backend(name):
+    """Switches the backend; data functions re-wrap on their next call."""
+    backend = _make_backend(name)
+    with _backend_lock:
+        _backend['name'] = name
+        _backend['instance'] = backend
+
+
+def clear_caches():
+    """Empties the in-process cache of every data function and the KPI supersets (not the disk cache)."""
+    from .superset import clear_supersets
+    cache_backend().clear_all()
+    clear_supersets()
@@ -0,0 +1,83 @@
+"""
+Shared SQLite connection provider for the data layer.
+
+Each thread gets one read-only connection to DB_NAME that is reused across
+calls, instead of every data function opening and closing its own.
+"""
+import sqlite3
+import threading
+import pathlib
+from contextlib import contextmanager
+from ..config import DB_NAME, DB_READ_PRAGMAS, DB_STATEMENT_CACHE_SIZE
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_stats = {'opened': 0, 'reused': 0, 'closed': 0}
+
+
+def _open_connection():
+    """Opens a read-only URI connection and applies the tuned PRAGMAs."""
+    uri = f"{pathlib.Path(DB_NAME).as_uri()}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, cached_statements=DB_STATEMENT_CACHE_SIZE)
+    for pragma, value in DB_READ_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    return conn
+
+
+def get_connection():
+    """
+    Returns the calling thread's pooled read-only connection, opening it on first use.
+    Callers must not close it; use close_connection() to drop it explicitly.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        with _stats_lock:
+            _stats['reused'] += 1
+        return conn
+
+    conn = _open_connection()
+    _local.conn = conn
+    with _stats_lock:
+        _stats['opened'] += 1
+    return conn
+
+
+def close_connection():
+    """Closes the calling thread's pooled connection (if any)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        return
+    conn.close()
+    _local.conn = None
+    with _stats_lock:
+        _stats['closed'] += 1
+
+
+@contextmanager
+def trace_statements():
+    """
+    Collects the SQL the calling thread's connection executes while active,
+    with bound parameters inlined (as SQLite expands them for tracing).
+    """
+    conn = get_connection()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        yield statements
+    finally:
+        conn.set_trace_callback(None)
+
+
+def get_connection_stats():
+    """
+    Returns connection pool counters:
+    - opened: connections created
+    - reused: get_connection() calls served by an existing connection
+    - closed: connections explicitly closed
+    - reuse_ratio: reused / (opened + reused)
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    total = stats['opened'] + stats['reused']
+    stats['reuse_ratio'] = stats['reused'] / total if total else 0.0
+    return stats
@@ -1,11 +1,13 @@
 import pandas as pd
-import sqlite3
 import os
-import streamlit as st
 from ..config import DB_NAME
+from .connection import get_connection
+from .query import LEI_SET, json_set, read_sql
 from .base import MIN_PERIOD
+from .notify import notify_error
+from .versions import versioned_cache, DIMENSION_TABLES
 
-@st.cache_data
+@versioned_cache('facts_cre')
 def get_cre_filter_options(lei_list):
     """
     Fetches distinct values for filterable columns in facts_cre for the selected LEIs.
@@ -15,9 +17,6 @@ def get_cre_filter_options(lei_list):
     if not lei_list or not os.path.exists(DB_NAME):
         return {}
 
-    conn = sqlite3.connect(DB_NAME)
-    leis_str = "'" + "','".join([str(lei) for lei in lei_list]) + "'"
-    
     # Columns in facts_cre
     filter_cols = [
         'portfolio', 
@@ -36,22 +35,20 @@ def get_cre_filter_options(lei_list):
             query = f"""
             SELECT DISTINCT {col} 
             FROM facts_cre 
-            WHERE lei IN ({leis_str}) 
+            WHERE lei IN {LEI_SET} 
             AND {col} IS NOT NULL 
             ORDER BY {col}
             """
-            df_col = pd.read_sql(query, conn)
+            df_col = read_sql(query, leis=lei_list)
             # Ensure we return strings to match filter keys
             options[col] = [str(x) for x in df_col[col].tolist()]
             
     except Exception as e:
-        st.error(f"Error fetching filter options: {e}")
-    finally:
-        conn.close()
+        notify_error(f"Error fetching filter options: {e}")
         
     return options
 
-@st.cache_data
+@versioned_cache(*DIMENSION_TABLES)
 def get_dim_maps():
     """
     Fetches all relevant dimension mappings (id -> label).
@@ -61,7 +58,7 @@ def get_dim_maps():
     if not os.path.exists(DB_NAME):
         return {}
     
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     maps = {}
     
     # Define mapping: fact_column -> (dim_table, id_col, label_col)
@@ -85,13 +82,11 @@ def get_dim_maps():
                 maps[key] = {}
         
     except Exception as e:
-        st.error(f"Error fetching dimension maps: {e}")
-    finally:
-        conn.close()
+        notify_error(f"Error fetching dimension maps: {e}")
 
     return maps
 
-@st.cache_data
+@versioned_cache('facts_cre', 'institutions', 'dictionary', *DIMENSION_TABLES)
 def get_cre_data(lei_list, filters=None):
     """
     Fetches data from facts_cre based on selected LEIs and filters.
@@ -100,11 +95,9 @@ def get_cre_data(lei_list, filters=None):
     if not lei_list or not os.path.exists(DB_NAME):
         return pd.DataFrame()
 
-    conn = sqlite3.connect(DB_NAME)
-    leis_str = "'" + "','".join([str(lei) for lei in lei_list]) + "'"
-    
-    where_clauses = [f"f.lei IN ({leis_str})"]
+    where_clauses = [f"f.lei IN {LEI_SET}"]
     where_clauses.append(f"f.period >= '{MIN_PERIOD}'")
+    filter_params = {}
     
     if filters:
         for col, values in filters.items():
@@ -112,8 +105,8 @@ def get_cre_data(lei_list, filters=None):
                 valid_vals = [str(v) for v in values if v is not None]
                 if not valid_vals:
                     continue
-                val_list_str = "'" + "','".join(valid_vals) + "'"
-                where_clauses.append(f"f.{col} IN ({val_list_str})")
+                filter_params[f"f_{col}"] = json_set(valid_vals)
+                where_clauses.append(f"f.{col} IN (SELECT value FROM json_each(:f_{col}))")
     
     where_sql = " AND ".join(where_clauses)
     
@@ -163,11 +156,9 @@ def get_cre_data(lei_list, filters=None):
     """
     
     try:
-        df = pd.read_sql(query, conn)
+        df = read_sql(query, leis=lei_list, **filter_params)
     except Exception as e:
-        st.error(f"Error fetching Credit Risk data: {e}")
+        notify_error(f"Error fetching Credit Risk data: {e}")
         df = pd.DataFrame()
-    finally:
-        conn.close()
         
     return df
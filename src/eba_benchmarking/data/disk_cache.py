@@ -0,0 +1,273 @@
+"""
+On-disk result cache for data functions.
+
+st.cache_data lives in one process, so every restart, deploy or extra
+server process starts cold. DiskCache keeps results under DISK_CACHE_DIR:
+
+- one file per result: DataFrames as Arrow IPC (with pyarrow), anything
+  else (or a frame Arrow cannot hold) pickled
+- an SQLite index (`index.db`) of key, function, file, size, expiry and last
+  access, shared by every process
+
+A key is a digest of the function name, its arguments and the data versions
+of the tables it reads (see versions.versioned_cache, which checks this cache
+before computing), so a re-stamped table makes old entries unreachable and
+they age out. Files are written to a temporary name and renamed into place,
+so readers never see a partial file, and least recently used entries are
+evicted once the files exceed DISK_CACHE_MAX_MB.
+
+    python -m eba_benchmarking.data.disk_cache           # entries and MB per function
+    python -m eba_benchmarking.data.disk_cache --clear   # remove every entry
+"""
+import os
+import sys
+import time
+import pickle
+import hashlib
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+import pandas as pd
+from ..config import DISK_CACHE_ENABLED, DISK_CACHE_DIR, DISK_CACHE_MAX_MB
+from .peer_set import PeerSet
+
+try:
+    import pyarrow as pa
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+INDEX_FILE = 'index.db'
+MB = 1024 * 1024
+
+# Returned by DiskCache.get() on a miss (None is a valid result)
+MISSING = object()
+
+_instance = {}
+_instance_lock = threading.Lock()
+
+
+def _key_part(value):
+    """Stable text for one argument (the same in every process)."""
+    if isinstance(value, PeerSet):
+        return f"PeerSet:{value.digest}"
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(_key_part(v) for v in value) + ']'
+    if isinstance(value, (set, frozenset)):
+        return '{' + ','.join(sorted(_key_part(v) for v in value)) + '}'
+    if isinstance(value, dict):
+        return '{' + ','.join(f"{_key_part(k)}:{_key_part(v)}" for k, v in sorted(value.items(), key=lambda kv: repr(kv[0]))) + '}'
+    return repr(value)
+
+
+def make_key(name, data_versions, args=(), kwargs=None):
+    """Digest of a function name, its data versions and its arguments."""
+    text = '|'.join([name, _key_part(data_versions), _key_part(list(args)), _key_part(kwargs or {})])
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def ttl_seconds(ttl):
+    """st.cache_data's ttl (seconds or timedelta) as seconds, None for no expiry."""
+    if ttl is None:
+        return None
+    if isinstance(ttl, timedelta):
+        return ttl.total_seconds()
+    return float(ttl)
+
+
+class DiskCache:
+    """Size-bounded LRU result store in `directory`, safe to share between processes."""
+
+    def __init__(self, directory=DISK_CACHE_DIR, max_mb=DISK_CACHE_MAX_MB):
+        self.directory = directory
+        self.max_bytes = max_mb * MB
+        os.makedirs(directory, exist_ok=True)
+        with self._index() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    function TEXT NOT NULL,
+                    file TEXT NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access)")
+
+    def _index(self, write=True):
+        conn = sqlite3.connect(os.path.join(self.directory, INDEX_FILE), timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return _closing_transaction(conn, write)
+
+    def _path(self, file):
+        return os.path.join(self.directory, file)
+
+    def get(self, key):
+        """The stored result for `key`, or MISSING."""
+        with self._index(write=False) as conn:
+            row = conn.execute("SELECT file, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return MISSING
+        file, expires_at = row
+        now = time.time()
+        try:
+            if expires_at is not None and expires_at < now:
+                raise FileNotFoundError(file)
+            value = self._read(self._path(file))
+        except Exception:
+            # Expired, evicted by another process meanwhile, or unreadable
+            with self._index() as conn:
+                self._remove(conn, key, file)
+            return MISSING
+        with self._index() as conn:
+            conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+        return value
+
+    def put(self, key, value, name, ttl=None):
+        """Stores `value` for `key` (atomically replacing any previous file) and evicts LRU entries."""
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                suffix = self._write(f, value)
+            file = f"{key}{suffix}"
+            os.replace(tmp, self._path(file))
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        size = os.path.getsize(self._path(file))
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        with self._index() as conn:
+            previous = conn.execute("SELECT file FROM entries WHERE key = ?", (key,)).fetchone()
+            if previous is not None and previous[0] != file:
+                self._remove(conn, key, previous[0])
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, function, file, bytes, created_at, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, name, file, size, now, expires_at, now),
+            )
+            self._evict(conn)
+
+    def _write(self, f, value):
+        """Writes `value` to the open file; returns the file suffix of its format."""
+        # Arrow keeps string column labels only; other frames are pickled
+        if (PYARROW_AVAILABLE and isinstance(value, pd.DataFrame) and not value.attrs
+                and all(isinstance(c, str) for c in value.columns)):
+            try:
+                table = pa.Table.from_pandas(value, preserve_index=True)
+            except (pa.ArrowException, TypeError, ValueError):
+                table = None
+            if table is not None:
+                with pa.ipc.new_file(f, table.schema) as writer:
+                    writer.write_table(table)
+                return '.arrow'
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return '.pkl'
+
+    def _read(self, path):
+        if path.endswith('.arrow'):
+            with pa.memory_map(path) as source:
+                return pa.ipc.open_file(source).read_all().to_pandas()
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def _remove(self, conn, key, file):
+        conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        try:
+            os.remove(self._path(file))
+        except OSError:
+            pass
+
+    def _evict(self, conn):
+        """Drops expired entries, then least recently used ones until the files fit max_bytes."""
+        now = time.time()
+        for key, file in conn.execute("SELECT key, file FROM entries WHERE expires_at < ?", (now,)).fetchall():
+            self._remove(conn, key, file)
+        total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, file, size in conn.execute("SELECT key, file, bytes FROM entries ORDER BY last_access").fetchall():
+            self._remove(conn, key, file)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self._index() as conn:
+            for key, file in conn.execute("SELECT key, file FROM entries").fetchall():
+                self._remove(conn, key, file)
+
+    def stats(self):
+        """Entries, MB and last access per function, largest first."""
+        with self._index() as conn:
+            return pd.read_sql(
+                "SELECT function, COUNT(*) AS entries, SUM(bytes) / 1048576.0 AS mb, "
+                "datetime(MAX(last_access), 'unixepoch', 'localtime') AS last_access "
+                "FROM entries GROUP BY function ORDER BY mb DESC",
+                conn,
+            )
+
+
+class _closing_transaction:
+    """
+    `with` block: one transaction on `conn` (IMMEDIATE when `write`, so
+    concurrent writers queue on the busy timeout), committed or rolled back,
+    then closed.
+    """
+
+    def __init__(self, conn, write=True):
+        self.conn = conn
+        self.write = write
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE" if self.write else "BEGIN")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.conn.close()
+
+
+def get_disk_cache():
+    """The process-wide DiskCache, or None when disabled or DISK_CACHE_DIR is not writable."""
+    if not DISK_CACHE_ENABLED or _instance.get('bypass'):
+        return None
+    with _instance_lock:
+        if 'cache' not in _instance:
+            try:
+                _instance['cache'] = DiskCache()
+            except (OSError, sqlite3.Error) as e:
+                print(f"Disk cache unavailable in {DISK_CACHE_DIR}: {e}")
+                _instance['cache'] = None
+        return _instance['cache']
+
+
+@contextmanager
+def disk_cache_bypassed():
+    """Within the block, data functions neither read nor write the disk cache (for cold-run timings)."""
+    with _instance_lock:
+        _instance['bypass'] = _instance.get('bypass', 0) + 1
+    try:
+        yield
+    finally:
+        with _instance_lock:
+            _instance['bypass'] -= 1
+
+
+if __name__ == "__main__":
+    cache = get_disk_cache()
+    if cache is None:
+        print("Disk cache disabled (DISK_CACHE_ENABLED / EBA_DISK_CACHE=0)")
+    elif '--clear' in sys.argv:
+        cache.clear()
+        print(f"Cleared {cache.directory}")
+    else:
+        stats = cache.stats()
+        print(stats.to_string(index=False))
+        print(f"\nTotal {stats['mb'].sum():.1f} MB of {DISK_CACHE_MAX_MB} MB budget in {cache.directory}")
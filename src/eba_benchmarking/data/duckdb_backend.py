@@ -0,0 +1,233 @@
+"""
+Optional DuckDB engine for data-layer queries.
+
+Selected with DATA_BACKEND = 'duckdb' (or EBA_DATA_BACKEND=duckdb). An
+in-process DuckDB database attaches DB_NAME read-only, or reads a Parquet
+export when DUCKDB_PARQUET_DIR is set, and runs the queries issued through
+data/query.py on its vectorized engine. Facts tables are exposed through
+typed views so comparisons behave as in SQLite (e.g. `country != 0`).
+
+The SQL in data/* is written once, in SQLite syntax; to_duckdb() rewrites
+the json_each() set binding and `:name` parameters for DuckDB.
+
+    python -m eba_benchmarking.data.duckdb_backend   # parity check against SQLite
+"""
+import os
+import re
+import json
+import threading
+from functools import lru_cache
+import pandas as pd
+from ..config import DB_NAME, DUCKDB_PARQUET_DIR
+
+try:
+    import duckdb
+    DUCKDB_AVAILABLE = True
+except ImportError:
+    duckdb = None
+    DUCKDB_AVAILABLE = False
+
+FACT_TABLES = ['facts_oth', 'facts_cre', 'facts_sov', 'facts_mrk']
+
+# Canonical types for the facts views; any other column is an integer dimension
+FACT_COLUMN_TYPES = {
+    'lei': 'VARCHAR',
+    'period': 'VARCHAR',
+    'item_id': 'VARCHAR',
+    'nsa': 'VARCHAR',
+    'amount': 'DOUBLE',
+}
+
+_SET_RE = re.compile(r"([\w.]+) IN \(SELECT value FROM json_each\(:(\w+)\)\)")
+_PARAM_RE = re.compile(r"(?<![:\w]):([A-Za-z_]\w*)")
+
+_init_lock = threading.Lock()
+_local = threading.local()
+_db = None
+
+
+def _parquet_path(table):
+    if not DUCKDB_PARQUET_DIR:
+        return None
+    path = os.path.join(DUCKDB_PARQUET_DIR, table)
+    return path if os.path.isdir(path) else None
+
+
+def _source(table):
+    """Relation to read `table` from: its Parquet export if present, else the attached SQLite DB."""
+    path = _parquet_path(table)
+    if path:
+        return f"read_parquet('{path}/**/*.parquet', hive_partitioning = true)"
+    return f"eba.{table}"
+
+
+def _create_views(con):
+    # Parquet-exported tables shadow the attached ones
+    if DUCKDB_PARQUET_DIR and os.path.isdir(DUCKDB_PARQUET_DIR):
+        for table in os.listdir(DUCKDB_PARQUET_DIR):
+            if table not in FACT_TABLES and _parquet_path(table):
+                con.execute(f"CREATE OR REPLACE VIEW main.{table} AS SELECT * FROM {_source(table)}")
+
+    for table in FACT_TABLES:
+        try:
+            cols = [r[0] for r in con.execute(f"DESCRIBE SELECT * FROM {_source(table)}").fetchall()]
+        except Exception:
+            continue  # table not built yet
+        select = []
+        for col in cols:
+            if col == 'id':
+                continue
+            col_type = FACT_COLUMN_TYPES.get(col, 'BIGINT')
+            select.append(f"TRY_CAST({col} AS {col_type}) AS {col}")
+        con.execute(f"CREATE OR REPLACE VIEW main.{table} AS SELECT {', '.join(select)} FROM {_source(table)}")
+
+
+def _open_database():
+    con = duckdb.connect(':memory:')
+    con.execute("INSTALL sqlite")
+    con.execute("LOAD sqlite")
+    con.execute(f"ATTACH '{DB_NAME}' AS eba (TYPE SQLITE, READ_ONLY)")
+    # Unqualified names resolve to the views first, then to the SQLite tables
+    con.execute("SET search_path = 'main,eba.main'")
+    _create_views(con)
+    return con
+
+
+def get_duckdb_connection():
+    """Returns the calling thread's cursor on the shared in-process DuckDB database."""
+    global _db
+    if not DUCKDB_AVAILABLE:
+        raise ImportError("DATA_BACKEND='duckdb' requires the duckdb package (pip install duckdb)")
+    cur = getattr(_local, 'cur', None)
+    if cur is not None:
+        return cur
+    with _init_lock:
+        if _db is None:
+            _db = _open_database()
+    _local.cur = _db.cursor()
+    return _local.cur
+
+
+def reset_duckdb():
+    """Drops the DuckDB database so the next query re-attaches (e.g. after the pipeline ran)."""
+    global _db
+    with _init_lock:
+        if _db is not None:
+            _db.close()
+        _db = None
+    _local.cur = None
+
+
+@lru_cache(maxsize=256)
+def to_duckdb(sql):
+    """
+    Rewrites SQLite-syntax data-layer SQL for DuckDB.
+    Returns (sql, set_param_names): `col IN json_each(:x)` becomes a VARCHAR
+    comparison against unnest($x) (sets are bound as strings, as in SQLite
+    where column affinity converts them), and :x becomes $x.
+    """
+    set_names = frozenset(name for _, name in _SET_RE.findall(sql))
+    sql = _SET_RE.sub(r"CAST(\1 AS VARCHAR) IN (SELECT unnest($\2))", sql)
+    sql = _PARAM_RE.sub(r"$\1", sql)
+    return sql, set_names
+
+
+def read_sql(sql, params=None):
+    """Runs a data-layer query (SQLite syntax, named params) on DuckDB and returns a DataFrame."""
+    duck_sql, set_names = to_duckdb(sql)
+    params = params or {}
+    # Sets arrive JSON-encoded for json_each(); DuckDB binds them as lists
+    duck_params = {k: json.loads(v) if k in set_names else v for k, v in params.items()}
+    return get_duckdb_connection().execute(duck_sql, duck_params).df()
+
+# =============================================================================
+# PARITY CHECK
+# =============================================================================
+
+def _normalize(df):
+    """Sorts rows/columns and drops the index so frames from both engines compare."""
+    if df is None or df.empty:
+        return pd.DataFrame()
+    df = df[sorted(df.columns, key=str)]
+    sort_cols = [c for c in ['lei', 'name', 'period', 'item_id', 'label'] if c in df.columns]
+    if sort_cols:
+        df = df.sort_values(sort_cols, kind='mergesort')
+    return df.reset_index(drop=True)
+
+
+def _parity_cases(sample_size):
+    from .connection import get_connection
+    from .generic import get_tab_data
+    from .benchmarking import compute_all_benchmarking_metrics
+    from .credit_risk import get_cre_data
+    from .solvency import get_solvency_averages
+    from .profitability import get_profitability_averages
+    from .assets import get_assets_averages
+    from .liquidity import get_liquidity_averages
+    from .asset_quality import get_aq_breakdown_averages
+    from .sovereign import get_sovereign_averages
+
+    conn = get_connection()
+    base = pd.read_sql(
+        "SELECT lei, country_iso, region, Systemic_Importance, size_category FROM institutions "
+        "WHERE size_category IS NOT NULL ORDER BY lei LIMIT 1", conn
+    )
+    leis = pd.read_sql("SELECT lei FROM institutions ORDER BY lei LIMIT ?", conn, params=[sample_size])['lei'].tolist()
+    if base.empty or not leis:
+        return []
+    b = base.iloc[0]
+    peer_args = (b['country_iso'], b['region'], b['Systemic_Importance'], b['size_category'])
+
+    return [
+        ('get_tab_data', get_tab_data, ('Capital', leis)),
+        ('compute_all_benchmarking_metrics', compute_all_benchmarking_metrics, (leis,)),
+        ('get_cre_data', get_cre_data, (leis, {'perf_status': ['1', '2']})),
+        ('get_solvency_averages', get_solvency_averages, peer_args),
+        ('get_profitability_averages', get_profitability_averages, peer_args),
+        ('get_assets_averages', get_assets_averages, peer_args),
+        ('get_liquidity_averages', get_liquidity_averages, peer_args),
+        ('get_aq_breakdown_averages', get_aq_breakdown_averages, peer_args),
+        ('get_sovereign_averages', get_sovereign_averages, peer_args[:3]),
+    ]
+
+
+def check_parity(sample_size=25, rtol=1e-9):
+    """
+    Runs representative data functions on both engines and compares the frames.
+    Returns a list of (function_name, error) for every mismatch.
+    """
+    from .query import get_backend, set_backend
+    from .cache import clear_caches
+    from .disk_cache import disk_cache_bypassed
+
+    previous = get_backend()
+    failures = []
+    try:
+        for name, func, args in _parity_cases(sample_size):
+            results = {}
+            for backend in ('sqlite', 'duckdb'):
+                set_backend(backend)
+                clear_caches()
+                with disk_cache_bypassed():
+                    results[backend] = _normalize(func(*args))
+            try:
+                pd.testing.assert_frame_equal(
+                    results['sqlite'], results['duckdb'],
+                    check_dtype=False, check_exact=False, rtol=rtol
+                )
+            except AssertionError as e:
+                failures.append((name, str(e).splitlines()[0]))
+    finally:
+        set_backend(previous)
+        clear_caches()
+    return failures
+
+
+if __name__ == "__main__":
+    import sys
+    failures = check_parity()
+    for name, error in failures:
+        print(f"  ❌ {name}: {error}")
+    if not failures:
+        print("  ✅ DuckDB results match SQLite.")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,245 @@
+"""
+Single-scan fact loader for the benchmarking frame.
+
+compute_all_benchmarking_metrics used to query facts_oth six times, facts_cre
+and facts_sov twice, then merge get_solvency_with_texas_ratio,
+get_aq_breakdown, get_assets_kpis, get_liabilities_kpis, get_liquidity_kpis
+and get_deposit_beta, which re-read the same rows. load_fact_scans() runs one
+planned query per facts table instead:
+
+- facts_oth: one conditional-aggregation column per (group, label) of
+  OTH_SCAN_GROUPS, one row per bank-period
+- facts_cre: amounts by item and perf_status (the AQ breakdown grain)
+- facts_sov: total and home-country sovereign exposure per bank-period
+
+compute_scan_kpis() then feeds those frames to the modules' compute_*()
+functions, which are the same code the per-tab get_*_kpis() functions run.
+
+    python -m eba_benchmarking.data.fact_scan   # query count and wall time, per-function vs single scan
+"""
+import time
+import pandas as pd
+from ..config import PROFITABILITY_ITEMS, SOLVENCY_ITEMS, ASSET_ITEMS
+from .query import LEI_SET, ITEM_SET, read_sql, read_aggregates, item_columns, get_query_stats
+from .base import MIN_PERIOD
+
+# Breakdown of item 2521215 (liabilities) by instrument / counterparty exposure
+LIABILITY_BREAKDOWN_ITEM = '2521215'
+LIABILITY_BREAKDOWN = {
+    'Customer Deposits': "f.financial_instruments = 30 AND f.exposure IN (301, 401)",  # NFC + Households
+    'Interbank Deposits': "f.financial_instruments = 30 AND f.exposure = 102",
+    'Central Bank Funding': "f.financial_instruments = 30 AND f.exposure = 101",
+    'Debt Securities Issued': "f.financial_instruments = 40",
+    'Derivatives (Liab)': "f.financial_instruments = 12",
+}
+
+# Balance sheet totals used by liquidity, liabilities and the benchmarking frame
+BALANCE_ITEMS = {
+    '2521010': 'total_assets',
+    '2521001': 'cash',
+    '2521017': 'loans',  # Loans FV
+    '2521019': 'loans',  # Loans AC
+    '2521214': 'total_liabilities',
+    '2520102': 'equity',
+}
+
+# NPE exposures/provisions, forborne exposures/provisions, write-offs
+AQ_ITEMS = ['2520603', '2520613', '2520703', '2520713', '2521708']
+SOVEREIGN_ITEMS = ['2520812', '2520813', '2520814', '2520815']
+
+OTH_SCAN_GROUPS = {
+    'profitability': item_columns(PROFITABILITY_ITEMS),
+    'solvency': item_columns(SOLVENCY_ITEMS),
+    'assets': item_columns(ASSET_ITEMS),
+    'balance': item_columns(BALANCE_ITEMS),
+    'liabilities': {label: ([LIABILITY_BREAKDOWN_ITEM], cond) for label, cond in LIABILITY_BREAKDOWN.items()},
+}
+
+# Scan columns are named '<group>|<label>'
+SCAN_SEP = '|'
+
+CRE_SCAN_SQL = f"""
+    SELECT f.lei, COALESCE(i.short_name, i.commercial_name) as name, f.period, f.item_id, f.perf_status,
+           SUM(f.amount) as amount, SUM(ABS(f.amount)) as abs_amount
+    FROM facts_cre f JOIN institutions i ON f.lei = i.lei
+    WHERE f.lei IN {LEI_SET}
+      AND f.item_id IN {ITEM_SET}
+      AND f.period >= '{MIN_PERIOD}'
+    GROUP BY f.lei, i.short_name, i.commercial_name, f.period, f.item_id, f.perf_status
+"""
+
+# Excludes the maturity=8 aggregate bucket to avoid double counting
+SOV_SCAN_SQL = f"""
+    SELECT f.lei, f.period, i.country_iso as bank_country,
+           SUM(CASE WHEN f.country != 0 THEN f.amount END) as total_sovereign,
+           SUM(CASE WHEN f.country IN (SELECT c.country FROM dim_country c WHERE c.iso_code = i.country_iso)
+                    THEN f.amount END) as home_sovereign
+    FROM facts_sov f
+    JOIN institutions i ON f.lei = i.lei
+    WHERE f.lei IN {LEI_SET}
+      AND f.item_id IN {ITEM_SET}
+      AND f.maturity != 8
+      AND f.period >= '{MIN_PERIOD}'
+    GROUP BY f.lei, f.period, i.country_iso
+"""
+
+
+def _rwa_labels():
+    """{item_id: label} of the RWA tab in the dictionary."""
+    df = read_sql("SELECT item_id, label FROM dictionary WHERE tab_name = 'RWA' AND label IS NOT NULL")
+    return dict(zip(df['item_id'].astype(str), df['label']))
+
+
+def oth_scan_columns(rwa_labels=None):
+    """{'<group>|<label>': (item_ids, condition)} for the facts_oth scan."""
+    groups = dict(OTH_SCAN_GROUPS)
+    if rwa_labels:
+        groups['rwa'] = item_columns(rwa_labels)
+    return {
+        f"{group}{SCAN_SEP}{label}": spec
+        for group, columns in groups.items()
+        for label, spec in columns.items()
+    }
+
+
+def load_cre_scan(lei_list):
+    """facts_cre amounts by (lei, name, period, item_id, perf_status) for the AQ items."""
+    df = read_sql(CRE_SCAN_SQL, leis=lei_list, items=AQ_ITEMS)
+    df['item_id'] = df['item_id'].astype(str)
+    return df
+
+
+def load_fact_scans(lei_list):
+    """
+    Runs the planned scan of each facts table once for `lei_list`.
+    Returns {'facts_oth': ..., 'facts_cre': ..., 'facts_sov': ...}; a table
+    that cannot be read yields an empty frame.
+    """
+    loaders = {
+        'facts_oth': lambda: read_aggregates('facts_oth', oth_scan_columns(_rwa_labels()), lei_list),
+        'facts_cre': lambda: load_cre_scan(lei_list),
+        'facts_sov': lambda: read_sql(SOV_SCAN_SQL, leis=lei_list, items=SOVEREIGN_ITEMS),
+    }
+    scans = {}
+    for table, load in loaders.items():
+        try:
+            scans[table] = load()
+        except Exception as e:
+            print(f"Error scanning {table}: {e}")
+            scans[table] = pd.DataFrame()
+    return scans
+
+
+def scan_group(df, group, with_name=True):
+    """
+    Columns of one facts_oth scan group with their labels restored, keeping
+    only bank-periods where the group has data (the rows a query for just
+    those items would return).
+    """
+    prefix = f"{group}{SCAN_SEP}"
+    keys = ['lei', 'name', 'period'] if with_name else ['lei', 'period']
+    cols = [c for c in df.columns if str(c).startswith(prefix)]
+    if df.empty or not cols:
+        return pd.DataFrame(columns=keys)
+    out = df.loc[df[cols].notna().any(axis=1), keys + cols].reset_index(drop=True)
+    out.columns = keys + [c[len(prefix):] for c in cols]
+    return out
+
+
+def compute_scan_kpis(scans):
+    """
+    Module KPI frames computed from one set of scans:
+    profitability, solvency (with Texas Ratio), aq_breakdown, assets,
+    liabilities, liquidity, nii and deposit_beta. A failing computation
+    yields an empty frame, as the get_*() functions do.
+    """
+    from .solvency import compute_solvency_kpis, add_texas_ratio
+    from .asset_quality import compute_aq_breakdown
+    from .assets import compute_assets_kpis
+    from .liabilities import compute_liabilities_kpis, compute_deposit_beta
+    from .liquidity import compute_liquidity_kpis
+    from .profitability import compute_profitability_kpis, compute_nii_analysis
+
+    oth = scans.get('facts_oth', pd.DataFrame())
+    balance = scan_group(oth, 'balance')
+    liabilities = scan_group(oth, 'liabilities', with_name=False)
+    total_assets = balance[['lei', 'period', 'total_assets']].dropna(subset=['total_assets'])
+
+    steps = [
+        ('profitability', lambda: compute_profitability_kpis(scan_group(oth, 'profitability'))),
+        ('aq_breakdown', lambda: compute_aq_breakdown(scans.get('facts_cre', pd.DataFrame()))),
+        ('solvency', lambda: add_texas_ratio(
+            compute_solvency_kpis(scan_group(oth, 'solvency'), total_assets), kpis['aq_breakdown'])),
+        ('assets', lambda: compute_assets_kpis(scan_group(oth, 'assets'))),
+        ('liabilities', lambda: compute_liabilities_kpis(
+            pd.merge(balance[['lei', 'name', 'period', 'total_liabilities', 'equity']], liabilities,
+                     on=['lei', 'period'], how='left'))),
+        ('liquidity', lambda: compute_liquidity_kpis(pd.merge(
+            balance[['lei', 'name', 'period', 'loans']],
+            liabilities[['lei', 'period', 'Customer Deposits']].rename(columns={'Customer Deposits': 'customer_deposits'}),
+            on=['lei', 'period'], how='left'))),
+        ('nii', lambda: compute_nii_analysis(kpis['profitability'], kpis['assets'], kpis['liabilities'])),
+        ('deposit_beta', lambda: compute_deposit_beta(kpis['nii'])),
+    ]
+    kpis = {}
+    for name, compute in steps:
+        try:
+            kpis[name] = compute()
+        except Exception as e:
+            print(f"Error computing {name} from fact scans: {e}")
+            kpis[name] = pd.DataFrame()
+    return kpis
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+def _run_per_function(lei_list):
+    from .solvency import get_solvency_with_texas_ratio
+    from .asset_quality import get_aq_breakdown
+    from .assets import get_assets_kpis
+    from .liabilities import get_liabilities_kpis, get_deposit_beta
+    from .liquidity import get_liquidity_kpis
+    from .profitability import get_profitability_kpis
+
+    for func in (get_profitability_kpis, get_solvency_with_texas_ratio, get_aq_breakdown,
+                 get_assets_kpis, get_liabilities_kpis, get_liquidity_kpis, get_deposit_beta):
+        func(lei_list)
+
+
+def _run_single_scan(lei_list):
+    compute_scan_kpis(load_fact_scans(lei_list))
+
+
+def benchmark_fact_loading(lei_list=None, repeats=3):
+    """
+    Facts queries (read_sql executions) and median wall time for the module
+    KPIs of `lei_list` (default: every institution), loaded per function or
+    from one scan per table. in-process caches and KPI supersets are cleared
+    before each run and the disk cache is bypassed.
+    """
+    import statistics
+    from .connection import get_connection
+    from .cache import clear_caches
+    from .disk_cache import disk_cache_bypassed
+
+    if lei_list is None:
+        lei_list = [r[0] for r in get_connection().execute("SELECT lei FROM institutions").fetchall()]
+
+    rows = []
+    with disk_cache_bypassed():
+        for mode, run in (('per-function', _run_per_function), ('single-scan', _run_single_scan)):
+            timings, queries = [], 0
+            for _ in range(repeats):
+                clear_caches()
+                before = get_query_stats()['executions']
+                start = time.perf_counter()
+                run(lei_list)
+                timings.append((time.perf_counter() - start) * 1000)
+                queries = get_query_stats()['executions'] - before
+            rows.append({'mode': mode, 'banks': len(lei_list), 'queries': queries, 'median_ms': statistics.median(timings)})
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    print(benchmark_fact_loading().to_string(index=False))
@@ -1,11 +1,25 @@
 import pandas as pd
-import sqlite3
-import streamlit as st
 import os
 from ..config import DB_NAME
-from .base import MIN_PERIOD
+from .query import LEI_SET, ITEM_SET, read_sql, get_backend
+from .base import MIN_PERIOD, read_columnar
+from .versions import versioned_cache, FACT_TABLES
 
-@st.cache_data
+
+def _read_tab_snapshot(table, lei_list, items):
+    """get_tab_data rows for one facts table from the columnar snapshots, or None if unavailable."""
+    facts = read_columnar(table, leis=lei_list, items=items, min_period=MIN_PERIOD,
+                          columns=['lei', 'period', 'item_id', 'amount'])
+    if facts is None:
+        return None
+    names = read_columnar('institutions', leis=lei_list, columns=['lei', 'short_name', 'commercial_name'])
+    if names is None:
+        return None
+    names['name'] = names['short_name'].fillna(names['commercial_name'])
+    df = facts.merge(names[['lei', 'name']], on='lei', how='inner')
+    return df[['lei', 'name', 'period', 'item_id', 'amount']]
+
+@versioned_cache(*FACT_TABLES, 'dictionary', 'institutions')
 def get_tab_data(tab_name, lei_list):
     """
     Fetches all data for a specific tab across all facts tables.
@@ -14,17 +28,13 @@ def get_tab_data(tab_name, lei_list):
     if not lei_list or not os.path.exists(DB_NAME):
         return pd.DataFrame()
     
-    conn = sqlite3.connect(DB_NAME)
-    
     # 1. Fetch Dictionary for the Tab
     try:
-        df_dict = pd.read_sql(f"SELECT item_id, label, category, template FROM dictionary WHERE tab_name = '{tab_name}'", conn)
+        df_dict = read_sql("SELECT item_id, label, category, template FROM dictionary WHERE tab_name = :tab_name", tab_name=tab_name)
     except Exception:
-        conn.close()
         return pd.DataFrame()
 
     if df_dict.empty:
-        conn.close()
         return pd.DataFrame()
 
     # 2. Map Templates to Tables
@@ -61,7 +71,6 @@ def get_tab_data(tab_name, lei_list):
 
     # 4. Execute Queries (One per Table)
     all_data = []
-    leis_str = "'" + "','".join([str(lei) for lei in lei_list]) + "'"
 
     for table, items in table_items_map.items():
         if not items:
@@ -69,8 +78,15 @@ def get_tab_data(tab_name, lei_list):
             
         # Deduplicate items
         items = list(set(items))
-        items_str = "'" + "','".join([str(i) for i in items]) + "'"
         
+        # Cold path: Arrow snapshot skips SQLite row decoding (DuckDB reads its own sources)
+        if get_backend() == 'sqlite':
+            df_temp = _read_tab_snapshot(table, lei_list, items)
+            if df_temp is not None:
+                if not df_temp.empty:
+                    all_data.append(df_temp)
+                continue
+
         query = f"""
         SELECT 
             f.lei, 
@@ -80,12 +96,12 @@ def get_tab_data(tab_name, lei_list):
             f.amount 
         FROM {table} f 
         JOIN institutions i ON f.lei = i.lei 
-        WHERE f.lei IN ({leis_str}) 
-          AND f.item_id IN ({items_str}) 
+        WHERE f.lei IN {LEI_SET} 
+          AND f.item_id IN {ITEM_SET} 
           AND f.period >= '{MIN_PERIOD}'
         """
         try:
-            df_temp = pd.read_sql(query, conn)
+            df_temp = read_sql(query, leis=lei_list, items=items)
             if not df_temp.empty:
                 all_data.append(df_temp)
         except Exception as e:
@@ -93,8 +109,6 @@ def get_tab_data(tab_name, lei_list):
             print(f"Error querying {table}: {e}")
             pass
 
-    conn.close()
-
     if not all_data:
         return pd.DataFrame()
 
@@ -105,12 +119,10 @@ def get_tab_data(tab_name, lei_list):
     
     return pd.merge(df_final, df_dict, on='item_id', how='left')
 
-@st.cache_data
+@versioned_cache('facts_oth', 'facts_cre', 'institutions')
 def get_financial_data(lei_list):
     """Legacy helper for standard KPIs across OTH and CRE."""
     if not lei_list or not os.path.exists(DB_NAME): return pd.DataFrame()
-    conn = sqlite3.connect(DB_NAME)
-    leis_str = "'" + "','".join([str(lei) for lei in lei_list]) + "'"
     sql_oth = f"""
     SELECT f.lei, COALESCE(i.short_name, i.commercial_name) as name, f.period, CASE 
         WHEN f.item_id = '2520140' THEN 'CET1 Ratio' WHEN f.item_id = '2520141' THEN 'Tier 1 Ratio' WHEN f.item_id = '2520142' THEN 'Total Capital Ratio' WHEN f.item_id = '2520905' THEN 'Leverage Ratio'
@@ -119,16 +131,15 @@ def get_financial_data(lei_list):
         WHEN f.item_id = '2520301' THEN 'Interest Income' WHEN f.item_id = '2520302' THEN 'Int Inc: Debt Securities' WHEN f.item_id = '2520303' THEN 'Int Inc: Loans'
         WHEN f.item_id = '2520304' THEN 'Interest Expenses' WHEN f.item_id = '2520305' THEN 'Int Exp: Deposits' WHEN f.item_id = '2520306' THEN 'Int Exp: Debt Securities'
         WHEN f.item_id = '2520201' THEN 'RWA: Credit Risk' WHEN f.item_id = '2520220' THEN 'Total Risk Exposure Amount' ELSE 'Other'
-    END as kpi, f.amount FROM facts_oth f JOIN institutions i ON f.lei = i.lei WHERE f.lei IN ({leis_str}) AND f.period >= '{MIN_PERIOD}'
+    END as kpi, f.amount FROM facts_oth f JOIN institutions i ON f.lei = i.lei WHERE f.lei IN {LEI_SET} AND f.period >= '{MIN_PERIOD}'
     """
     try:
-        df_oth = pd.read_sql(sql_oth, conn)
-        sql_cre = f"SELECT f.lei, f.period, SUM(amount) as total_loans, SUM(CASE WHEN perf_status = 2 THEN amount ELSE 0 END) as npl_amt FROM facts_cre f WHERE f.lei IN ({leis_str}) AND f.item_id = '2520605' AND f.period >= '{MIN_PERIOD}' GROUP BY f.lei, f.period"
-        df_cre = pd.read_sql(sql_cre, conn); conn.close()
+        df_oth = read_sql(sql_oth, leis=lei_list)
+        sql_cre = f"SELECT f.lei, f.period, SUM(amount) as total_loans, SUM(CASE WHEN perf_status = 2 THEN amount ELSE 0 END) as npl_amt FROM facts_cre f WHERE f.lei IN {LEI_SET} AND f.item_id = '2520605' AND f.period >= '{MIN_PERIOD}' GROUP BY f.lei, f.period"
+        df_cre = read_sql(sql_cre, leis=lei_list)
         df_oth_p = df_oth.pivot_table(index=['lei', 'name', 'period'], columns='kpi', values='amount', aggfunc='sum').reset_index() if not df_oth.empty else pd.DataFrame(columns=['lei', 'name', 'period'])
         df_final = pd.merge(df_oth_p, df_cre, on=['lei', 'period'], how='left') if not df_cre.empty else df_oth_p
         if 'npl_amt' in df_final.columns: df_final['npl_ratio'] = df_final['npl_amt'] / df_final['total_loans']
         return df_final
     except:
-        if conn: conn.close()
         return pd.DataFrame()
\ No newline at end of file
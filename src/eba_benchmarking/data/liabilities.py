@@ -1,12 +1,17 @@
 import pandas as pd
-import sqlite3
-import streamlit as st
 import os
 from ..config import DB_NAME
-from .base import MIN_PERIOD, get_benchmark_leis
+from .connection import get_connection
+from .query import read_aggregates
+from .base import get_benchmark_leis, peer_union
+from .fact_scan import LIABILITY_BREAKDOWN, LIABILITY_BREAKDOWN_ITEM
+from .metrics import evaluate_metrics
+from .ranking import peer_group_averages
+from .versions import versioned_cache
+from .superset import kpi_superset
 from .solvency import get_solvency_kpis
 
-@st.cache_data
+@kpi_superset('facts_oth', 'institutions')
 def get_liabilities_kpis(lei_list):
     """
     Fetches main liability categories.
@@ -19,122 +24,59 @@ def get_liabilities_kpis(lei_list):
     - 2521214: Total Liabilities
     """
     if not lei_list or not os.path.exists(DB_NAME): return pd.DataFrame()
-    conn = sqlite3.connect(DB_NAME)
-    leis_str = "'" + "','".join([str(lei) for lei in lei_list]) + "'"
-    
-    # 1. Fetch breakdown from 2521215
-    query_brk = f"""
-    SELECT lei, period, financial_instruments, exposure, SUM(amount) as amount
-    FROM facts_oth 
-    WHERE lei IN ({leis_str}) AND item_id = '2521215' AND period >= '{MIN_PERIOD}'
-    GROUP BY lei, period, financial_instruments, exposure
-    """
-    
-    # 2. Fetch Total Liabilities from 2521214
-    query_tot = f"""
-    SELECT f.lei, COALESCE(i.short_name, i.commercial_name) as name, f.period, SUM(f.amount) as total_liabilities
-    FROM facts_oth f
-    JOIN institutions i ON f.lei = i.lei
-    WHERE f.lei IN ({leis_str}) AND f.item_id = '2521214' AND f.period >= '{MIN_PERIOD}'
-    GROUP BY f.lei, f.period
-    """
-
-    # 3. Fetch Equity (CET1) from 2520102
-    query_eq = f"""
-    SELECT lei, period, SUM(amount) as equity
-    FROM facts_oth
-    WHERE lei IN ({leis_str}) AND item_id = '2520102' AND period >= '{MIN_PERIOD}'
-    GROUP BY lei, period
-    """
-    
+    # Breakdown of 2521215, Total Liabilities (2521214) and Equity (CET1, 2520102) in one pass
+    columns = {
+        'total_liabilities': (['2521214'], None),
+        **{label: ([LIABILITY_BREAKDOWN_ITEM], cond) for label, cond in LIABILITY_BREAKDOWN.items()},
+        'equity': (['2520102'], None),
+    }
     try:
-        df_brk = pd.read_sql(query_brk, conn)
-        df_tot = pd.read_sql(query_tot, conn)
-        df_eq = pd.read_sql(query_eq, conn)
-        conn.close()
-        
-        if df_tot.empty: return pd.DataFrame()
-        
-        # Process breakdown
-        def aggregate_liabilities(group):
-            d = {}
-            # Customer Deposits (301: NFC, 401: Households)
-            d['Customer Deposits'] = group[(group['financial_instruments'] == 30) & (group['exposure'].isin([301, 401]))]['amount'].sum()
-            # Interbank (102: Credit Institutions)
-            d['Interbank Deposits'] = group[(group['financial_instruments'] == 30) & (group['exposure'] == 102)]['amount'].sum()
-            # Central Bank (101)
-            d['Central Bank Funding'] = group[(group['financial_instruments'] == 30) & (group['exposure'] == 101)]['amount'].sum()
-            # Debt Securities Issued (40)
-            d['Debt Securities Issued'] = group[group['financial_instruments'] == 40]['amount'].sum()
-            # Derivatives (12)
-            d['Derivatives (Liab)'] = group[group['financial_instruments'] == 12]['amount'].sum()
-            return pd.Series(d)
-
-        df_agg = df_brk.groupby(['lei', 'period']).apply(aggregate_liabilities, include_groups=False).reset_index()
-        
-        df_final = pd.merge(df_tot, df_agg, on=['lei', 'period'], how='left').fillna(0)
-        df_final = pd.merge(df_final, df_eq, on=['lei', 'period'], how='left').fillna(0)
-        
-        # Total Equity & Liabilities
-        df_final['total_eq_liab'] = df_final['total_liabilities'] + df_final['equity']
-        
-        # Other Liabilities calculation (residual of total_liabilities)
-        sum_known = df_final['Customer Deposits'] + df_final['Interbank Deposits'] + df_final['Central Bank Funding'] + df_final['Debt Securities Issued'] + df_final['Derivatives (Liab)']
-        df_final['Other Liabilities'] = (df_final['total_liabilities'] - sum_known).apply(lambda x: max(0, x))
-        
-        # Ratios (relative to total equity & liabilities)
-        df_final['Customer Deposit Ratio'] = df_final.apply(lambda x: x['Customer Deposits'] / x['total_eq_liab'] if x['total_eq_liab'] > 0 else 0, axis=1)
-        df_final['Wholesale Funding Ratio'] = df_final.apply(lambda x: (x['Interbank Deposits'] + x['Debt Securities Issued']) / x['total_eq_liab'] if x['total_eq_liab'] > 0 else 0, axis=1)
-        df_final['Equity Ratio'] = df_final.apply(lambda x: x['equity'] / x['total_eq_liab'] if x['total_eq_liab'] > 0 else 0, axis=1)
-        
-        return df_final
-        
+        return compute_liabilities_kpis(read_aggregates('facts_oth', columns, lei_list))
     except Exception as e:
-        if conn: conn.close()
         print(f"Error in get_liabilities_kpis: {e}")
         return pd.DataFrame()
 
-@st.cache_data
+def compute_liabilities_kpis(df):
+    """
+    Liability mix and funding ratios from one row per bank-period with
+    total_liabilities, equity and the LIABILITY_BREAKDOWN columns.
+    Only bank-periods reporting Total Liabilities are kept.
+    """
+    if df.empty or 'total_liabilities' not in df.columns: return pd.DataFrame()
+    df_final = df[df['total_liabilities'].notna()].copy()
+    if df_final.empty: return pd.DataFrame()
+    for col in ['equity', *LIABILITY_BREAKDOWN]:
+        if col not in df_final.columns: df_final[col] = 0
+    df_final = df_final[['lei', 'name', 'period', 'total_liabilities', *LIABILITY_BREAKDOWN, 'equity']].fillna(0)
+    
+    # Total Equity & Liabilities, Other Liabilities (residual of total_liabilities, >= 0)
+    # and ratios relative to total equity & liabilities
+    return evaluate_metrics(df_final, [
+        'total_eq_liab', 'Other Liabilities',
+        'Customer Deposit Ratio', 'Wholesale Funding Ratio', 'Equity Ratio',
+    ])
+
+@versioned_cache('facts_oth', 'institutions')
 def get_liabilities_averages(country_iso, region, systemic_importance, size_category=None):
     """Calculates Domestic, Regional, EU group averages for Liabilities based on Size logic."""
     if not os.path.exists(DB_NAME): return pd.DataFrame()
-    conn = sqlite3.connect(DB_NAME)
     
     groups = get_benchmark_leis(country_iso, region, systemic_importance, size_category)
     
-    all_results = []
-    
-    for label, leis in groups.items():
-        if not leis: continue
-        df_group = get_liabilities_kpis(leis)
-        if df_group.empty: continue
-        
-        # --- NO OUTLIER REMOVAL ---
-        df_filtered = df_group.copy()
-
-        if df_filtered.empty: continue
-
-        def weighted_avg(group):
-            w = group['total_eq_liab']
-            d = {}
-            def get_w_avg(m_col):
-                v = group[[m_col, 'total_eq_liab']].dropna()
-                return (v[m_col] * v['total_eq_liab']).sum() / v['total_eq_liab'].sum() if v['total_eq_liab'].sum() > 0 else group[m_col].mean()
-            
-            d['Customer Deposit Ratio'] = get_w_avg('Customer Deposit Ratio')
-            d['Wholesale Funding Ratio'] = get_w_avg('Wholesale Funding Ratio')
-            d['Equity Ratio'] = get_w_avg('Equity Ratio')
-            
-            for col in ['total_liabilities', 'total_eq_liab', 'equity', 'Customer Deposits', 'Interbank Deposits', 'Central Bank Funding', 'Debt Securities Issued', 'Other Liabilities']:
-                d[col] = group[col].mean()
-            return pd.Series(d)
-
-        df_avg = df_filtered.groupby('period').apply(weighted_avg, include_groups=False).reset_index().assign(name=label)
-        all_results.append(df_avg)
-    conn.close()
-    return pd.concat(all_results, ignore_index=True) if all_results else pd.DataFrame()
+    # One fetch for the union of the groups, split by membership in memory
+    df_banks = get_liabilities_kpis(peer_union(groups))
+    if df_banks.empty: return pd.DataFrame()
+    
+    # Ratios weighted by total equity & liabilities, amounts as plain means
+    return peer_group_averages(
+        df_banks,
+        {m: 'total_eq_liab' for m in ['Customer Deposit Ratio', 'Wholesale Funding Ratio', 'Equity Ratio']},
+        groups,
+        means=['total_liabilities', 'total_eq_liab', 'equity', 'Customer Deposits', 'Interbank Deposits',
+               'Central Bank Funding', 'Debt Securities Issued', 'Other Liabilities'],
+    )
 
-@st.cache_data
+@versioned_cache('facts_oth', 'institutions', 'base_rates')
 def get_deposit_beta(lei_list):
     """
     Calculates Deposit Beta: the sensitivity of implied deposit cost to ECB rate changes.
@@ -147,15 +89,16 @@ def get_deposit_beta(lei_list):
     
     # 1. Get Implied Deposit Cost from NII Analysis
     from .profitability import get_nii_analysis
-    df_nii = get_nii_analysis(lei_list)
-    
+    return compute_deposit_beta(get_nii_analysis(lei_list))
+
+def compute_deposit_beta(df_nii):
+    """Deposit beta per bank-period from the NII analysis frame (Implied Deposit Cost) and ECB rates."""
     if df_nii.empty or 'Implied Deposit Cost' not in df_nii.columns:
         return pd.DataFrame()
     
     # 2. Get ECB Deposit Facility Rate
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     df_ecb = pd.read_sql("SELECT date, value as ecb_rate FROM base_rates WHERE metric = 'Deposit Facility Rate'", conn)
-    conn.close()
     
     if df_ecb.empty:
         return pd.DataFrame()
@@ -10,15 +10,9 @@ from datetime import datetime, timedelta
 from datetime import datetime, timedelta
 import numpy as np
 from ..config import DB_NAME
-
-# Conditional streamlit import for caching
-try:
-    import streamlit as st
-    cache_decorator = st.cache_data(ttl=3600)
-except:
-    # Fallback when running as script (no streamlit)
-    def cache_decorator(func):
-        return func
+from .query import LEI_SET, read_sql
+from .peers import get_peer_index, market_groups
+from .versions import stamp_data_versions, versioned_cache
 
 # Currency conversion utilities
 CURRENCY_FX_PAIRS = {
@@ -138,7 +132,7 @@ def convert_to_eur(value, currency, fx_rate=None, is_total_value=False):
     
     return value * fx_rate
 
-@cache_decorator
+@versioned_cache('market_data', 'institutions', ttl=3600)
 def get_market_data(lei_list=None):
     """
     Fetches market data for banks with tickers.
@@ -148,8 +142,6 @@ def get_market_data(lei_list=None):
     if not os.path.exists(DB_NAME):
         return pd.DataFrame()
     
-    conn = sqlite3.connect(DB_NAME)
-    
     # Build query
     query = """
         SELECT m.*, COALESCE(i.short_name, i.commercial_name) as name, i.country_iso, i.region, i.size_category
@@ -157,19 +149,16 @@ def get_market_data(lei_list=None):
         JOIN institutions i ON m.lei = i.lei
     """
     if lei_list:
-        leis_str = "'" + "','".join([str(l) for l in lei_list]) + "'"
-        query += f" WHERE m.lei IN ({leis_str})"
+        query += f" WHERE m.lei IN {LEI_SET}"
     
     try:
-        df = pd.read_sql(query, conn)
-        conn.close()
+        df = read_sql(query, leis=lei_list or None)
         return df
     except Exception as e:
         print(f"ERROR in get_market_data: {e}")
-        conn.close()
         return pd.DataFrame()
 
-@cache_decorator
+@versioned_cache('market_data', 'institutions', ttl=3600)
 def get_market_benchmarking_stats(base_country, base_region, base_size):
     """
     Calculates market data averages for 6 key peer groups:
@@ -184,17 +173,12 @@ def get_market_benchmarking_stats(base_country, base_region, base_size):
     if df_all.empty:
         return pd.DataFrame()
         
-    ATHEX_PEER_LEIS = ['635400L14KNHZXPUZM19'] # Bank of Cyprus
-    CORE_REGIONS = ['Western Europe', 'Northern Europe']
-    SMALL_SIZE = 'Small (<50bn)'
-    
+    index = get_peer_index()
+    if index is None:
+        return pd.DataFrame()
     groups = {
-        "Domestic Avg": df_all[(df_all['country_iso'] == base_country) | (df_all['lei'].isin(ATHEX_PEER_LEIS) if base_country == 'GR' else False)],
-        "Regional (Same Size)": df_all[(df_all['region'] == base_region) & (df_all['size_category'] == base_size)],
-        "Regional (All but Small)": df_all[(df_all['region'] == base_region) & (df_all['size_category'] != SMALL_SIZE)],
-        "Core (Same Size)": df_all[(df_all['region'].isin(CORE_REGIONS)) & (df_all['size_category'] == base_size)],
-        "Core (All but Small)": df_all[(df_all['region'].isin(CORE_REGIONS)) & (df_all['size_category'] != SMALL_SIZE)],
-        "CEE (All)": df_all[df_all['region'] == 'CEE']
+        label: df_all[index.isin(df_all['lei'], bits)]
+        for label, bits in market_groups(index, base_country, base_region, base_size).items()
     }
     
     stats = []
@@ -210,7 +194,7 @@ def get_market_benchmarking_stats(base_country, base_region, base_size):
             
     return pd.DataFrame(stats)
 
-@cache_decorator
+@versioned_cache('market_financial_years', 'institutions', ttl=3600)
 def get_market_fy_averages(base_country, base_region, base_size):
     """
     Calculates FY strategic averages for peer groups.
@@ -219,24 +203,12 @@ def get_market_fy_averages(base_country, base_region, base_size):
     if df_fy_all.empty:
         return pd.DataFrame()
         
-    # Standardize LEI mapping
-    conn = sqlite3.connect(DB_NAME)
-    df_meta = pd.read_sql("SELECT lei, country_iso, region, size_category FROM institutions", conn)
-    conn.close()
-    
-    df_fy_all = pd.merge(df_fy_all, df_meta, on='lei', how='left')
-    
-    ATHEX_PEER_LEIS = ['635400L14KNHZXPUZM19']
-    CORE_REGIONS = ['Western Europe', 'Northern Europe']
-    SMALL_SIZE = 'Small (<50bn)'
-    
+    index = get_peer_index()
+    if index is None:
+        return pd.DataFrame()
     group_filters = {
-        "Domestic Avg": (df_fy_all['country_iso'] == base_country) | (df_fy_all['lei'].isin(ATHEX_PEER_LEIS) if base_country == 'GR' else False),
-        "Regional (Same Size)": (df_fy_all['region'] == base_region) & (df_fy_all['size_category'] == base_size),
-        "Regional (All but Small)": (df_fy_all['region'] == base_region) & (df_fy_all['size_category'] != SMALL_SIZE),
-        "Core (Same Size)": (df_fy_all['region'].isin(CORE_REGIONS)) & (df_fy_all['size_category'] == base_size),
-        "Core (All but Small)": (df_fy_all['region'].isin(CORE_REGIONS)) & (df_fy_all['size_category'] != SMALL_SIZE),
-        "CEE (All)": (df_fy_all['region'] == 'CEE')
+        label: index.isin(df_fy_all['lei'], bits)
+        for label, bits in market_groups(index, base_country, base_region, base_size).items()
     }
     
     fy_stats = []
@@ -669,6 +641,7 @@ def refresh_market_data():
             print("FAIL")
     
     conn.commit()
+    stamp_data_versions(conn, ['market_data'])
     conn.close()
     print("\nDone!")
 
@@ -677,7 +650,7 @@ HISTORY_TICKER_MAP = {
     # '213800DBQIB6VBNU5C64': 'ACBC.SG', # REVERTED: Price in SG (0.84) does not match Athens (1.54/3.81)
 }
 
-@cache_decorator
+@versioned_cache('market_history', 'institutions', ttl=3600)
 def get_market_history(lei_list=None, period="5y"):
     """
     Fetches historical market data for banks with tickers.
@@ -686,27 +659,22 @@ def get_market_history(lei_list=None, period="5y"):
     if not os.path.exists(DB_NAME):
         return pd.DataFrame()
     
-    conn = sqlite3.connect(DB_NAME)
-    
     query = """
         SELECT h.*, COALESCE(i.short_name, i.commercial_name) as name, i.country_iso
         FROM market_history h
         JOIN institutions i ON h.lei = i.lei
     """
     if lei_list:
-        leis_str = "'" + "','".join([str(l) for l in lei_list]) + "'"
-        query += f" WHERE h.lei IN ({leis_str})"
+        query += f" WHERE h.lei IN {LEI_SET}"
     query += " ORDER BY h.date"
     
     try:
-        df = pd.read_sql(query, conn)
-        conn.close()
+        df = read_sql(query, leis=lei_list or None)
         return df
     except:
-        conn.close()
         return pd.DataFrame()
 
-@cache_decorator
+@versioned_cache('market_financial_years', 'institutions', ttl=3600)
 def get_market_financial_years(lei_list=None):
     """
     Fetches strategic market data aligned by Financial Year.
@@ -714,19 +682,17 @@ def get_market_financial_years(lei_list=None):
     if not os.path.exists(DB_NAME):
         return pd.DataFrame()
     
-    conn = sqlite3.connect(DB_NAME)
     query = """
         SELECT f.*, COALESCE(i.short_name, i.commercial_name) as name
         FROM market_financial_years f
         JOIN institutions i ON f.lei = i.lei
     """
     if lei_list:
-        leis_str = "'" + "','".join([str(l) for l in lei_list]) + "'"
-        query += f" WHERE f.lei IN ({leis_str})"
+        query += f" WHERE f.lei IN {LEI_SET}"
     query += " ORDER BY f.fy DESC"
     
     try:
-        df = pd.read_sql(query, conn)
+        df = read_sql(query, leis=lei_list or None)
         # Calculate Strategic Metrics
         
         # 1. Payout Ratio: (Total Payout Amount) / Net Income
@@ -741,11 +707,9 @@ def get_market_financial_years(lei_list=None):
         # 2. Earnings Yield: Net Income / Market Cap
         df['earnings_yield_fy'] = df['net_income'] / df['avg_market_cap']
         
-        conn.close()
         return df
     except Exception as e:
         print(f"Error in get_market_financial_years: {e}")
-        conn.close()
         return pd.DataFrame()
 
 def attribute_date_to_fy(date_obj):
@@ -1275,6 +1239,7 @@ def refresh_market_history():
             print("FAIL")
     
     conn.commit()
+    stamp_data_versions(conn, ['market_history', 'market_financial_years'])
     conn.close()
     print("\nDone!")
 
@@ -1,11 +1,13 @@
 import pandas as pd
-import sqlite3
 import os
-import streamlit as st
 from ..config import DB_NAME
+from .connection import get_connection
+from .query import LEI_SET, json_set, read_sql
 from .base import MIN_PERIOD
+from .notify import notify_error
+from .versions import versioned_cache, DIMENSION_TABLES
 
-@st.cache_data
+@versioned_cache('facts_mrk')
 def get_mrk_filter_options(lei_list):
     """
     Fetches distinct values for filterable columns in facts_mrk for the selected LEIs.
@@ -14,9 +16,6 @@ def get_mrk_filter_options(lei_list):
     if not lei_list or not os.path.exists(DB_NAME):
         return {}
 
-    conn = sqlite3.connect(DB_NAME)
-    leis_str = "'" + "','".join([str(lei) for lei in lei_list]) + "'"
-    
     filter_cols = [
         'portfolio', 
         'mkt_modprod', 
@@ -31,21 +30,19 @@ def get_mrk_filter_options(lei_list):
             query = f"""
             SELECT DISTINCT {col} 
             FROM facts_mrk 
-            WHERE lei IN ({leis_str}) 
+            WHERE lei IN {LEI_SET} 
             AND {col} IS NOT NULL 
             ORDER BY {col}
             """
-            df_col = pd.read_sql(query, conn)
+            df_col = read_sql(query, leis=lei_list)
             options[col] = [str(x) for x in df_col[col].tolist()]
             
     except Exception as e:
-        st.error(f"Error fetching filter options: {e}")
-    finally:
-        conn.close()
+        notify_error(f"Error fetching filter options: {e}")
         
     return options
 
-@st.cache_data
+@versioned_cache(*DIMENSION_TABLES)
 def get_mrk_dim_maps():
     """
     Fetches all relevant dimension mappings (id -> label) for Market Risk.
@@ -54,7 +51,7 @@ def get_mrk_dim_maps():
     if not os.path.exists(DB_NAME):
         return {}
     
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     maps = {}
     
     # Mapping: filter_key -> (dim_table, id_col, label_col)
@@ -74,13 +71,11 @@ def get_mrk_dim_maps():
                 maps[key] = {} # Fail gracefully
                 
     except Exception as e:
-        st.error(f"Error fetching dimension maps: {e}")
-    finally:
-        conn.close()
+        notify_error(f"Error fetching dimension maps: {e}")
 
     return maps
 
-@st.cache_data
+@versioned_cache('facts_mrk', 'institutions', 'dictionary', *DIMENSION_TABLES)
 def get_mrk_data(lei_list, filters=None):
     """
     Fetches data from facts_mrk based on selected LEIs and filters.
@@ -89,11 +84,9 @@ def get_mrk_data(lei_list, filters=None):
     if not lei_list or not os.path.exists(DB_NAME):
         return pd.DataFrame()
 
-    conn = sqlite3.connect(DB_NAME)
-    leis_str = "'" + "','".join([str(lei) for lei in lei_list]) + "'"
-    
-    where_clauses = [f"f.lei IN ({leis_str})"]
+    where_clauses = [f"f.lei IN {LEI_SET}"]
     where_clauses.append(f"f.period >= '{MIN_PERIOD}'")
+    filter_params = {}
     
     if filters:
         for col, values in filters.items():
@@ -101,8 +94,8 @@ def get_mrk_data(lei_list, filters=None):
                 valid_vals = [str(v) for v in values if v is not None]
                 if not valid_vals:
                     continue
-                val_list_str = "'" + "','".join(valid_vals) + "'"
-                where_clauses.append(f"f.{col} IN ({val_list_str})")
+                filter_params[f"f_{col}"] = json_set(valid_vals)
+                where_clauses.append(f"f.{col} IN (SELECT value FROM json_each(:f_{col}))")
     
     where_sql = " AND ".join(where_clauses)
     
@@ -139,11 +132,9 @@ def get_mrk_data(lei_list, filters=None):
     """
     
     try:
-        df = pd.read_sql(query, conn)
+        df = read_sql(query, leis=lei_list, **filter_params)
     except Exception as e:
-        st.error(f"Error fetching Market Risk data: {e}")
+        notify_error(f"Error fetching Market Risk data: {e}")
         df = pd.DataFrame()
-    finally:
-        conn.close()
         
     return df
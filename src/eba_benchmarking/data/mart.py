@@ -0,0 +1,98 @@
+"""
+Materialized bank x period metrics mart.
+
+The pipeline computes the wide benchmarking frame once for every institution
+(see ingestion/processors/build_mart.py) and stores it in `mart_bank_metrics`.
+`mart_percentiles` holds every bank's benchmarking report values (base
+value, peer averages and percentiles per peer group) for every period.
+Readers only use them while they are fresh, i.e. while the data versions of
+the source tables (see versions.py) are those recorded at the build;
+otherwise callers fall back to live computation.
+"""
+from .connection import get_connection
+from .query import LEI_SET, read_sql
+from .versions import VERSION_TABLE
+
+MART_TABLE = 'mart_bank_metrics'
+PERCENTILES_TABLE = 'mart_percentiles'
+MART_INFO_TABLE = 'mart_build_info'
+
+# Tables whose contents feed get_all_benchmarking_metrics
+MART_SOURCE_TABLES = ['institutions', 'dictionary', 'facts_oth', 'facts_cre', 'facts_sov', 'base_rates']
+
+
+def _table_exists(conn, table_name):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone()
+    return row is not None
+
+
+def get_table_signature(conn, table):
+    """
+    Data version of one table, e.g. 'v12', as stamped in the data_version
+    table; None if the table was never stamped (or does not exist).
+
+    Row-count or MAX(rowid) checks miss in-place UPDATEs, so writers bump
+    the version instead: the pipeline's stamp step, and writers that change
+    rows in place through versions.bump_data_versions(). Builders stamp
+    their source tables before recording this signature.
+    """
+    if not _table_exists(conn, VERSION_TABLE):
+        return None
+    row = conn.execute(f"SELECT version FROM {VERSION_TABLE} WHERE table_name = ?", (table,)).fetchone()
+    return f"v{row[0]}" if row else None
+
+
+def get_source_signature(conn):
+    """Fingerprint of the mart's source tables (see get_table_signature)."""
+    return '|'.join(f"{table}:{get_table_signature(conn, table)}" for table in MART_SOURCE_TABLES)
+
+
+def is_mart_fresh(conn=None, table=MART_TABLE):
+    """True if the mart `table` exists and was built from the current source tables."""
+    conn = conn or get_connection()
+    if not _table_exists(conn, table) or not _table_exists(conn, MART_INFO_TABLE):
+        return False
+    row = conn.execute(
+        f"SELECT source_signature FROM {MART_INFO_TABLE} WHERE table_name = ?", (table,)
+    ).fetchone()
+    return row is not None and row[0] == get_source_signature(conn)
+
+
+def get_mart_metrics(lei_list):
+    """
+    Returns mart rows for the given LEIs, or None if the mart is missing or stale.
+    """
+    try:
+        conn = get_connection()
+        if not is_mart_fresh(conn):
+            return None
+        return read_sql(f"SELECT * FROM {MART_TABLE} WHERE lei IN {LEI_SET}", leis=lei_list, conn=conn)
+    except Exception as e:
+        print(f"Error reading {MART_TABLE}, falling back to live computation: {e}")
+        return None
+
+
+def get_mart_percentiles(base_lei, lei_list, peer_key, period=None):
+    """
+    Precomputed report rows of `base_lei` ranked within the peer groups
+    identified by `peer_key`, for `period` (default: the latest period of
+    `lei_list`, as the live report picks it).
+    Returns (rows, period), or None if the table is missing or stale or has
+    no rows for the request.
+    """
+    try:
+        conn = get_connection()
+        if not is_mart_fresh(conn, PERCENTILES_TABLE) or not is_mart_fresh(conn, MART_TABLE):
+            return None
+        if period is None:
+            period = read_sql(
+                f"SELECT MAX(period) AS period FROM {MART_TABLE} WHERE lei IN {LEI_SET}", leis=lei_list, conn=conn
+            )['period'].iloc[0]
+        df = read_sql(
+            f"SELECT * FROM {PERCENTILES_TABLE} WHERE lei = :lei AND period = :period AND peer_key = :peer_key",
+            conn=conn, lei=base_lei, period=period, peer_key=peer_key
+        )
+        return (df, period) if not df.empty else None
+    except Exception as e:
+        print(f"Error reading {PERCENTILES_TABLE}, falling back to live computation: {e}")
+        return None
@@ -0,0 +1,37 @@
+"""
+User-facing messages from the data layer.
+
+Inside a running Streamlit app a message is shown with st.error / st.warning;
+in batch jobs, process pools and scripts it is printed. Streamlit is only
+used when the app has already imported it, so the data layer never imports
+it itself.
+"""
+import sys
+
+
+def streamlit_running():
+    """The streamlit module when a Streamlit runtime is running in this process, else None."""
+    if 'streamlit' not in sys.modules:
+        return None
+    import streamlit as st
+    try:
+        from streamlit import runtime
+        return st if runtime.exists() else None
+    except ImportError:
+        return None
+
+
+def notify_error(message):
+    st = streamlit_running()
+    if st is None:
+        print(f"Error: {message}")
+    else:
+        st.error(message)
+
+
+def notify_warning(message):
+    st = streamlit_running()
+    if st is None:
+        print(f"Warning: {message}")
+    else:
+        st.warning(message)
@@ -0,0 +1,60 @@
+"""
+Canonical LEI sets for cache keys.
+
+Data functions are cached on their `lei_list` argument, but callers build it
+with list(set(...)), dict order or a peer-group filter, so the same banks
+arrive in a different order from call to call and miss the cache. Streamlit
+also re-hashes the whole list on every call.
+
+A PeerSet is the sorted, de-duplicated tuple of the LEIs, built once with its
+JSON array (the LEI_SET parameter of query.py) and a digest of it. Cached
+data functions convert `lei_list` to a PeerSet (see versions.versioned_cache)
+and hash it by digest, so logically identical requests share one entry and
+hashing costs O(1) whatever the group size.
+
+    peers = PeerSet(['LEI_B', 'LEI_A', 'LEI_B'])
+    peers == PeerSet(['LEI_A', 'LEI_B'])   # True, same digest
+"""
+import hashlib
+import json
+
+# Arguments of cached data functions that hold a set of LEIs
+PEER_SET_ARGS = ('lei_list',)
+
+
+class PeerSet(tuple):
+    """Sorted, immutable tuple of distinct LEIs with a precomputed JSON array and digest."""
+
+    def __new__(cls, leis=()):
+        if isinstance(leis, PeerSet):
+            return leis
+        if isinstance(leis, str):
+            leis = [leis]
+        peers = super().__new__(cls, sorted({str(lei) for lei in leis}))
+        peers.json = json.dumps(list(peers))
+        peers.digest = hashlib.sha1(peers.json.encode()).hexdigest()
+        return peers
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __repr__(self):
+        return f"PeerSet({len(self)} LEIs, {self.digest[:12]})"
+
+
+def peer_set_digest(peers):
+    """Cache hash of a PeerSet (its digest, O(1))."""
+    return peers.digest
+
+
+def canonical_lei_args(signature, args, kwargs):
+    """
+    (args, kwargs) with every PEER_SET_ARGS argument of `signature` turned
+    into a PeerSet; None (no filter) is kept as is.
+    """
+    bound = signature.bind(*args, **kwargs)
+    for name in PEER_SET_ARGS:
+        value = bound.arguments.get(name)
+        if value is not None and not isinstance(value, PeerSet):
+            bound.arguments[name] = PeerSet(value)
+    return bound.args, bound.kwargs
@@ -0,0 +1,250 @@
+"""
+Peer-group membership index.
+
+get_benchmark_leis(), get_benchmarking_peer_groups(), the sidebar strategies
+in app.py and the market peer averages each filtered the institutions table
+with pandas masks (and mostly re-read it per call). PeerIndex reads it once
+and gives every institution a dense ordinal; each attribute value (country,
+region, size category, systemic importance) is kept as a bitset: a Python int
+with bit i set for the bank with ordinal i.
+
+A peer group is then a few AND / OR / AND-NOT operations on those ints,
+checking one bank is a shift and a mask, and a group turns into a bool mask
+or an LEI list (in ordinal order) only when a query needs it.
+
+    index = get_peer_index()
+    groups = benchmark_groups(index, 'GR', 'Southern Europe', 'Large (200-500bn)')
+    index.leis(groups['EU Large'])
+"""
+import os
+import numpy as np
+import pandas as pd
+from ..config import DB_NAME
+from .connection import get_connection
+from .versions import versioned_cache
+
+# Bank of Cyprus LEI (ATHEX-listed, treated as domestic for Greek banks)
+ATHEX_PEER_LEIS = ['635400L14KNHZXPUZM19']
+
+LARGE_SIZES = ['Large (200-500bn)', 'Huge (>500bn)']
+SMALL_SIZE = 'Small (<50bn)'
+CORE_REGIONS = ['Western Europe', 'Northern Europe']
+CEE_REGION = 'CEE'  # Database uses 'CEE' for Central and Eastern Europe
+SYSTEMIC_BANKS = ['GSIB', 'OSII']
+
+INDEX_COLUMNS = ['country_iso', 'region', 'size_category', 'Systemic_Importance']
+
+# Sidebar strategies of app.py, in display order ("Manual Selection" is not an index group)
+PEER_STRATEGIES = [
+    "Domestic Peers (incl. BoC)",
+    "Regional (Same Size)",
+    "Regional (All but Small)",
+    "Core (Same Size)",
+    "Core (All but Small)",
+    "CEE (All)",
+]
+
+
+def _mask_to_bits(mask):
+    """Bool array (bank ordinal order) -> bitset."""
+    packed = np.packbits(np.asarray(mask, dtype=bool), bitorder='little')
+    return int.from_bytes(packed.tobytes(), 'little')
+
+
+class PeerIndex:
+    """
+    Bitsets over a dense bank ordinal, built once from institution rows
+    (lei plus INDEX_COLUMNS; a commercial_name column marks named banks).
+    """
+
+    def __init__(self, df):
+        df = df.reset_index(drop=True)
+        self.lei_array = df['lei'].astype(str).to_numpy()
+        self.ordinal = {lei: i for i, lei in enumerate(self.lei_array)}
+        self.size = len(self.lei_array)
+        self.all = (1 << self.size) - 1
+        self.attributes = {}
+        self._values = {}
+        self._missing = {}
+        for col in INDEX_COLUMNS:
+            values = df[col] if col in df.columns else pd.Series([None] * self.size)
+            missing = values.isna().to_numpy()
+            self.attributes[col] = values.where(~missing, None).tolist()
+            self._missing[col] = _mask_to_bits(missing)
+            codes, uniques = pd.factorize(values)
+            self._values[col] = {value: _mask_to_bits(codes == code) for code, value in enumerate(uniques)}
+        if 'commercial_name' in df.columns:
+            self.named = _mask_to_bits(df['commercial_name'].notna().to_numpy())
+        else:
+            self.named = self.all
+
+    def __len__(self):
+        return self.size
+
+    def where(self, column, *values):
+        """Banks whose `column` equals any of `values` (a missing value matches nothing, as ==)."""
+        lookup = self._values[column]
+        bits = 0
+        for value in values:
+            if not pd.isna(value):
+                bits |= lookup.get(value, 0)
+        return bits
+
+    def missing(self, column):
+        """Banks with no value in `column`."""
+        return self._missing[column]
+
+    def bits(self, leis):
+        """Bitset of `leis`; LEIs not in the index are ignored."""
+        bits = 0
+        for lei in leis:
+            i = self.ordinal.get(str(lei))
+            if i is not None:
+                bits |= 1 << i
+        return bits
+
+    def contains(self, bits, lei):
+        i = self.ordinal.get(str(lei))
+        return i is not None and bool(bits >> i & 1)
+
+    def count(self, bits):
+        return bin(bits).count('1')
+
+    def mask(self, bits):
+        """Bool array over the bank ordinal."""
+        raw = np.frombuffer(bits.to_bytes((self.size + 7) // 8, 'little'), dtype=np.uint8)
+        return np.unpackbits(raw, count=self.size, bitorder='little').astype(bool)
+
+    def leis(self, bits):
+        """LEIs of a bitset, in ordinal order."""
+        return self.lei_array[self.mask(bits)].tolist()
+
+    def value(self, lei, column):
+        """Attribute of one bank (None when missing or unknown)."""
+        i = self.ordinal.get(str(lei))
+        return None if i is None else self.attributes[column][i]
+
+    def positions(self, leis):
+        """Ordinal of each of `leis` (-1 for LEIs not in the index)."""
+        return np.array([self.ordinal.get(str(lei), -1) for lei in leis], dtype=int)
+
+    def membership(self, bitsets, leis):
+        """Bool matrix len(bitsets) x len(leis): whether each LEI is in each bitset."""
+        positions = self.positions(leis)
+        known = positions >= 0
+        matrix = np.zeros((len(bitsets), len(positions)), dtype=bool)
+        for g, bits in enumerate(bitsets):
+            if bits:
+                matrix[g, known] = self.mask(bits)[positions[known]]
+        return matrix
+
+    def isin(self, leis, bits):
+        """Bool mask for `leis` (e.g. a frame's lei column), as leis.isin(self.leis(bits))."""
+        return self.membership([bits], leis)[0]
+
+
+def load_peer_index(conn):
+    """PeerIndex of every institution on `conn`."""
+    df = pd.read_sql(
+        "SELECT lei, commercial_name, country_iso, region, Systemic_Importance, size_category FROM institutions",
+        conn,
+    )
+    return PeerIndex(df)
+
+
+@versioned_cache('institutions')
+def get_peer_index():
+    """The PeerIndex of the institutions table, or None without a readable database."""
+    if not os.path.exists(DB_NAME):
+        return None
+    try:
+        return load_peer_index(get_connection())
+    except Exception as e:
+        print(f"Error building peer index: {e}")
+        return None
+
+
+def benchmark_groups(index, country_iso, region, size_category=None):
+    """
+    Bitsets of the benchmarking peer groups:
+    - Domestic Avg: Same country banks (incl. Bank of Cyprus for GR)
+    - Regional (Same Size): Same region, other country, same size category
+    - EU (Same Size): All EU banks with same size category
+    - EU Large: All EU banks with Large + Huge size categories
+
+    Banks with no size_category are excluded.
+    """
+    sized = index.all & ~index.missing('size_category')
+
+    dom = index.where('country_iso', country_iso)
+    if country_iso == 'GR':
+        dom |= index.bits(ATHEX_PEER_LEIS)
+
+    same_size = index.where('size_category', size_category) if size_category else 0
+    other_country = index.all & ~index.where('country_iso', country_iso)
+
+    return {
+        "Domestic Avg": dom & sized,
+        "Regional (Same Size)": index.where('region', region) & other_country & same_size,
+        "EU (Same Size)": same_size,
+        "EU Large": index.where('size_category', *LARGE_SIZES),
+    }
+
+
+def market_groups(index, country_iso, region, size_category):
+    """
+    Bitsets of the market peer groups (every institution, base bank included):
+    Domestic Avg, Regional (Same Size / All but Small), Core (Same Size /
+    All but Small) and CEE (All).
+    """
+    dom = index.where('country_iso', country_iso)
+    if country_iso == 'GR':
+        dom |= index.bits(ATHEX_PEER_LEIS)
+
+    same_size = index.where('size_category', size_category)
+    not_small = index.all & ~index.where('size_category', SMALL_SIZE)
+    regional = index.where('region', region)
+    core = index.where('region', *CORE_REGIONS)
+
+    return {
+        "Domestic Avg": dom,
+        "Regional (Same Size)": regional & same_size,
+        "Regional (All but Small)": regional & not_small,
+        "Core (Same Size)": core & same_size,
+        "Core (All but Small)": core & not_small,
+        "CEE (All)": index.where('region', CEE_REGION),
+    }
+
+
+def strategy_peers(index, strategy, base_lei):
+    """
+    Bitset of the peers an app.py sidebar strategy selects for `base_lei`
+    (named banks only, base bank excluded). A base bank without a size
+    category is compared with the other banks without one.
+    """
+    country_iso = index.value(base_lei, 'country_iso')
+    region = index.value(base_lei, 'region')
+    size_category = index.value(base_lei, 'size_category')
+
+    if size_category is None:
+        same_size = index.missing('size_category')
+    else:
+        same_size = index.where('size_category', size_category)
+    not_small = index.all & ~index.where('size_category', SMALL_SIZE)
+    core = index.where('region', *CORE_REGIONS)
+
+    if strategy == "Domestic Peers (incl. BoC)":
+        bits = (index.where('country_iso', country_iso) | index.bits(ATHEX_PEER_LEIS)) & index.where('Systemic_Importance', *SYSTEMIC_BANKS)
+    elif strategy == "Regional (Same Size)":
+        bits = index.where('region', region) & same_size
+    elif strategy == "Regional (All but Small)":
+        bits = index.where('region', region) & not_small
+    elif strategy == "Core (Same Size)":
+        bits = core & same_size
+    elif strategy == "Core (All but Small)":
+        bits = core & not_small
+    elif strategy == "CEE (All)":
+        bits = index.where('region', CEE_REGION)
+    else:
+        raise ValueError(f"Unknown peer strategy '{strategy}', expected one of {PEER_STRATEGIES}")
+    return bits & index.named & ~index.bits([base_lei])
@@ -0,0 +1,255 @@
+"""
+Query helper for LEI / item sets.
+
+Instead of inlining `'lei1','lei2',...` into the SQL text, data functions
+write `f.lei IN {LEI_SET}` and bind the set as one JSON array parameter that
+SQLite expands with json_each(). The SQL text no longer depends on the peer
+group, so the connection's statement cache reuses the prepared plan and
+large groups (e.g. "EU (Same Size)") do not produce huge statements.
+
+read_sql() runs on SQLite by default, or on DuckDB when DATA_BACKEND is
+'duckdb' (see duckdb_backend.py).
+
+    python -m eba_benchmarking.data.query   # inline vs bound benchmark by peer-group size
+"""
+import json
+import time
+import statistics
+import threading
+from collections import OrderedDict
+import pandas as pd
+from .connection import get_connection
+from .peer_set import PeerSet
+from ..config import DB_STATEMENT_CACHE_SIZE, DATA_BACKEND
+from .base import MIN_PERIOD
+from . import duckdb_backend
+
+# SQL fragments for `column IN ...`, bound via set_params()
+LEI_SET = "(SELECT value FROM json_each(:leis))"
+ITEM_SET = "(SELECT value FROM json_each(:items))"
+
+_stats_lock = threading.Lock()
+_stats = {'executions': 0, 'reused_statements': 0}
+
+BACKENDS = ('sqlite', 'duckdb')
+_backend = {'name': 'sqlite'}
+
+
+def json_set(values):
+    """Serializes a collection as the JSON array bound into json_each()."""
+    if isinstance(values, PeerSet):
+        return values.json
+    return json.dumps([str(v) for v in values])
+
+
+def set_params(leis=None, items=None, **extra):
+    """Builds the named-parameter dict for queries using LEI_SET / ITEM_SET."""
+    params = dict(extra)
+    if leis is not None:
+        params['leis'] = json_set(leis)
+    if items is not None:
+        params['items'] = json_set(items)
+    return params
+
+
+class StatementLRU:
+    """
+    Model of the sqlite3 statement cache: an LRU of SQL texts of the
+    connection's cached_statements size. access() is True when the text is
+    still cached, i.e. the prepared statement would be reused. An estimate,
+    not a measurement: sqlite3 does not expose its cache hits.
+    """
+
+    def __init__(self, size=DB_STATEMENT_CACHE_SIZE):
+        self.size = size
+        self._texts = OrderedDict()
+
+    def __len__(self):
+        return len(self._texts)
+
+    def access(self, sql):
+        if sql in self._texts:
+            self._texts.move_to_end(sql)
+            return True
+        self._texts[sql] = True
+        if len(self._texts) > self.size:
+            self._texts.popitem(last=False)
+        return False
+
+
+# One model for every read_sql() call (each thread's connection has its own cache)
+_statements = StatementLRU()
+
+
+def _record(sql):
+    with _stats_lock:
+        _stats['executions'] += 1
+        if _statements.access(sql):
+            _stats['reused_statements'] += 1
+
+
+def get_backend():
+    """Name of the engine read_sql() currently uses."""
+    return _backend['name']
+
+
+def set_backend(name):
+    """Switches the engine used by read_sql() ('sqlite' or 'duckdb')."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown data backend '{name}', expected one of {BACKENDS}")
+    if name == 'duckdb' and not duckdb_backend.DUCKDB_AVAILABLE:
+        raise ImportError("DATA_BACKEND='duckdb' requires the duckdb package (pip install duckdb)")
+    _backend['name'] = name
+
+
+def read_sql(sql, leis=None, items=None, conn=None, **extra):
+    """
+    Runs a query with LEI/item sets bound as parameters and returns a DataFrame.
+    An explicit `conn` always runs on that SQLite connection.
+    """
+    params = set_params(leis, items, **extra)
+    if conn is None and _backend['name'] == 'duckdb':
+        return duckdb_backend.read_sql(sql, params)
+    conn = conn or get_connection()
+    _record(sql)
+    return pd.read_sql(sql, conn, params=params)
+
+
+def item_columns(item_labels):
+    """{item_id: label} -> {label: ([item_id, ...], None)}; items sharing a label are summed together."""
+    columns = {}
+    for item_id, label in item_labels.items():
+        columns.setdefault(str(label), ([], None))[0].append(str(item_id))
+    return columns
+
+
+def wide_columns(columns, alias='f'):
+    """
+    Conditional-aggregation SQL for {column: (item_ids, condition)}: one
+    `SUM(CASE WHEN item_id = :wN [AND condition] THEN amount END)` per column.
+    `condition` is optional SQL on the same row (e.g. a dimension filter).
+    Returns (sql_fragment, params).
+    """
+    cols, params = [], {}
+    for column, (ids, condition) in columns.items():
+        names = []
+        for item_id in ids:
+            name = f"w{len(params)}"
+            params[name] = str(item_id)
+            names.append(f":{name}")
+        cond = f"{alias}.item_id = {names[0]}" if len(names) == 1 else f"{alias}.item_id IN ({', '.join(names)})"
+        if condition:
+            cond = f"{cond} AND {condition}"
+        quoted = str(column).replace('"', '""')
+        cols.append(f'SUM(CASE WHEN {cond} THEN {alias}.amount END) AS "{quoted}"')
+    return ',\n        '.join(cols), params
+
+
+def read_aggregates(table, columns, leis, with_name=True, conn=None):
+    """
+    Fetches the aggregates in `columns` ({column: (item_ids, condition)}) for
+    the given LEIs as one row per (lei, period), pivoted by the engine instead
+    of pandas. With `with_name`, also returns the bank's display name.
+    Columns without data for a bank-period are NULL (NaN), as after pivot_table.
+    """
+    sql_cols, params = wide_columns(columns)
+    if with_name:
+        name_col = "COALESCE(i.short_name, i.commercial_name) AS name, "
+        join = "JOIN institutions i ON f.lei = i.lei"
+        group = "f.lei, i.short_name, i.commercial_name, f.period"
+    else:
+        name_col, join, group = "", "", "f.lei, f.period"
+
+    items = sorted({str(item_id) for ids, _ in columns.values() for item_id in ids})
+    sql = f"""
+    SELECT f.lei, {name_col}f.period,
+        {sql_cols}
+    FROM {table} f
+    {join}
+    WHERE f.lei IN {LEI_SET}
+      AND f.item_id IN {ITEM_SET}
+      AND f.period >= '{MIN_PERIOD}'
+    GROUP BY {group}
+    """
+    return read_sql(sql, leis=leis, items=items, conn=conn, **params)
+
+
+def read_wide(table, item_labels, leis, with_name=True, conn=None):
+    """
+    Fetches `item_labels` ({item_id: label}, e.g. config.SOLVENCY_ITEMS) as one
+    row per (lei, period) with one column per label (see read_aggregates).
+    """
+    return read_aggregates(table, item_columns(item_labels), leis, with_name=with_name, conn=conn)
+
+
+def get_query_stats():
+    """
+    Returns query helper counters:
+    - executions: SQLite queries run through read_sql()
+    - cached_statements: SQL texts in the modelled statement cache (see StatementLRU)
+    - reused_statements: executions whose SQL text was still cached, an
+      estimate of prepared-statement reuse, not measured plan-cache hits
+    - reuse_ratio: reused_statements / executions
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+        stats['cached_statements'] = len(_statements)
+    stats['reuse_ratio'] = stats['reused_statements'] / stats['executions'] if stats['executions'] else 0.0
+    return stats
+
+try:
+    set_backend(DATA_BACKEND)
+except (ValueError, ImportError) as e:
+    print(f"Data backend '{DATA_BACKEND}' unavailable, using sqlite: {e}")
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+_BENCH_SQL = (
+    "SELECT f.lei, f.period, f.item_id, f.amount FROM facts_oth f "
+    "WHERE f.lei IN {leis} AND f.item_id IN {items} AND f.period >= '" + MIN_PERIOD + "'"
+)
+_BENCH_ITEMS = ['2520102', '2520138', '2521010']
+
+
+def benchmark_lei_binding(group_sizes=(5, 20, 50, 100, 200), repeats=10):
+    """
+    Compares inlined IN-strings with json_each binding for growing peer groups.
+    Each repeat uses a different group (a shifted window of LEIs), as happens
+    when users switch base bank. Returns one row per (mode, group size) with
+    median latency and the executions whose SQL text a StatementLRU still
+    held (estimated statement reuse, not measured plan-cache hits).
+    """
+    conn = get_connection()
+    all_leis = [r[0] for r in conn.execute("SELECT lei FROM institutions ORDER BY lei").fetchall()]
+    rows = []
+    for size in group_sizes:
+        size = min(size, len(all_leis))
+        groups = [(all_leis[i:] + all_leis[:i])[:size] for i in range(repeats)]
+        for mode in ('inline', 'json_each'):
+            statements, reused, timings = StatementLRU(), 0, []
+            for leis in groups:
+                if mode == 'inline':
+                    leis_str = "(" + ",".join(f"'{lei}'" for lei in leis) + ")"
+                    items_str = "(" + ",".join(f"'{i}'" for i in _BENCH_ITEMS) + ")"
+                    sql, params = _BENCH_SQL.format(leis=leis_str, items=items_str), {}
+                else:
+                    sql, params = _BENCH_SQL.format(leis=LEI_SET, items=ITEM_SET), set_params(leis, _BENCH_ITEMS)
+                reused += statements.access(sql)
+                start = time.perf_counter()
+                conn.execute(sql, params).fetchall()
+                timings.append((time.perf_counter() - start) * 1000)
+            rows.append({
+                'mode': mode,
+                'group_size': size,
+                'median_ms': statistics.median(timings),
+                'est_statement_reuse': reused,
+                'executions': len(groups),
+                'sql_chars': len(sql),
+            })
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    print(benchmark_lei_binding().to_string(index=False))
@@ -0,0 +1,255 @@
+"""
+Vectorized peer ranking for the benchmarking report.
+
+The report compares a base bank with every peer group on every
+BENCHMARKING_METRICS entry. Instead of filtering the frame per
+(metric, group) and counting in Python, the engine builds once:
+
+- a metric matrix: banks x metrics (NaN where a bank has no value)
+- a membership matrix: groups x banks (bool)
+
+Weighted averages for all groups and metrics are then matrix products
+(sums of weight * value and of weights), and percentiles come from
+np.searchsorted on each group's sorted metric columns, so any number of
+base banks is ranked in one pass.
+
+peer_group_averages() is the time-series counterpart used by the tabs'
+get_*_averages(): every group's weighted means per period from one groupby
+of sum-of-products and sum-of-weights.
+"""
+import numpy as np
+import pandas as pd
+
+
+def membership_matrix(leis, groups, index=None):
+    """
+    (group names, bool matrix groups x banks) for `leis` in bank order.
+    With a PeerIndex, `groups` holds its bitsets instead of LEI lists.
+    """
+    names = list(groups)
+    if index is not None:
+        return names, index.membership([groups[name] for name in names], leis)
+    leis = pd.Index(leis)
+    matrix = np.zeros((len(names), len(leis)), dtype=bool)
+    for g, name in enumerate(names):
+        if groups[name]:
+            matrix[g] = leis.isin(groups[name])
+    return names, matrix
+
+
+def metric_matrix(df, columns):
+    """Float matrix banks x metrics; metrics missing from df are all NaN."""
+    values = np.full((len(df), len(columns)), np.nan)
+    for j, col in enumerate(columns):
+        if col in df.columns:
+            values[:, j] = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+    return values
+
+
+def weighted_peer_averages(values, weights, membership):
+    """
+    Averages groups x metrics: weighted by `weights` over each group's banks
+    with a value, or the plain mean where those weights do not sum to > 0.
+    NaN where a group has no value for a metric.
+    """
+    valid = ~np.isnan(values)
+    v = np.where(valid, values, 0.0)
+    w = np.where(valid, weights[:, None], 0.0)
+    m = membership.astype(float)
+
+    count = m @ valid.astype(float)
+    sum_v = m @ v
+    sum_w = m @ w
+    sum_wv = m @ (w * v)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg = np.where(sum_w > 0, sum_wv / sum_w, sum_v / count)
+    return np.where(count > 0, avg, np.nan)
+
+
+def sorted_peer_values(values, membership):
+    """
+    Per group: (metric columns sorted ascending with NaN last, count of
+    non-NaN values per metric). Built once, reused for every base bank.
+    """
+    return [(np.sort(values[member], axis=0), (~np.isnan(values[member])).sum(axis=0))
+            for member in membership]
+
+
+def peer_percentiles(sorted_peers, base_values, directions):
+    """
+    Percentile (0-100, higher is better) of each base bank within each group,
+    as calculate_percentiles() computes it: the share of a group's peers the
+    base value beats (is above, or below when lower is better).
+
+    base_values: banks x metrics; directions: higher_is_better per metric.
+    Returns base banks x groups x metrics, NaN where there is nothing to rank.
+    """
+    base_values = np.atleast_2d(base_values)
+    result = np.full((base_values.shape[0], len(sorted_peers), base_values.shape[1]), np.nan)
+    for g, (peers, counts) in enumerate(sorted_peers):
+        for j, higher_is_better in enumerate(directions):
+            n = counts[j]
+            if n == 0:
+                continue
+            column = peers[:n, j]
+            base = base_values[:, j]
+            if higher_is_better is False:
+                beaten = n - np.searchsorted(column, base, side='right')
+            else:
+                beaten = np.searchsorted(column, base, side='left')
+            result[:, g, j] = np.where(np.isnan(base), np.nan, np.round(beaten / n * 100, 0))
+    return result
+
+
+def rank_against_peers(df, columns, directions, groups, base_leis, weight_col='Total Assets', index=None):
+    """
+    Peer averages and base-bank percentiles for one period's bank rows.
+    - df: one row per bank (lei + metric columns)
+    - groups: {group name: [lei, ...]}, or {group name: bitset} of `index`
+    Returns (group names, averages groups x metrics, base values
+    base banks x metrics, percentiles base banks x groups x metrics).
+    A base LEI missing from df ranks with NaN values.
+    """
+    names, membership = membership_matrix(df['lei'], groups, index)
+    values = metric_matrix(df, columns)
+    if weight_col in df.columns:
+        weights = pd.to_numeric(df[weight_col], errors='coerce').fillna(1).to_numpy(dtype=float)
+    else:
+        weights = np.ones(len(df))
+
+    averages = weighted_peer_averages(values, weights, membership)
+
+    # First row of each base LEI, as df[df['lei'] == lei].iloc[0]
+    first_row = pd.Series(np.arange(len(df)), index=df['lei'].to_numpy())
+    first_row = first_row[~first_row.index.duplicated()]
+    position = first_row.reindex(list(base_leis)).fillna(-1).to_numpy(dtype=int)
+    base_values = np.full((len(position), len(columns)), np.nan)
+    found = position >= 0
+    base_values[found] = values[position[found]]
+    percentiles = peer_percentiles(sorted_peer_values(values, membership), base_values, directions)
+    return names, averages, base_values, percentiles
+
+
+def peer_group_averages(df, weighted, groups, means=(), sums=(), index=None, by='period'):
+    """
+    Peer-group averages of a wide bank-period frame (lei, `by`, metric columns).
+    - weighted: {metric: weight column}; sum(metric * weight) / sum(weight) over
+      the rows where both are present, or the plain mean of the metric where
+      those weights do not sum to > 0
+    - means: columns averaged without weights (NaN ignored)
+    - sums: columns totalled over the group's banks (NaN ignored), e.g. for
+      pooled ratios
+    - groups: {group name: [lei, ...]}, or {group name: bitset} of `index`
+    Metrics missing from df are left out. Returns one row per (group, `by`)
+    with columns [by, metrics..., 'name'], groups in `groups` order.
+    """
+    weighted = {m: w for m, w in weighted.items() if m in df.columns}
+    means = [c for c in means if c in df.columns and c not in weighted]
+    sums = [c for c in sums if c in df.columns]
+    if df.empty or not (weighted or means or sums):
+        return pd.DataFrame()
+
+    names, membership = membership_matrix(df['lei'], groups, index)
+    group_pos, row_pos = np.nonzero(membership)
+    if not len(row_pos):
+        return pd.DataFrame()
+
+    # Banks in several groups are repeated once per group they belong to
+    rows = df.iloc[row_pos]
+    work = {'_group': group_pos, by: rows[by].to_numpy()}
+    sum_cols, count_cols = [], []
+    for j, (metric, weight_col) in enumerate(weighted.items()):
+        v = pd.to_numeric(rows[metric], errors='coerce').to_numpy(dtype=float)
+        if weight_col in rows.columns:
+            w = pd.to_numeric(rows[weight_col], errors='coerce').to_numpy(dtype=float)
+        else:
+            w = np.full(len(v), np.nan)
+        both = ~np.isnan(v) & ~np.isnan(w)
+        work[f'wv{j}'] = np.where(both, v * w, 0.0)
+        work[f'w{j}'] = np.where(both, w, 0.0)
+        work[f'v{j}'] = v
+        sum_cols += [f'wv{j}', f'w{j}', f'v{j}']
+        count_cols.append(f'v{j}')
+    for j, col in enumerate(means):
+        work[f'm{j}'] = pd.to_numeric(rows[col], errors='coerce').to_numpy(dtype=float)
+        sum_cols.append(f'm{j}')
+        count_cols.append(f'm{j}')
+    for j, col in enumerate(sums):
+        work[f's{j}'] = pd.to_numeric(rows[col], errors='coerce').to_numpy(dtype=float)
+        sum_cols.append(f's{j}')
+
+    grouped = pd.DataFrame(work).groupby(['_group', by], sort=True)
+    totals = grouped[sum_cols].sum()
+    counts = grouped[count_cols].count()
+
+    out = pd.DataFrame({by: totals.index.get_level_values(by)})
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for j, metric in enumerate(weighted):
+            sum_w = totals[f'w{j}'].to_numpy()
+            mean = totals[f'v{j}'].to_numpy() / counts[f'v{j}'].to_numpy()
+            out[metric] = np.where(sum_w > 0, totals[f'wv{j}'].to_numpy() / sum_w, mean)
+        for j, col in enumerate(means):
+            out[col] = totals[f'm{j}'].to_numpy() / counts[f'm{j}'].to_numpy()
+    for j, col in enumerate(sums):
+        out[col] = totals[f's{j}'].to_numpy()
+    out['name'] = np.asarray(names, dtype=object)[totals.index.get_level_values('_group')]
+    return out
+
+# =============================================================================
+# QUERY-COUNT CHECK
+# =============================================================================
+
+# SQLite queries (read_sql executions) each get_*_averages() may issue with cold
+# caches: one fetch for the union of its peer groups, whatever their number
+AVERAGES_QUERY_BUDGET = {
+    'solvency.get_solvency_averages': 2,
+    'solvency.get_rwa_composition_averages': 1,
+    'asset_quality.get_asset_quality_averages': 2,
+    'asset_quality.get_aq_breakdown_averages': 1,
+    'sovereign.get_sovereign_averages': 4,
+    'assets.get_assets_averages': 1,
+    'liabilities.get_liabilities_averages': 1,
+    'liquidity.get_liquidity_averages': 1,
+    'profitability.get_profitability_averages': 1,
+}
+
+
+def check_averages_query_counts(country_iso, region, systemic_importance, size_category=None):
+    """
+    Runs every averages function in AVERAGES_QUERY_BUDGET with cleared
+    in-process caches and KPI supersets, bypassing the disk cache, and asserts
+    it stays within its query budget. Returns one row per function: queries,
+    budget and the number of peer groups.
+    """
+    import importlib
+    from .base import get_benchmark_leis
+    from .query import get_query_stats
+    from .cache import clear_caches
+    from .disk_cache import disk_cache_bypassed
+
+    groups = get_benchmark_leis(country_iso, region, systemic_importance, size_category)
+    rows = []
+    for path, budget in AVERAGES_QUERY_BUDGET.items():
+        module, func = path.split('.')
+        averages = getattr(importlib.import_module(f'.{module}', __package__), func)
+        args = (country_iso, region, systemic_importance) if module == 'sovereign' else (country_iso, region, systemic_importance, size_category)
+        clear_caches()
+        before = get_query_stats()['executions']
+        with disk_cache_bypassed():
+            averages(*args)
+        queries = get_query_stats()['executions'] - before
+        assert queries <= budget, f"{path} issued {queries} queries, budget {budget}"
+        rows.append({'function': path, 'queries': queries, 'budget': budget,
+                     'groups': sum(1 for leis in groups.values() if leis)})
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    from .connection import get_connection
+
+    lei, country_iso, region, systemic_importance, size_category = get_connection().execute(
+        "SELECT lei, country_iso, region, Systemic_Importance, size_category FROM institutions "
+        "WHERE size_category IS NOT NULL ORDER BY total_assets DESC LIMIT 1"
+    ).fetchone()
+    print(f"Peer groups of {lei} ({country_iso}, {region}, {size_category})")
+    print(check_averages_query_counts(country_iso, region, systemic_importance, size_category).to_string(index=False))
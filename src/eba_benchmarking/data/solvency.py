@@ -1,65 +1,50 @@
 import pandas as pd
-import sqlite3
-import streamlit as st
 import os
 from ..config import DB_NAME, SOLVENCY_ITEMS
-from .base import MIN_PERIOD, get_benchmark_leis
+from .connection import get_connection
+from .query import LEI_SET, ITEM_SET, read_sql, read_wide
+from .base import MIN_PERIOD, get_benchmark_leis, peer_union
+from .metrics import evaluate_metrics
+from .ranking import peer_group_averages
+from .versions import versioned_cache
+from .superset import kpi_superset
 
-@st.cache_data
+@kpi_superset('facts_oth', 'institutions')
 def get_solvency_kpis(lei_list):
     """Fetches specific solvency items and calculates derived ratios including Texas Ratio and RWA Density."""
     if not lei_list or not os.path.exists(DB_NAME): return pd.DataFrame()
-    conn = sqlite3.connect(DB_NAME)
-    leis_str = "'" + "','".join([str(lei) for lei in lei_list]) + "'"
-    
-    items = list(SOLVENCY_ITEMS.keys())
-    items_str = "'" + "','".join(items) + "'"
-    
-    query = f"""
-    SELECT f.lei, COALESCE(i.short_name, i.commercial_name) as name, f.period, f.item_id, f.amount
-    FROM facts_oth f JOIN institutions i ON f.lei = i.lei
-    WHERE f.lei IN ({leis_str}) AND f.item_id IN ({items_str}) AND f.period >= '{MIN_PERIOD}'
-    """
     try:
-        df = pd.read_sql(query, conn)
+        df_pivot = read_wide('facts_oth', SOLVENCY_ITEMS, lei_list)
         
         # Also fetch Total Assets for RWA Density
         query_assets = f"""
         SELECT f.lei, f.period, f.amount as total_assets
         FROM facts_oth f
-        WHERE f.lei IN ({leis_str}) AND f.item_id = '2521010' AND f.period >= '{MIN_PERIOD}'
+        WHERE f.lei IN {LEI_SET} AND f.item_id = '2521010' AND f.period >= '{MIN_PERIOD}'
         """
-        df_assets = pd.read_sql(query_assets, conn)
-        conn.close()
-        
-        if df.empty: return pd.DataFrame()
-        df_pivot = df.pivot_table(index=['lei', 'name', 'period'], columns='item_id', values='amount', aggfunc='sum').reset_index()
-        
-        df_pivot.rename(columns=SOLVENCY_ITEMS, inplace=True)
-        for col in SOLVENCY_ITEMS.values():
-            if col not in df_pivot.columns: df_pivot[col] = 0
-        
-        # Merge Total Assets
-        if not df_assets.empty:
-            df_pivot = pd.merge(df_pivot, df_assets, on=['lei', 'period'], how='left')
-        else:
-            df_pivot['total_assets'] = 0
-            
-        df_pivot['Total Capital'] = df_pivot['CET1 Capital'] + df_pivot['AT1 Capital'] + df_pivot['Tier 2 Capital']
-        df_pivot['AT1 Ratio (calc)'] = df_pivot.apply(lambda x: x['AT1 Capital'] / x['TREA'] if x['TREA'] > 0 else 0, axis=1)
-        df_pivot['Tier 2 Ratio (calc)'] = df_pivot.apply(lambda x: x['Tier 2 Capital'] / x['TREA'] if x['TREA'] > 0 else 0, axis=1)
-        
-        # RWA Density: TREA / Total Assets
-        df_pivot['RWA Density'] = df_pivot.apply(
-            lambda x: x['TREA'] / x['total_assets'] if x.get('total_assets', 0) > 0 else 0, axis=1
-        )
-        
-        return df_pivot
+        df_assets = read_sql(query_assets, leis=lei_list)
+        return compute_solvency_kpis(df_pivot, df_assets)
     except:
-        if conn: conn.close()
         return pd.DataFrame()
 
-@st.cache_data  
+def compute_solvency_kpis(df_pivot, df_assets):
+    """Derived solvency ratios from the wide SOLVENCY_ITEMS frame and total assets per bank-period."""
+    if df_pivot.empty: return pd.DataFrame()
+    for col in SOLVENCY_ITEMS.values():
+        if col not in df_pivot.columns: df_pivot[col] = 0
+    
+    # Merge Total Assets
+    if not df_assets.empty:
+        df_pivot = pd.merge(df_pivot, df_assets, on=['lei', 'period'], how='left')
+    else:
+        df_pivot['total_assets'] = 0
+        
+    # RWA Density: TREA / Total Assets, as reported (see 'TREA / Assets' in metrics.py)
+    return evaluate_metrics(df_pivot, {'Total Capital': 'Total Capital', 'AT1 Ratio (calc)': 'AT1 Ratio (calc)',
+                                       'Tier 2 Ratio (calc)': 'Tier 2 Ratio (calc)', 'RWA Density': 'TREA / Assets'},
+                            aliases={'Total Assets': 'total_assets'})
+
+@versioned_cache('facts_oth', 'facts_cre', 'institutions')
 def get_solvency_with_texas_ratio(lei_list):
     """Combines solvency KPIs with AQ data to calculate Texas Ratio."""
     from .asset_quality import get_aq_breakdown
@@ -68,7 +53,11 @@ def get_solvency_with_texas_ratio(lei_list):
     if df_solv.empty: return df_solv
     
     df_aq = get_aq_breakdown(lei_list)
-    if df_aq.empty: return df_solv
+    return add_texas_ratio(df_solv, df_aq)
+
+def add_texas_ratio(df_solv, df_aq):
+    """Adds the Texas Ratio to solvency KPIs using NPL amount and provisions from the AQ breakdown."""
+    if df_solv.empty or df_aq.empty: return df_solv
     
     # Merge on lei and period
     df_merged = pd.merge(
@@ -79,41 +68,24 @@ def get_solvency_with_texas_ratio(lei_list):
     )
     
     # Texas Ratio = NPLs / (CET1 Capital + Total Provisions)
-    df_merged['Texas Ratio'] = df_merged.apply(
-        lambda x: x['NPL_Amount'] / (x['CET1 Capital'] + x.get('Total_Provisions', 0)) 
-        if (x['CET1 Capital'] + x.get('Total_Provisions', 0)) > 0 else 0, 
-        axis=1
-    )
-    
-    return df_merged
+    return evaluate_metrics(df_merged, ['Texas Ratio'],
+                            aliases={'npl_amount': 'NPL_Amount', 'total_provisions': 'Total_Provisions'})
 
-@st.cache_data
+@versioned_cache('facts_oth', 'facts_cre', 'institutions')
 def get_solvency_averages(country_iso, region, systemic_importance, size_category=None):
     """Calculates Domestic, Regional, and EU Averages based on Size logic."""
     if not os.path.exists(DB_NAME): return pd.DataFrame()
-    conn = sqlite3.connect(DB_NAME)
     
     groups = get_benchmark_leis(country_iso, region, systemic_importance, size_category)
     
-    items = list(SOLVENCY_ITEMS.keys())
-
-    def get_pivoted_data(lei_list, label):
+    # One fetch for the union of the groups, split by membership in memory
+    def get_pivoted_data(lei_list):
         if not lei_list: return pd.DataFrame()
-        leis_sql = "'" + "','".join([str(l) for l in lei_list]) + "'"
-        
         # 1. Fetch Solvency Items + Total Assets
-        items_with_assets = items + ['2521010']
-        items_str_ext = "'" + "','".join(items_with_assets) + "'"
-        query = f"SELECT lei, period, item_id, amount FROM facts_oth WHERE lei IN ({leis_sql}) AND item_id IN ({items_str_ext}) AND period >= '{MIN_PERIOD}'"
-        df_raw = pd.read_sql(query, conn)
-        
-        if df_raw.empty: return pd.DataFrame()
-        
-        df_banks = df_raw.pivot_table(index=['lei', 'period'], columns='item_id', values='amount', aggfunc='sum').reset_index()
-        
-        # Mapping for readability
         cols_map = {**SOLVENCY_ITEMS, '2521010': 'total_assets'}
-        df_banks.rename(columns=cols_map, inplace=True)
+        df_banks = read_wide('facts_oth', cols_map, lei_list, with_name=False)
+        
+        if df_banks.empty: return pd.DataFrame()
         
         # 2. Fetch NPL & Provisions for Texas Ratio
         # NPL Amount: 2520603 (Gross Loans) with status 2 (Non-performing)
@@ -123,12 +95,12 @@ def get_solvency_averages(country_iso, region, systemic_importance, size_categor
                SUM(CASE WHEN item_id='2520603' AND perf_status='2' THEN amount ELSE 0 END) as NPL_Amount,
                SUM(CASE WHEN item_id='2520613' THEN amount ELSE 0 END) as Total_Provisions
         FROM facts_cre 
-        WHERE lei IN ({leis_sql}) 
+        WHERE lei IN {LEI_SET} 
           AND item_id IN ('2520603', '2520613')
           AND period >= '{MIN_PERIOD}'
         GROUP BY lei, period
         """
-        df_aq = pd.read_sql(query_aq, conn)
+        df_aq = read_sql(query_aq, leis=lei_list)
         
         if not df_aq.empty:
             df_banks = pd.merge(df_banks, df_aq, on=['lei', 'period'], how='left')
@@ -139,70 +111,47 @@ def get_solvency_averages(country_iso, region, systemic_importance, size_categor
             df_banks['Total_Provisions'] = 0
 
         # --- WEIGHTED AVERAGES ---
-        def weighted_avg(group):
-            d = {}
-            # We must handle NaNs: only average over banks that have the data
-            def get_w_avg(metric_col, weight_col):
-                if metric_col not in group.columns or weight_col not in group.columns: return 0
-                valid = group[[metric_col, weight_col]].dropna()
-                if not valid.empty and valid[weight_col].sum() > 0:
-                    return (valid[metric_col] * valid[weight_col]).sum() / valid[weight_col].sum()
-                return group[metric_col].mean() # Fallback
+        # Bank-level AT1/T2 ratios and RWA Density, averaged like the reported ratios
+        weighted = {'CET1 Ratio': 'TREA', 'Total Capital Ratio': 'TREA', 'Leverage Ratio': 'TREA'}
+        if 'AT1 Capital' in df_banks.columns and 'TREA' in df_banks.columns:
+            df_banks['AT1 Ratio (calc)'] = df_banks['AT1 Capital'] / df_banks['TREA']
+            weighted['AT1 Ratio (calc)'] = 'TREA'
+        if 'Tier 2 Capital' in df_banks.columns and 'TREA' in df_banks.columns:
+            df_banks['Tier 2 Ratio (calc)'] = df_banks['Tier 2 Capital'] / df_banks['TREA']
+            weighted['Tier 2 Ratio (calc)'] = 'TREA'
+        if 'TREA' in df_banks.columns and 'total_assets' in df_banks.columns:
+            df_banks['RWA Density'] = df_banks['TREA'] / df_banks['total_assets']
+            weighted['RWA Density'] = 'total_assets'
 
-            d['CET1 Ratio'] = get_w_avg('CET1 Ratio', 'TREA')
-            d['Total Capital Ratio'] = get_w_avg('Total Capital Ratio', 'TREA')
-            d['Leverage Ratio'] = get_w_avg('Leverage Ratio', 'TREA')
-            
-            # AT1/T2 Ratios
-            if 'AT1 Capital' in group.columns and 'TREA' in group.columns:
-                group['AT1_R'] = group['AT1 Capital'] / group['TREA']
-                d['AT1 Ratio (calc)'] = get_w_avg('AT1_R', 'TREA')
-            
-            if 'Tier 2 Capital' in group.columns and 'TREA' in group.columns:
-                group['T2_R'] = group['Tier 2 Capital'] / group['TREA']
-                d['Tier 2 Ratio (calc)'] = get_w_avg('T2_R', 'TREA')
-            
-            # RWA Density: TREA / Total Assets
-            if 'TREA' in group.columns and 'total_assets' in group.columns:
-                group['RWA_Den'] = group['TREA'] / group['total_assets']
-                d['RWA Density'] = get_w_avg('RWA_Den', 'total_assets')
+        # Absolute Amounts (Mean of reporting banks)
+        amounts = ['CET1 Capital', 'AT1 Capital', 'Tier 2 Capital', 'TREA', 'total_assets', 'NPL_Amount', 'Total_Provisions']
 
-            # Absolute Amounts (Mean of reporting banks)
-            for col in ['CET1 Capital', 'AT1 Capital', 'Tier 2 Capital', 'TREA', 'total_assets', 'NPL_Amount', 'Total_Provisions']:
-                if col in group.columns:
-                    d[col] = group[col].mean()
-            
-            d['Total Capital'] = sum([d.get(c, 0) for c in ['CET1 Capital', 'AT1 Capital', 'Tier 2 Capital'] if pd.notna(d.get(c))])
-            
-            # Texas Ratio (Weighted for Group): Sum(NPL) / Sum(CET1 + Prov)
-            if 'NPL_Amount' in group.columns and 'CET1 Capital' in group.columns and 'Total_Provisions' in group.columns:
-                valid_tx = group[(group['CET1 Capital'].notnull()) | (group['Total_Provisions'].notnull())]
-                agg_npl = valid_tx['NPL_Amount'].sum()
-                agg_cap = valid_tx['CET1 Capital'].sum()
-                agg_prov = valid_tx['Total_Provisions'].sum()
-                if (agg_cap + agg_prov) > 0:
-                    d['Texas Ratio'] = agg_npl / (agg_cap + agg_prov)
-                else:
-                    d['Texas Ratio'] = 0
+        # Texas Ratio (Weighted for Group): Sum(NPL) / Sum(CET1 + Prov) over banks reporting either
+        texas = 'CET1 Capital' in df_banks.columns
+        if texas:
+            valid_tx = (df_banks['CET1 Capital'].notnull()) | (df_banks['Total_Provisions'].notnull())
+            df_banks['tx_npl'] = df_banks['NPL_Amount'].where(valid_tx)
+            df_banks['tx_cap'] = (df_banks['CET1 Capital'].fillna(0) + df_banks['Total_Provisions'].fillna(0)).where(valid_tx)
 
-            return pd.Series(d)
-        
-        df_f = df_banks.groupby('period').apply(weighted_avg, include_groups=False).reset_index()
-        df_f['name'] = label
+        df_f = peer_group_averages(df_banks, weighted, groups, means=amounts,
+                                   sums=['tx_npl', 'tx_cap'] if texas else ())
+        if df_f.empty: return df_f
+
+        capital_cols = [c for c in ['CET1 Capital', 'AT1 Capital', 'Tier 2 Capital'] if c in df_f.columns]
+        df_f['Total Capital'] = df_f[capital_cols].sum(axis=1)
+        if texas:
+            df_f['Texas Ratio'] = (df_f['tx_npl'] / df_f['tx_cap']).where(df_f['tx_cap'] > 0, 0)
+            df_f = df_f.drop(columns=['tx_npl', 'tx_cap'])
+        df_f['name'] = df_f.pop('name')
         return df_f
 
-    dfs = []
-    for lbl, leis in groups.items():
-        dfs.append(get_pivoted_data(leis, lbl))
-    
-    conn.close()
-    return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+    return get_pivoted_data(peer_union(groups))
 
-@st.cache_data
+@versioned_cache('facts_oth', 'facts_cre', 'institutions')
 def get_regional_peers_raw_data(region, systemic_importance, exclude_country=None, size_category=None):
     """Fetches raw solvency data for Regional peers (Size-based)."""
     if not os.path.exists(DB_NAME): return pd.DataFrame()
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     
     # Base query
     query = "SELECT lei FROM institutions WHERE region = ? AND country_iso != ?"
@@ -213,16 +162,15 @@ def get_regional_peers_raw_data(region, systemic_importance, exclude_country=Non
         params.append(size_category)
     
     leis = pd.read_sql(query, conn, params=params)['lei'].tolist()
-    conn.close()
     return get_solvency_kpis(leis) if leis else pd.DataFrame()
 
-@st.cache_data
+@versioned_cache('facts_oth', 'dictionary', 'institutions')
 def get_rwa_composition_averages(country_iso, region, systemic_importance, size_category=None):
     """
     Calculates Domestic, Regional, EU peer averages for RWA composition.
     """
     if not os.path.exists(DB_NAME): return pd.DataFrame()
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     
     # Get peer groups
     groups = get_benchmark_leis(country_iso, region, systemic_importance, size_category)
@@ -230,65 +178,60 @@ def get_rwa_composition_averages(country_iso, region, systemic_importance, size_
     # Get RWA items from dictionary
     df_dict = pd.read_sql("SELECT item_id, label FROM dictionary WHERE tab_name = 'RWA'", conn)
     if df_dict.empty:
-        conn.close()
         return pd.DataFrame()
     
-    items_str = "'" + "','".join(df_dict['item_id'].tolist()) + "'"
+    # One fetch for the union of the groups: per-bank sums and counts, so each
+    # group's AVG(amount) over its fact rows is a ratio of totals in memory
+    query = f"""
+    SELECT f.lei, f.period, f.item_id, SUM(f.amount) as amount_sum, COUNT(f.amount) as amount_count
+    FROM facts_oth f
+    WHERE f.lei IN {LEI_SET} 
+      AND f.item_id IN {ITEM_SET}
+      AND f.period >= '{MIN_PERIOD}'
+    GROUP BY f.lei, f.period, f.item_id
+    """
+    df_banks = read_sql(query, leis=peer_union(groups), items=df_dict['item_id'])
+    if df_banks.empty: return pd.DataFrame()
     
     all_results = []
     for label, leis in groups.items():
-        if not leis: continue
-        leis_str = "'" + "','".join([str(l) for l in leis]) + "'"
-        
-        query = f"""
-        SELECT f.period, f.item_id, AVG(f.amount) as amount
-        FROM facts_oth f
-        WHERE f.lei IN ({leis_str}) 
-          AND f.item_id IN ({items_str})
-          AND f.period >= '{MIN_PERIOD}'
-        GROUP BY f.period, f.item_id
-        """
-        df_group = pd.read_sql(query, conn)
+        df_group = df_banks[df_banks['lei'].isin(leis)]
         if df_group.empty: continue
+        df_group = df_group.groupby(['period', 'item_id'], as_index=False)[['amount_sum', 'amount_count']].sum()
+        df_group['amount'] = df_group['amount_sum'] / df_group['amount_count']
         
         # Merge with labels
-        df_group = pd.merge(df_group, df_dict, on='item_id', how='left')
+        df_group = pd.merge(df_group[['period', 'item_id', 'amount']], df_dict, on='item_id', how='left')
         df_group['name'] = label
         all_results.append(df_group)
     
-    conn.close()
     return pd.concat(all_results, ignore_index=True) if all_results else pd.DataFrame()
 
-@st.cache_data
+@versioned_cache('facts_oth', 'dictionary', 'institutions')
 def get_rwa_composition(lei_list):
     """
     Fetches RWA breakdown data for selected banks.
     Adapted from get_rwa_composition_averages logic (querying facts_oth).
     """
     if not lei_list or not os.path.exists(DB_NAME): return pd.DataFrame()
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     
     # Get RWA items
     df_dict = pd.read_sql("SELECT item_id, label FROM dictionary WHERE tab_name = 'RWA'", conn)
     if df_dict.empty:
-        conn.close()
         return pd.DataFrame()
     
-    items_str = "'" + "','".join(df_dict['item_id'].tolist()) + "'"
-    leis_str = "'" + "','".join([str(l) for l in lei_list]) + "'"
-    
     # Query facts_oth (where RWA summary data lives)
     query = f"""
     SELECT f.lei, COALESCE(i.short_name, i.commercial_name) as name, f.period, f.item_id, f.amount
     FROM facts_oth f
     JOIN institutions i ON f.lei = i.lei
-    WHERE f.lei IN ({leis_str}) 
-      AND f.item_id IN ({items_str})
+    WHERE f.lei IN {LEI_SET} 
+      AND f.item_id IN {ITEM_SET}
       AND f.period >= '{MIN_PERIOD}'
     """
     try:
-        df = pd.read_sql(query, conn)
-        conn.close()
+        df = read_sql(query, leis=lei_list, items=df_dict['item_id'])
         
         if df.empty: return pd.DataFrame()
         
@@ -297,5 +240,4 @@ def get_rwa_composition(lei_list):
         df['item_id'] = df['item_id'].astype(str)
         return pd.merge(df, df_dict, on='item_id', how='left')
     except:
-        if conn: conn.close()
         return pd.DataFrame()
@@ -1,69 +1,69 @@
 import pandas as pd
-import sqlite3
-import streamlit as st
 import os
 from ..config import DB_NAME
-from .base import MIN_PERIOD, get_benchmark_leis
+from .query import LEI_SET, ITEM_SET, read_sql
+from .base import MIN_PERIOD, get_benchmark_leis, peer_union
+from .versions import versioned_cache
 
-@st.cache_data
+@versioned_cache('facts_sov', 'facts_oth', 'institutions', 'dim_country', 'dim_maturity')
 def get_sovereign_kpis(lei_list):
     """Fetches sovereign exposures by portfolio, country, and maturity."""
     if not lei_list or not os.path.exists(DB_NAME): return pd.DataFrame()
-    conn = sqlite3.connect(DB_NAME)
-    leis_str = "'" + "','".join([str(lei) for lei in lei_list]) + "'"
     port_map = {'2520812': 'Held for trading', '2520813': 'Designated at FV', '2520814': 'FVOCI', '2520815': 'Amortised Cost'}
-    items_str = "'" + "','".join(port_map.keys()) + "'"
     mat_map = {1: 0.125, 2: 0.625, 3: 1.5, 4: 2.5, 5: 4.0, 6: 7.5, 7: 15.0}
     query = f"""
     SELECT f.lei, COALESCE(i.short_name, i.commercial_name) as name, f.period, f.item_id, f.country as country_id, c.label as country_name, c.iso_code as country_iso, i.country_iso as bank_country_iso, f.maturity as maturity_id, m.label as maturity_label, f.amount
     FROM facts_sov f JOIN institutions i ON f.lei = i.lei LEFT JOIN dim_country c ON f.country = c.country LEFT JOIN dim_maturity m ON f.maturity = m.maturity
-    WHERE f.lei IN ({leis_str}) AND f.item_id IN ({items_str}) AND f.period >= '{MIN_PERIOD}' AND f.country != 0 AND f.maturity != 8
+    WHERE f.lei IN {LEI_SET} AND f.item_id IN {ITEM_SET} AND f.period >= '{MIN_PERIOD}' AND f.country != 0 AND f.maturity != 8
     """
     try:
-        df = pd.read_sql(query, conn)
-        df_cet1 = pd.read_sql(f"SELECT lei, period, amount as cet1 FROM facts_oth WHERE lei IN ({leis_str}) AND item_id = '2520102' AND period >= '{MIN_PERIOD}'", conn)
-        conn.close()
+        df = read_sql(query, leis=lei_list, items=port_map.keys())
+        df_cet1 = read_sql(f"SELECT lei, period, amount as cet1 FROM facts_oth WHERE lei IN {LEI_SET} AND item_id = '2520102' AND period >= '{MIN_PERIOD}'", leis=lei_list)
         if df.empty: return pd.DataFrame()
         df['portfolio'] = df['item_id'].map(port_map)
         df['maturity_years'] = df['maturity_id'].map(mat_map)
         return pd.merge(df, df_cet1, on=['lei', 'period'], how='left') if not df_cet1.empty else df.assign(cet1=0)
     except Exception as e:
-        if conn: conn.close()
         return pd.DataFrame()
 
-@st.cache_data
+@versioned_cache('facts_sov', 'facts_oth', 'institutions', 'dim_country')
 def get_sovereign_averages(country_iso, region, systemic_importance):
     """Calculates Domestic, Regional, EU averages for Sovereign metrics."""
     if not os.path.exists(DB_NAME): return pd.DataFrame()
-    conn = sqlite3.connect(DB_NAME)
-    
     groups = get_benchmark_leis(country_iso, region, systemic_importance)
     port_map = {'2520812': 'Held for trading', '2520813': 'Designated at FV', '2520814': 'FVOCI', '2520815': 'Amortised Cost'}
-    items_str = "'2520812','2520813','2520814','2520815'"
     mat_map = {1: 0.125, 2: 0.625, 3: 1.5, 4: 2.5, 5: 4.0, 6: 7.5, 7: 15.0}
+    # One fetch for the union of the groups, split by membership in memory
+    union = peer_union(groups)
+    if not union: return pd.DataFrame()
+    df_all = read_sql(f"SELECT lei, period, item_id, maturity, country as country_id, amount FROM facts_sov WHERE lei IN {LEI_SET} AND item_id IN {ITEM_SET} AND period >= '{MIN_PERIOD}' AND country != 0 AND maturity != 8", leis=union, items=port_map.keys())
+    if df_all.empty: return pd.DataFrame()
+    df_all['portfolio'] = df_all['item_id'].map(port_map); df_all['maturity_years'] = df_all['maturity'].map(mat_map)
+    df_cet1_all = read_sql(f"SELECT lei, period, amount as cet1 FROM facts_oth WHERE lei IN {LEI_SET} AND item_id = '2520102' AND period >= '{MIN_PERIOD}'", leis=union)
+    
+    # Home Bias (Exp to Home Country / CET1)
+    # We need Home Country for each LEI
+    df_home_map = read_sql(f"SELECT lei, country_iso as home_iso FROM institutions WHERE lei IN {LEI_SET}", leis=union)
+    df_exp_all = read_sql(f"SELECT f.lei, f.period, c.iso_code as exp_iso, f.amount FROM facts_sov f LEFT JOIN dim_country c ON f.country = c.country WHERE f.lei IN {LEI_SET} AND f.item_id IN {ITEM_SET} AND f.period >= '{MIN_PERIOD}'", leis=union, items=port_map.keys())
+    df_exp_all = pd.merge(df_exp_all, df_home_map, on='lei')
+    df_exp_all = df_exp_all[df_exp_all['exp_iso'] == df_exp_all['home_iso']]
+    
     all_results = []
     for label, leis in groups.items():
         if not leis: continue
-        leis_sql = "'" + "','".join([str(l) for l in leis]) + "'"
-        df = pd.read_sql(f"SELECT lei, period, item_id, maturity, country as country_id, amount FROM facts_sov WHERE lei IN ({leis_sql}) AND item_id IN ({items_str}) AND period >= '{MIN_PERIOD}' AND country != 0 AND maturity != 8", conn)
+        df = df_all[df_all['lei'].isin(leis)]
         if df.empty: continue
-        df['portfolio'] = df['item_id'].map(port_map); df['maturity_years'] = df['maturity'].map(mat_map)
         df_avg_port = df.groupby(['lei', 'period', 'portfolio'])['amount'].sum().reset_index().groupby(['period', 'portfolio'])['amount'].mean().reset_index()
         df_mat = df.groupby(['period']).apply(lambda x: (x['maturity_years'] * x['amount']).sum() / x['amount'].sum() if x['amount'].sum() > 0 else 0, include_groups=False).reset_index()
         df_mat.columns = ['period', 'mean_maturity']
         df_conc_raw = df.groupby(['lei', 'period', 'country_id']).agg({'amount': 'sum'}).reset_index()
-        df_cet1_grp = pd.read_sql(f"SELECT lei, period, amount as cet1 FROM facts_oth WHERE lei IN ({leis_sql}) AND item_id = '2520102' AND period >= '{MIN_PERIOD}'", conn)
+        df_cet1_grp = df_cet1_all[df_cet1_all['lei'].isin(leis)]
         df_conc = pd.merge(df_conc_raw, df_cet1_grp, on=['lei', 'period'])
         df_bank_max = df_conc.groupby(['lei', 'period']).apply(lambda x: x['amount'].max() / x['cet1'].iloc[0] if x['cet1'].iloc[0] > 0 else 0, include_groups=False).reset_index()
         df_bank_max.columns = ['lei', 'period', 'conc_ratio']
         df_avg_conc = df_bank_max.groupby('period')['conc_ratio'].mean().reset_index().rename(columns={'conc_ratio': 'concentration_ratio'})
         
-        # Home Bias (Exp to Home Country / CET1)
-        # We need Home Country for each LEI
-        df_home_map = pd.read_sql(f"SELECT lei, country_iso as home_iso FROM institutions WHERE lei IN ({leis_sql})", conn)
-        df_exp_home = pd.read_sql(f"SELECT f.lei, f.period, c.iso_code as exp_iso, f.amount FROM facts_sov f LEFT JOIN dim_country c ON f.country = c.country WHERE f.lei IN ({leis_sql}) AND f.item_id IN ({items_str}) AND f.period >= '{MIN_PERIOD}'", conn)
-        df_exp_home = pd.merge(df_exp_home, df_home_map, on='lei')
-        df_exp_home = df_exp_home[df_exp_home['exp_iso'] == df_exp_home['home_iso']]
+        df_exp_home = df_exp_all[df_exp_all['lei'].isin(leis)]
         df_home_sum = df_exp_home.groupby(['lei', 'period'])['amount'].sum().reset_index().rename(columns={'amount': 'home_exp'})
         df_home_r = pd.merge(df_home_sum, df_cet1_grp, on=['lei', 'period'], how='left') # Use left to keep banks with exposure
         # If no home exposure, it's 0 (fill later if needed, but merge handles intersection)
@@ -75,5 +75,4 @@ def get_sovereign_averages(country_iso, region, systemic_importance):
 
         df_combined = pd.merge(pd.merge(pd.merge(df_avg_port, df_mat, on='period', how='left'), df_avg_conc, on='period', how='left'), df_avg_hb, on='period', how='left')
         df_combined['name'] = label; all_results.append(df_combined)
-    conn.close()
     return pd.concat(all_results, ignore_index=True) if all_results else pd.DataFrame()
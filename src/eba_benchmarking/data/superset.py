@@ -0,0 +1,161 @@
+"""
+All-bank KPI frames, sliced per LEI set.
+
+get_solvency_kpis(), get_profitability_kpis(), get_liquidity_kpis(),
+get_assets_kpis() and get_liabilities_kpis() were cached per `lei_list`, so
+every sidebar strategy and every Manual Selection recomputed the KPIs of
+banks already computed for another group. With
+
+    @kpi_superset('facts_oth', 'institutions')
+    def get_solvency_kpis(lei_list): ...
+
+the function runs once for every institution and the frame is kept in
+process memory until the data version of one of its tables changes (see
+versions.py). A request is a boolean mask over the frame's lei column. The
+KPIs are computed per bank-period, so a slice has the same rows and values
+as computing the LEI set on its own.
+
+Memory is bounded by config.KPI_SUPERSET_MAX_MB (least recently used frames
+are dropped) and reported by get_superset_stats():
+
+    python -m eba_benchmarking.data.superset   # build every superset, print rows/MB
+"""
+import time
+import threading
+from collections import OrderedDict
+from functools import wraps
+import pandas as pd
+from ..config import KPI_SUPERSET_MAX_MB
+from .peer_set import PeerSet
+from .peers import get_peer_index
+from .versions import table_versions
+
+_lock = threading.Lock()
+# function name -> {'versions', 'frame', 'bytes', 'built_at', 'build_ms', 'hits'}, least recently used first
+_supersets = OrderedDict()
+_registry = {}
+
+MB = 1024 * 1024
+
+
+def _frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def _all_leis():
+    # From the cached peer index: not a data query, so query budgets are unaffected
+    index = get_peer_index()
+    return PeerSet(index.lei_array if index is not None else ())
+
+
+def _evict(budget):
+    """Drops least recently used frames until the kept frames fit `budget` bytes (lock held)."""
+    while _supersets and sum(entry['bytes'] for entry in _supersets.values()) > budget:
+        _supersets.popitem(last=False)
+
+
+def get_superset(name):
+    """The all-bank frame of a @kpi_superset function, built (or rebuilt) when stale."""
+    func, tables = _registry[name]
+    versions = table_versions(tables)
+    with _lock:
+        entry = _supersets.get(name)
+        if entry is not None and entry['versions'] == versions:
+            _supersets.move_to_end(name)
+            entry['hits'] += 1
+            return entry['frame']
+
+    start = time.perf_counter()
+    frame = func(_all_leis())
+    build_ms = (time.perf_counter() - start) * 1000
+    if frame.empty:
+        return frame
+
+    size = _frame_bytes(frame)
+    budget = KPI_SUPERSET_MAX_MB * MB
+    with _lock:
+        _supersets.pop(name, None)
+        if size <= budget:
+            _evict(budget - size)
+            _supersets[name] = {'versions': versions, 'frame': frame, 'bytes': size,
+                                'built_at': time.time(), 'build_ms': build_ms, 'hits': 0}
+        else:
+            print(f"KPI superset '{name}' ({size / MB:.1f} MB) exceeds KPI_SUPERSET_MAX_MB, not kept")
+    return frame
+
+
+def slice_leis(df, lei_list):
+    """Rows of `df` whose lei is in `lei_list`, as a new frame."""
+    mask = df['lei'].isin(PeerSet(lei_list)).to_numpy()
+    return df[mask].reset_index(drop=True)
+
+
+def kpi_superset(*tables):
+    """
+    Decorator for a get_*_kpis(lei_list) whose rows are computed per bank:
+    the function is called once with every institution and each call returns
+    the slice for `lei_list`. `tables` are the tables the frame is built from.
+    """
+    def decorator(func):
+        _registry[func.__name__] = (func, tables)
+
+        @wraps(func)
+        def wrapper(lei_list):
+            if not lei_list:
+                return pd.DataFrame()
+            try:
+                frame = get_superset(func.__name__)
+            except Exception as e:
+                print(f"Error building KPI superset for {func.__name__}: {e}")
+                return func(lei_list)
+            if frame.empty:
+                return pd.DataFrame()
+            return slice_leis(frame, lei_list)
+
+        wrapper.tables = tables
+        return wrapper
+    return decorator
+
+
+def clear_supersets():
+    """Drops every kept frame (see cache.clear_caches())."""
+    with _lock:
+        _supersets.clear()
+
+
+def get_superset_stats():
+    """
+    One row per kept frame (most recently used last): rows, columns, MB,
+    build time and hits, plus the total against KPI_SUPERSET_MAX_MB.
+    """
+    with _lock:
+        rows = [{
+            'function': name,
+            'rows': len(entry['frame']),
+            'columns': entry['frame'].shape[1],
+            'mb': entry['bytes'] / MB,
+            'build_ms': entry['build_ms'],
+            'hits': entry['hits'],
+        } for name, entry in _supersets.items()]
+    df = pd.DataFrame(rows, columns=['function', 'rows', 'columns', 'mb', 'build_ms', 'hits'])
+    df.attrs['total_mb'] = df['mb'].sum() if not df.empty else 0.0
+    df.attrs['budget_mb'] = KPI_SUPERSET_MAX_MB
+    return df
+
+
+if __name__ == "__main__":
+    # Run with -m this file is __main__, a second copy of the module: the
+    # get_*_kpis fill the frames of eba_benchmarking.data.superset, so report from there
+    from eba_benchmarking.data import superset
+    from eba_benchmarking.data.solvency import get_solvency_kpis
+    from eba_benchmarking.data.profitability import get_profitability_kpis
+    from eba_benchmarking.data.liquidity import get_liquidity_kpis
+    from eba_benchmarking.data.assets import get_assets_kpis
+    from eba_benchmarking.data.liabilities import get_liabilities_kpis
+
+    sample = superset._all_leis()[:10]
+    for get_kpis in (get_solvency_kpis, get_profitability_kpis, get_liquidity_kpis, get_assets_kpis, get_liabilities_kpis):
+        get_kpis(sample)
+    stats = superset.get_superset_stats()
+    print(stats.to_string(index=False))
+    print(f"\nTotal {stats.attrs['total_mb']:.1f} MB of {stats.attrs['budget_mb']} MB budget")
@@ -0,0 +1,286 @@
+"""
+Data-version stamps for cache invalidation.
+
+The pipeline stamps the `data_version` table after it writes (see
+ingestion/processors/stamp_versions.py): one row per table whose version is
+bumped when the table's fingerprint changes, plus a '__global__' row hashing
+all table versions. Cached data functions declare the tables they read:
+
+    @versioned_cache('facts_oth', 'institutions')
+    def get_assets_averages(country_iso, region, systemic_importance, size_category=None): ...
+
+and the current versions of those tables become part of the cache key. After
+a pipeline run only entries built from changed tables miss; the others keep
+hitting, and nobody has to clear the whole cache. Versions are re-read only
+when SQLite's PRAGMA data_version reports a commit by another connection, so
+the check costs one PRAGMA per call.
+"""
+import hashlib
+import inspect
+import threading
+from datetime import datetime
+from functools import wraps
+from .connection import get_connection
+from .peer_set import PEER_SET_ARGS, canonical_lei_args
+from .disk_cache import MISSING, get_disk_cache, make_key, ttl_seconds
+from .cache import cache_backend
+from ..config import COMPACT_TABLE_SUFFIX
+
+VERSION_TABLE = 'data_version'
+GLOBAL_VERSION = '__global__'
+
+# Tables up to this many rows are fingerprinted by content; larger ones by
+# row count, max rowid and TOTAL(amount)
+FULL_HASH_MAX_ROWS = 50000
+
+# Bookkeeping tables that never feed a data function
+UNVERSIONED_TABLES = {VERSION_TABLE, 'mart_build_info', 'schema_version'}
+
+# Table sets shared by many data functions
+FACT_TABLES = ('facts_oth', 'facts_cre', 'facts_sov', 'facts_mrk')
+DIMENSION_TABLES = (
+    'dim_country', 'dim_exposure', 'dim_maturity', 'dim_mkt_modprod', 'dim_mkt_risk',
+    'dim_nace_codes', 'dim_perf_status', 'dim_portfolio', 'dim_status',
+)
+
+_local = threading.local()
+
+
+# =============================================================================
+# STAMPING (pipeline side)
+# =============================================================================
+
+def ensure_version_table(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            fingerprint TEXT,
+            updated_at TEXT
+        )
+    """)
+
+
+def _versioned_relations(conn):
+    """Tables and views to stamp (compact backing tables are covered by their view)."""
+    rows = conn.execute(
+        "SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'"
+    ).fetchall()
+    return {name: kind for name, kind in rows
+            if name not in UNVERSIONED_TABLES and not name.endswith(COMPACT_TABLE_SUFFIX)}
+
+
+def table_fingerprint(conn, table, kind='table'):
+    """
+    Content fingerprint of one table: a hash of every row for small tables,
+    otherwise row count, max rowid and TOTAL(amount). A compact facts view
+    (see compact_facts.py) takes the fingerprint of its backing table.
+    """
+    if kind == 'view':
+        compact = f"{table}{COMPACT_TABLE_SUFFIX}"
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (compact,)).fetchone():
+            return table_fingerprint(conn, compact, 'compact')
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = ?", (table,)).fetchone()[0]
+        return hashlib.sha1(sql.encode()).hexdigest()
+
+    cols = [c[1] for c in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+    count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    digest = hashlib.sha1(f"{table}|{','.join(cols)}|{count}".encode())
+    if count <= FULL_HASH_MAX_ROWS:
+        for row in conn.execute(f"SELECT * FROM {table}"):
+            digest.update(repr(row).encode())
+        return digest.hexdigest()
+
+    aggregates = ['TOTAL(amount)'] if 'amount' in cols else []
+    if kind == 'table':
+        aggregates.append('MAX(rowid)')
+    if aggregates:
+        digest.update(repr(conn.execute(f"SELECT {', '.join(aggregates)} FROM {table}").fetchone()).encode())
+    return digest.hexdigest()
+
+
+def stamp_data_versions(conn, tables=None):
+    """
+    Bumps the version of every table (default: all) whose fingerprint changed
+    since the last stamp, refreshes the global hash and commits.
+    Returns the names of the tables that changed.
+    """
+    ensure_version_table(conn)
+    relations = _versioned_relations(conn)
+    if tables is not None:
+        relations = {t: kind for t, kind in relations.items() if t in tables}
+    stored = {
+        name: (version, fingerprint)
+        for name, version, fingerprint in conn.execute(
+            f"SELECT table_name, version, fingerprint FROM {VERSION_TABLE}"
+        ).fetchall()
+    }
+    now = datetime.now().isoformat(timespec='seconds')
+    changed = []
+    for table, kind in sorted(relations.items()):
+        fingerprint = table_fingerprint(conn, table, kind)
+        version, previous = stored.get(table, (0, None))
+        if fingerprint != previous:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {VERSION_TABLE} (table_name, version, fingerprint, updated_at) VALUES (?, ?, ?, ?)",
+                (table, version + 1, fingerprint, now),
+            )
+            changed.append(table)
+
+    # Tables dropped since the last stamp lose their row
+    if tables is None:
+        for table in set(stored) - set(relations) - {GLOBAL_VERSION}:
+            conn.execute(f"DELETE FROM {VERSION_TABLE} WHERE table_name = ?", (table,))
+            changed.append(table)
+
+    if changed:
+        _stamp_global(conn, stored.get(GLOBAL_VERSION, (0, None))[0], now)
+    conn.commit()
+    return changed
+
+
+def _stamp_global(conn, previous, now):
+    versions = conn.execute(
+        f"SELECT table_name, version FROM {VERSION_TABLE} WHERE table_name != ? ORDER BY table_name", (GLOBAL_VERSION,)
+    ).fetchall()
+    global_hash = hashlib.sha1(repr(versions).encode()).hexdigest()
+    conn.execute(
+        f"INSERT OR REPLACE INTO {VERSION_TABLE} (table_name, version, fingerprint, updated_at) VALUES (?, ?, ?, ?)",
+        (GLOBAL_VERSION, previous + 1, global_hash, now),
+    )
+
+
+def bump_data_versions(conn, tables):
+    """
+    Bumps the version of every existing table in `tables`, whether or not
+    its fingerprint changed, and commits. Writers that change rows in place
+    call it: an UPDATE that keeps the row count, max rowid and TOTAL(amount)
+    leaves a large table's fingerprint as it was.
+    """
+    ensure_version_table(conn)
+    relations = {t: kind for t, kind in _versioned_relations(conn).items() if t in tables}
+    if not relations:
+        return []
+    stored = dict(conn.execute(f"SELECT table_name, version FROM {VERSION_TABLE}").fetchall())
+    now = datetime.now().isoformat(timespec='seconds')
+    for table, kind in sorted(relations.items()):
+        conn.execute(
+            f"INSERT OR REPLACE INTO {VERSION_TABLE} (table_name, version, fingerprint, updated_at) VALUES (?, ?, ?, ?)",
+            (table, stored.get(table, 0) + 1, table_fingerprint(conn, table, kind), now),
+        )
+    _stamp_global(conn, stored.get(GLOBAL_VERSION, 0), now)
+    conn.commit()
+    return sorted(relations)
+
+
+# =============================================================================
+# READING (data layer side)
+# =============================================================================
+
+def _read_versions(conn):
+    try:
+        rows = conn.execute(f"SELECT table_name, version FROM {VERSION_TABLE}").fetchall()
+    except Exception:
+        return {}
+    return dict(rows)
+
+
+def get_data_versions():
+    """
+    {table: version} of the database, plus GLOBAL_VERSION. Re-read only when
+    another connection has committed since the last call on this thread;
+    {} when the database has never been stamped.
+    """
+    try:
+        conn = get_connection()
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    except Exception:
+        return {}
+    seen = getattr(_local, 'seen', None)
+    if seen is not None and seen[0] is conn and seen[1] == data_version:
+        return seen[2]
+    versions = _read_versions(conn)
+    _local.seen = (conn, data_version, versions)
+    return versions
+
+
+def table_versions(tables):
+    """Hashable versions of `tables` for a cache key (None for unstamped tables)."""
+    versions = get_data_versions()
+    return tuple((table, versions.get(table)) for table in tables)
+
+
+def _disk_cached(name, func, data_versions, args, kwargs, ttl):
+    """func(*args, **kwargs) through the disk cache (see disk_cache.py)."""
+    cache = get_disk_cache()
+    # An unstamped table has no version to key on, so its results could outlive a reload
+    if cache is None or any(version is None for _, version in data_versions):
+        return func(*args, **kwargs)
+    key = make_key(name, data_versions, args, kwargs)
+    try:
+        value = cache.get(key)
+    except Exception as e:
+        print(f"Error reading disk cache for {name}: {e}")
+        return func(*args, **kwargs)
+    if value is not MISSING:
+        return value
+
+    value = func(*args, **kwargs)
+    # Empty results are usually a failed query; they are not persisted
+    if value is not None and not getattr(value, 'empty', False) and not (isinstance(value, dict) and not value):
+        try:
+            cache.put(key, value, name, ttl)
+        except Exception as e:
+            print(f"Error writing disk cache for {name}: {e}")
+    return value
+
+
+def versioned_cache(*tables, **cache_kwargs):
+    """
+    Caches a data function on the current data versions of `tables` plus its
+    arguments, so an entry misses as soon as one of them is re-stamped. The
+    in-process tier is the cache backend's (st.cache_data, an LRU dict or
+    none, see cache.py, with `cache_kwargs` such as ttl); a miss is looked up
+    in the disk cache shared by every server process before the function
+    runs. A `lei_list` argument is keyed as a PeerSet (order-insensitive,
+    hashed by digest). The decorated function keeps its signature and
+    `.clear()` (in-process tier only).
+    """
+    ttl = ttl_seconds(cache_kwargs.get('ttl'))
+
+    def decorator(func):
+        signature = inspect.signature(func)
+        has_leis = any(name in PEER_SET_ARGS for name in signature.parameters)
+        name = f"{func.__module__}.{func.__qualname__}"
+        tier = {'backend': None, 'cached': None}
+
+        @wraps(func)
+        def keyed(data_versions, *args, **kwargs):
+            if cache_backend().disk:
+                return _disk_cached(name, func, data_versions, args, kwargs, ttl)
+            return func(*args, **kwargs)
+
+        # Backends name (and hash) arguments after this signature
+        keyed.__signature__ = signature.replace(parameters=[
+            inspect.Parameter('data_versions', inspect.Parameter.POSITIONAL_OR_KEYWORD),
+            *signature.parameters.values(),
+        ])
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if has_leis:
+                args, kwargs = canonical_lei_args(signature, args, kwargs)
+            backend = cache_backend()
+            if tier['backend'] is not backend:
+                tier['cached'] = backend.wrap(keyed, **cache_kwargs)
+                tier['backend'] = backend
+            return tier['cached'](table_versions(tables), *args, **kwargs)
+
+        def clear():
+            if tier['cached'] is not None:
+                tier['cached'].clear()
+
+        wrapper.clear = clear
+        wrapper.tables = tables
+        return wrapper
+    return decorator
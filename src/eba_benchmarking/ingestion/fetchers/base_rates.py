@@ -4,7 +4,7 @@ import sqlite3
 import io
 import time
 from eba_benchmarking.config import DB_NAME
-from eba_benchmarking.utils import normalize_period
+from eba_benchmarking.utils import normalize_periods
 
 # --- CONFIGURATION ---
 API_BASE = "https://data-api.ecb.europa.eu/service/data"
@@ -99,7 +99,7 @@ def main():
     if all_data:
         full_df = pd.concat(all_data, ignore_index=True)
         full_df.rename(columns={'TIME_PERIOD': 'date', 'OBS_VALUE': 'value'}, inplace=True)
-        full_df['date'] = full_df['date'].apply(normalize_period)
+        full_df['date'] = normalize_periods(full_df['date'])
         
         conn = sqlite3.connect(DB_NAME)
         cursor = conn.cursor()
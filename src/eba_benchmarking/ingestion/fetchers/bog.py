@@ -7,7 +7,7 @@ import os
 import xml.etree.ElementTree as ET
 from datetime import datetime
 from eba_benchmarking.config import DB_NAME, ROOT_DIR
-from eba_benchmarking.utils import normalize_period
+from eba_benchmarking.utils import normalize_periods
 
 # --- CONFIGURATION ---
 CATALOG_URL = "https://www.bankofgreece.gr/OpenDataSetsCatalog/catalog.xml"
@@ -223,7 +223,7 @@ def save_to_db(df):
             PRIMARY KEY (date, metric)
         )
     ''')
-    df['date'] = df['date'].dt.strftime('%Y-%m-%d').apply(normalize_period)
+    df['date'] = normalize_periods(df['date'].dt.strftime('%Y-%m-%d'))
     records = df[['date', 'category', 'metric', 'value']].values.tolist()
     cursor.executemany('INSERT OR REPLACE INTO bog_macro VALUES (?,?,?,?)', records)
     conn.commit()
@@ -4,6 +4,7 @@ import sqlite3
 import io
 import time
 from eba_benchmarking.config import DB_NAME
+from eba_benchmarking.utils import normalize_periods
 
 class ECBConnector:
     """
@@ -69,6 +70,10 @@ class ECBConnector:
         # Process Data
         # ECB CSV usually has: TIME_PERIOD, OBS_VALUE, and dimension columns
         data_to_insert = []
+        # Dates are stored as month end (YYYY-MM-DD). Daily series ('B.'/'D.' keys)
+        # keep the first observation of each month, as cleanup_db's deduplication did
+        df['TIME_PERIOD'] = normalize_periods(df['TIME_PERIOD'])
+        seen = set()
         
         for _, row in df.iterrows():
             date = row['TIME_PERIOD']
@@ -85,12 +90,14 @@ class ECBConnector:
                     metric_label = metric_name_map[row[col]]
                     break
             
-            if metric_label != "Unknown":
+            if metric_label != "Unknown" and (date, metric_label) not in seen:
+                seen.add((date, metric_label))
                 data_to_insert.append((date, category, metric_label, val))
         
         if data_to_insert:
+            # A month already stored keeps its first observation
             cursor.executemany(
-                'INSERT OR REPLACE INTO ecb_market_data (date, category, metric, value) VALUES (?, ?, ?, ?)', 
+                'INSERT OR IGNORE INTO ecb_market_data (date, category, metric, value) VALUES (?, ?, ?, ?)', 
                 data_to_insert
             )
             conn.commit()
@@ -3,7 +3,7 @@ import sqlite3
 import requests
 import io
 from eba_benchmarking.config import DB_NAME
-from eba_benchmarking.utils import normalize_period
+from eba_benchmarking.utils import normalize_periods
 
 # --- CONSTANTS ---
 ITEM_MAP = {
@@ -82,7 +82,7 @@ def main():
         if 'CB_ITEM' in df_country.columns and 'REF_AREA' in df_country.columns:
             df_country['variable'] = df_country['CB_ITEM'].map(ITEM_MAP)
             df_country['group_type'] = 'Country'
-            df_country['period'] = df_country['TIME_PERIOD'].apply(normalize_period)
+            df_country['period'] = normalize_periods(df_country['TIME_PERIOD'])
             
             df_save = df_country[['period', 'variable', 'group_type', 'REF_AREA', 'OBS_VALUE']].copy()
             df_save.columns = ['period', 'variable', 'group_type', 'group_name', 'value']
@@ -106,7 +106,7 @@ def main():
             df_biz['variable'] = df_biz['CB_ITEM'].map(ITEM_MAP)
             df_biz['group_type'] = 'Business Model'
             df_biz['group_name'] = df_biz['SBS_BREAKDOWN'].map(BIZ_MODEL_MAP).fillna(df_biz['SBS_BREAKDOWN'])
-            df_biz['period'] = df_biz['TIME_PERIOD'].apply(normalize_period)
+            df_biz['period'] = normalize_periods(df_biz['TIME_PERIOD'])
             
             df_save = df_biz[['period', 'variable', 'group_type', 'group_name', 'OBS_VALUE']].copy()
             df_save.columns = ['period', 'variable', 'group_type', 'group_name', 'value']
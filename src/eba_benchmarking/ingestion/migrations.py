@@ -0,0 +1,295 @@
+"""
+Versioned schema migrations for the facts_* tables.
+
+Applied migrations are recorded in the `schema_version` table. Run after the
+parsers and cleanup so the composite indexes exist on the final tables:
+
+    python -m eba_benchmarking.ingestion.migrations          # apply + ANALYZE
+    python -m eba_benchmarking.ingestion.migrations --audit  # EXPLAIN QUERY PLAN audit
+"""
+import re
+import sys
+import sqlite3
+import inspect
+import importlib
+from datetime import datetime
+from eba_benchmarking.config import DB_NAME, COMPACT_TABLE_SUFFIX
+
+# =============================================================================
+# INDEX DEFINITIONS
+# =============================================================================
+
+# Composite covering indexes matching the data-layer access pattern:
+#   item_id IN (...) AND lei IN (...) AND period >= MIN_PERIOD [AND dims]
+# plus a (lei, period) index for queries that do not filter on item_id.
+FACT_INDEXES = {
+    'facts_oth': [
+        "CREATE INDEX IF NOT EXISTS idx_oth_item_lei_period ON facts_oth(item_id, lei, period, financial_instruments, exposure, amount)",
+        "CREATE INDEX IF NOT EXISTS idx_oth_lei_period ON facts_oth(lei, period)",
+    ],
+    'facts_cre': [
+        "CREATE INDEX IF NOT EXISTS idx_cre_item_lei_period ON facts_cre(item_id, lei, period, perf_status, amount)",
+        "CREATE INDEX IF NOT EXISTS idx_cre_lei_period ON facts_cre(lei, period)",
+    ],
+    'facts_sov': [
+        "CREATE INDEX IF NOT EXISTS idx_sov_item_lei_period ON facts_sov(item_id, lei, period, country, maturity, amount)",
+        "CREATE INDEX IF NOT EXISTS idx_sov_lei_period ON facts_sov(lei, period)",
+    ],
+    'facts_mrk': [
+        "CREATE INDEX IF NOT EXISTS idx_mrk_item_lei_period ON facts_mrk(item_id, lei, period, amount)",
+        "CREATE INDEX IF NOT EXISTS idx_mrk_lei_period ON facts_mrk(lei, period)",
+    ],
+}
+
+# Single-column indexes made redundant by the composite ones above
+REDUNDANT_INDEXES = [
+    'idx_oth_lei', 'idx_oth_item', 'idx_oth_period', 'idx_oth_instrument',
+    'idx_cre_lei', 'idx_cre_item', 'idx_cre_period',
+    'idx_facts_mrk_lei', 'idx_facts_sov_lei',
+]
+
+# =============================================================================
+# MIGRATIONS
+# =============================================================================
+
+def _table_exists(conn, table_name):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone()
+    return row is not None
+
+
+def _relation_exists(conn, name):
+    """True for a table or a view (facts tables become views in the compact layout)."""
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?", (name,)).fetchone()
+    return row is not None
+
+
+def ensure_fact_indexes(conn):
+    """Creates any missing composite index (tables rebuilt by parsers lose them)."""
+    for table, index_sqls in FACT_INDEXES.items():
+        if not _table_exists(conn, table):
+            continue
+        for idx_sql in index_sqls:
+            conn.execute(idx_sql)
+
+
+def _m001_composite_indexes(conn):
+    ensure_fact_indexes(conn)
+    for idx in REDUNDANT_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {idx}")
+
+
+# Ordered list of (version, description, function(conn))
+MIGRATIONS = [
+    (1, 'Composite covering indexes on facts_* tables', _m001_composite_indexes),
+]
+
+
+def get_schema_version(conn):
+    """Returns the highest applied migration version (0 if none)."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT
+        )
+    """)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def apply_migrations(conn):
+    """Applies pending migrations in order, each in its own transaction. Returns the list applied."""
+    current = get_schema_version(conn)
+    conn.commit()
+    applied = []
+    for version, description, func in MIGRATIONS:
+        if version <= current:
+            continue
+        print(f"  - Applying migration {version:03d}: {description}")
+        with conn:
+            func(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.now().isoformat(timespec='seconds'))
+            )
+        applied.append(version)
+    return applied
+
+# =============================================================================
+# QUERY PLAN AUDIT
+# =============================================================================
+
+# Data functions the audit runs. Their arguments are filled by name from a
+# sample bank, its peers and dictionary rows (see _sample_arguments), and every
+# statement they execute on the data layer's connection is explained, so the
+# audit checks the SQL the app actually sends.
+AUDIT_CALLS = [
+    'solvency.get_solvency_kpis', 'solvency.get_solvency_with_texas_ratio', 'solvency.get_rwa_composition',
+    'solvency.get_solvency_averages', 'solvency.get_rwa_composition_averages', 'solvency.get_regional_peers_raw_data',
+    'asset_quality.get_aq_breakdown', 'asset_quality.get_asset_quality_averages', 'asset_quality.get_aq_breakdown_averages',
+    'assets.get_assets_kpis', 'assets.get_assets_averages',
+    'liabilities.get_liabilities_kpis', 'liabilities.get_liabilities_averages', 'liabilities.get_deposit_beta',
+    'liquidity.get_liquidity_kpis', 'liquidity.get_liquidity_averages',
+    'profitability.get_profitability_kpis', 'profitability.get_nii_analysis', 'profitability.get_nii_averages',
+    'profitability.get_profitability_averages',
+    'sovereign.get_sovereign_kpis', 'sovereign.get_sovereign_averages',
+    'credit_risk.get_cre_filter_options', 'credit_risk.get_cre_data',
+    'market_risk.get_mrk_filter_options', 'market_risk.get_mrk_data',
+    'generic.get_tab_data', 'generic.get_financial_data',
+    'benchmarking.get_all_benchmarking_metrics', 'benchmarking.get_benchmarking_report',
+    'benchmarking.get_underlying_bank_data', 'benchmarking.get_custom_metric_data',
+    'benchmarking.get_available_metrics_for_explorer',
+]
+
+_FACTS_RE = re.compile(r'\b(' + '|'.join(FACT_INDEXES) + r')\b')
+# Words that can follow a table name where an alias would be
+_NOT_ALIASES = {'WHERE', 'JOIN', 'LEFT', 'INNER', 'CROSS', 'ON', 'USING', 'GROUP', 'ORDER', 'LIMIT', 'UNION', 'AS'}
+
+
+def _sample_arguments(conn, sample_size):
+    """{parameter name: value} for AUDIT_CALLS: the largest sized bank, its attributes and a sample of LEIs."""
+    lei, country_iso, region, systemic_importance, size_category = conn.execute(
+        "SELECT lei, country_iso, region, Systemic_Importance, size_category FROM institutions "
+        "ORDER BY size_category IS NULL, total_assets DESC LIMIT 1"
+    ).fetchone()
+    leis = [r[0] for r in conn.execute("SELECT lei FROM institutions LIMIT ?", (sample_size,)).fetchall()]
+    items = conn.execute("SELECT item_id, label FROM dictionary ORDER BY item_id LIMIT 3").fetchall()
+    tab = conn.execute(
+        "SELECT tab_name FROM dictionary WHERE tab_name IS NOT NULL GROUP BY tab_name ORDER BY COUNT(*) DESC LIMIT 1"
+    ).fetchone()
+    return {
+        'lei_list': sorted(set(leis) | {lei}), 'base_lei': lei, 'country_iso': country_iso, 'region': region,
+        'systemic_importance': systemic_importance, 'size_category': size_category,
+        'item_ids': [i for i, _ in items], 'item_labels': [label for _, label in items],
+        'tab_name': tab[0] if tab else None,
+    }
+
+
+def _call(func, sample):
+    """Calls a data function with its parameters taken by name from `sample`."""
+    params = inspect.signature(func).parameters
+    kwargs = {name: sample[name] for name in params if name in sample}
+    missing = [name for name, p in params.items() if p.default is p.empty and name not in kwargs]
+    if missing:
+        raise ValueError(f"no sample value for {', '.join(missing)}")
+    return func(**kwargs)
+
+
+def get_audit_statements(conn, sample_size=20):
+    """
+    Runs AUDIT_CALLS on the data layer (SQLite backend, caches cleared and
+    bypassed) and records the facts-table statements they execute.
+    Yields (query_name, table, sql, params) per distinct statement, with the
+    parameters already inlined in `sql`. Reads served from columnar snapshots
+    do not reach SQLite and are not recorded.
+    """
+    from eba_benchmarking.data.cache import clear_caches
+    from eba_benchmarking.data.connection import trace_statements
+    from eba_benchmarking.data.disk_cache import disk_cache_bypassed
+    from eba_benchmarking.data.query import get_backend, set_backend
+
+    if not _relation_exists(conn, 'institutions') or not _relation_exists(conn, 'dictionary'):
+        return
+    sample = _sample_arguments(conn, sample_size)
+    backend = get_backend()
+    set_backend('sqlite')
+    seen = set()
+    try:
+        for path in AUDIT_CALLS:
+            module, func = path.split('.')
+            func = getattr(importlib.import_module(f'eba_benchmarking.data.{module}'), func)
+            clear_caches()
+            with disk_cache_bypassed(), trace_statements() as statements:
+                try:
+                    _call(func, sample)
+                except Exception as e:
+                    print(f"  [WARN] {path} failed, its queries are not audited: {e}")
+            n = 0
+            for sql in statements:
+                tables = _FACTS_RE.findall(sql)
+                if not tables or sql in seen or not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+                    continue
+                seen.add(sql)
+                n += 1
+                yield f"{path}#{n}", tables[0], sql, ()
+    finally:
+        set_backend(backend)
+
+
+def _scan_targets(conn, sql):
+    """Names a scan of a facts table shows in a plan of `sql`: table names, their aliases and compact tables."""
+    targets = set()
+    for table in set(_FACTS_RE.findall(sql)):
+        targets.add(table)
+        if _relation_exists(conn, f"{table}{COMPACT_TABLE_SUFFIX}"):
+            # Compact layout (see compact_facts.py): the view reads <table>_compact aliased as "c"
+            targets |= {f"{table}{COMPACT_TABLE_SUFFIX}", 'c'}
+    for match in re.finditer(_FACTS_RE.pattern + r'(?:\s+AS)?\s+(\w+)', sql, re.IGNORECASE):
+        if match.group(2).upper() not in _NOT_ALIASES:
+            targets.add(match.group(2))
+    return targets
+
+
+def _facts_indexes(conn):
+    return {r[0] for r in conn.execute(
+        f"SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name IN ({', '.join('?' * len(FACT_INDEXES))})",
+        list(FACT_INDEXES),
+    ).fetchall()}
+
+
+def audit_query_plans(conn, sample_size=20):
+    """
+    Runs EXPLAIN QUERY PLAN over every facts-table statement AUDIT_CALLS execute.
+    Returns (number of statements checked, [(query_name, plan_detail)] for every
+    scan of a facts table), including scans of a covering index: only SEARCH
+    (an index seek) passes.
+    """
+    indexes = _facts_indexes(conn)
+    violations = []
+    checked = 0
+    for name, table, query, params in get_audit_statements(conn, sample_size):
+        checked += 1
+        targets = _scan_targets(conn, query)
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+        for row in plan:
+            detail = row[-1]
+            # "SCAN f", "SCAN f USING COVERING INDEX ..." = full table/index scan; "SEARCH f USING INDEX ..." is fine
+            words = detail.split()
+            if words[0] == 'SCAN' and (words[1] in targets or any(w in indexes for w in words[2:])):
+                violations.append((name, detail))
+    return checked, violations
+
+
+def main(audit=False):
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        print("--- Applying Schema Migrations ---")
+        applied = apply_migrations(conn)
+        if not applied:
+            print("  - Schema already up to date.")
+
+        # Parsers/cleanup recreate tables, so re-check indexes on every run
+        ensure_fact_indexes(conn)
+        conn.commit()
+
+        print("  - Running ANALYZE...")
+        conn.execute("ANALYZE")
+        conn.commit()
+        print(f"  > Schema version: {get_schema_version(conn)}")
+
+        if audit:
+            print("\n--- EXPLAIN QUERY PLAN Audit ---")
+            checked, violations = audit_query_plans(conn)
+            if violations:
+                for name, detail in violations:
+                    print(f"  ❌ {name}: {detail}")
+                return False
+            print(f"  ✅ {checked} data-layer queries checked, no facts table scans.")
+        return True
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    ok = main(audit='--audit' in sys.argv)
+    sys.exit(0 if ok else 1)
@@ -1,13 +1,77 @@
+"""
+CSV parser for the EBA transparency facts tables (tr_cre / tr_oth).
+
+Imports are incremental. Every source file gets a row in `ingest_manifest`
+(path, size, mtime, content hash, parser version, row count) and its facts
+rows carry that row's `source_file_id`. On a rerun:
+
+- files whose size and mtime (or, failing that, content hash) and parser
+  version match the manifest are skipped
+- changed files have their rows deleted by source_file_id and reloaded
+- files no longer in data/raw have their rows deleted
+- rows of every other file are left untouched
+
+Changed files are parsed in worker processes (see parallel.py) and written
+in bulk-load mode (see bulk_load.py). A table built before the manifest
+existed (untagged rows) is reimported once in full. Bump PARSER_VERSION when
+the parsing rules change in a way the rules digest below cannot see.
+"""
 import pandas as pd
 import sqlite3
 import os
 import glob
 import re
+import json
+import time
+import hashlib
+from datetime import datetime
 from eba_benchmarking.config import DB_NAME, ROOT_DIR
-from eba_benchmarking.utils import get_item_mapping
+from eba_benchmarking.utils import get_item_mapping, normalize_periods
+from eba_benchmarking.ingestion.processors.compact_facts import drop_compact_layout, expand_table
+from eba_benchmarking.ingestion.processors.export_columnar import invalidate_snapshot
+from eba_benchmarking.ingestion.parsers.bulk_load import bulk_load, insert_batch, rows_per_second
+from eba_benchmarking.ingestion.parsers.parallel import ParseJob, parse_files
+from eba_benchmarking.data.versions import bump_data_versions
 
 RAW_FOLDER = os.path.join(ROOT_DIR, 'data', 'raw')
 
+MANIFEST_TABLE = 'ingest_manifest'
+PARSER_VERSION = 2
+SOURCE_FILE_COLUMN = 'source_file_id'
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def ensure_manifest(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+            source_file_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER,
+            mtime_ns INTEGER,
+            content_hash TEXT,
+            parser_version TEXT,
+            row_count INTEGER,
+            loaded_at TEXT,
+            UNIQUE (table_name, path)
+        )
+    """)
+
+
+def file_hash(path):
+    """SHA-256 of a file's content, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def exercise_year(file_name):
+    year_match = re.search(r'20\d{2}', file_name)
+    return year_match.group(0) if year_match else '2025'
+
+
 class BaseParser:
     def __init__(self, table_name, file_pattern_prefix, col_mapping_rules, create_table_sql, index_sqls, dtype_conversions=None):
         """
@@ -26,25 +90,141 @@ class BaseParser:
         self.index_sqls = index_sqls
         self.dtype_conversions = dtype_conversions or {}
 
-    def run(self):
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
+    def _source_key(self, csv_path):
+        """Manifest path of a source file, relative to RAW_FOLDER."""
+        return os.path.relpath(csv_path, RAW_FOLDER)
+
+    def _parser_version(self, conn, year):
+        """PARSER_VERSION plus a digest of the mapping rules and the exercise's item mappings."""
+        rules = json.dumps([self.col_mapping_rules, self.dtype_conversions, sorted(get_item_mapping(conn, year).items())],
+                           sort_keys=True, default=str)
+        return f"{PARSER_VERSION}:{hashlib.sha1(rules.encode()).hexdigest()[:12]}"
 
+    def _relation_type(self, conn):
+        row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (self.table_name,)).fetchone()
+        return row[0] if row else None
+
+    def _needs_full_import(self, conn):
+        """True when the table is missing or holds rows not attributed to a manifest entry."""
+        if self._relation_type(conn) is None:
+            return True
+        cols = [c[1] for c in conn.execute(f"PRAGMA table_info({self.table_name})").fetchall()]
+        if SOURCE_FILE_COLUMN not in cols:
+            return True
+        if conn.execute(f"SELECT 1 FROM {self.table_name} WHERE {SOURCE_FILE_COLUMN} IS NULL LIMIT 1").fetchone():
+            return True
+        has_rows = conn.execute(f"SELECT 1 FROM {self.table_name} LIMIT 1").fetchone() is not None
+        has_manifest = conn.execute(f"SELECT 1 FROM {MANIFEST_TABLE} WHERE table_name = ? LIMIT 1", (self.table_name,)).fetchone() is not None
+        return has_rows and not has_manifest
+
+    def _create_table(self, conn):
+        cursor = conn.cursor()
         print(f"--- [{self.table_name.upper()}] Clearing table for fresh import ---")
+        drop_compact_layout(cursor, self.table_name)
         cursor.execute(f'DROP TABLE IF EXISTS {self.table_name}')
-        
-        # Create Table
         cursor.execute(self.create_table_sql)
+        cursor.execute(f"ALTER TABLE {self.table_name} ADD COLUMN {SOURCE_FILE_COLUMN} INTEGER")
+        cursor.execute(f"DELETE FROM {MANIFEST_TABLE} WHERE table_name = ?", (self.table_name,))
+        conn.commit()
+
+    def _plan(self, conn, files):
+        """
+        (files to load, manifest rows of removed files, unchanged count).
+        Size and mtime decide first; a file that only got a new mtime is
+        hashed and, if its content is unchanged, just re-stamped.
+        """
+        manifest = {
+            path: (file_id, size, mtime_ns, content_hash, version)
+            for file_id, path, size, mtime_ns, content_hash, version in conn.execute(
+                f"SELECT source_file_id, path, size, mtime_ns, content_hash, parser_version FROM {MANIFEST_TABLE} WHERE table_name = ?",
+                (self.table_name,),
+            ).fetchall()
+        }
+        to_load, unchanged = [], 0
+        for csv_path in files:
+            key = self._source_key(csv_path)
+            stat = os.stat(csv_path)
+            version = self._parser_version(conn, exercise_year(os.path.basename(csv_path)))
+            entry = manifest.pop(key, None)
+            if entry is not None and entry[3] is not None and entry[4] == version:
+                _, size, mtime_ns, content_hash, _ = entry
+                if (size, mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                    unchanged += 1
+                    continue
+                if size == stat.st_size and file_hash(csv_path) == content_hash:
+                    conn.execute(f"UPDATE {MANIFEST_TABLE} SET mtime_ns = ? WHERE source_file_id = ?", (stat.st_mtime_ns, entry[0]))
+                    unchanged += 1
+                    continue
+            to_load.append((csv_path, version))
+        conn.commit()
+        removed = [(file_id, path) for path, (file_id, *_) in manifest.items()]
+        return to_load, removed, unchanged
+
+    def _begin_file(self, conn, csv_path, version):
+        """Registers the file (content hash pending) and deletes its previous rows; returns its source_file_id."""
+        key = self._source_key(csv_path)
+        conn.execute(f"INSERT OR IGNORE INTO {MANIFEST_TABLE} (table_name, path) VALUES (?, ?)", (self.table_name, key))
+        file_id = conn.execute(
+            f"SELECT source_file_id FROM {MANIFEST_TABLE} WHERE table_name = ? AND path = ?", (self.table_name, key)
+        ).fetchone()[0]
+        # A NULL hash marks an unfinished load, so an interrupted file is reloaded next time
+        conn.execute(f"UPDATE {MANIFEST_TABLE} SET content_hash = NULL, parser_version = ? WHERE source_file_id = ?", (version, file_id))
+        deleted = conn.execute(f"DELETE FROM {self.table_name} WHERE {SOURCE_FILE_COLUMN} = ?", (file_id,)).rowcount
+        conn.commit()
+        if deleted:
+            print(f"  > Removed {deleted} rows of the previous version of {key}")
+        return file_id
+
+    def _finish_file(self, conn, csv_path, file_id, row_count):
+        stat = os.stat(csv_path)
+        conn.execute(
+            f"UPDATE {MANIFEST_TABLE} SET size = ?, mtime_ns = ?, content_hash = ?, row_count = ?, loaded_at = ? WHERE source_file_id = ?",
+            (stat.st_size, stat.st_mtime_ns, file_hash(csv_path), row_count, datetime.now().isoformat(timespec='seconds'), file_id),
+        )
+        conn.commit()
+
+    def run(self):
+        conn = sqlite3.connect(DB_NAME)
+        cursor = conn.cursor()
+        ensure_manifest(conn)
+
+        if self._needs_full_import(conn):
+            self._create_table(conn)
+        elif self._relation_type(conn) == 'view':
+            # Compact layout (see compact_facts.py): back to rows, the pipeline compacts again
+            print(f"  > Expanding compact {self.table_name} for incremental import...")
+            with conn:
+                expand_table(conn, self.table_name)
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table_name}_source_file ON {self.table_name}({SOURCE_FILE_COLUMN})")
         conn.commit()
 
-        files = glob.glob(self.file_pattern)
+        files = sorted(glob.glob(self.file_pattern))
         if not files:
             print(f"⚠️ No files found matching {self.file_pattern}")
+
+        to_load, removed, unchanged = self._plan(conn, files)
+        print(f"--- [{self.table_name.upper()}] {len(to_load)} file(s) to load, {unchanged} unchanged, {len(removed)} removed ---")
+        if not to_load and not removed:
             conn.close()
             return
+        invalidate_snapshot(self.table_name)
 
-        for csv_path in files:
-            self._process_file(conn, csv_path)
+        for file_id, path in removed:
+            deleted = conn.execute(f"DELETE FROM {self.table_name} WHERE {SOURCE_FILE_COLUMN} = ?", (file_id,)).rowcount
+            conn.execute(f"DELETE FROM {MANIFEST_TABLE} WHERE source_file_id = ?", (file_id,))
+            conn.commit()
+            print(f"  > {path} no longer in {RAW_FOLDER}: removed {deleted} rows")
+
+        # Previous rows go first, while the source_file_id index still exists
+        file_ids = [self._begin_file(conn, csv_path, version) for csv_path, version in to_load]
+        pending = [(file_id, self._parse_job(conn, csv_path)) for (csv_path, _), file_id in zip(to_load, file_ids)]
+        pending = [(file_id, job) for file_id, job in pending if job is not None]
+        with bulk_load(conn, self.table_name):
+            parsed = parse_files([job for _, job in pending])
+            for (file_id, _), (job, batches) in zip(pending, parsed):
+                row_count = self._write_file(conn, job.path, file_id, batches)
+                if row_count is not None:
+                    self._finish_file(conn, job.path, file_id, row_count)
 
         # Create Indexes
         print(f"Refreshing indexes for {self.table_name}...")
@@ -52,20 +232,12 @@ class BaseParser:
             cursor.execute(idx_sql)
         
         conn.commit()
+        # Rows were replaced in place: readers keyed on the data version (mart, snapshots, caches) must see it
+        bump_data_versions(conn, [self.table_name])
         conn.close()
 
-    def _process_file(self, conn, csv_path):
-        file_name = os.path.basename(csv_path)
-        print(f"\n--- [{self.table_name.upper()}] Processing {file_name} ---")
-
-        # Determine Exercise Year
-        year_match = re.search(r'20\d{2}', file_name)
-        exercise_year = year_match.group(0) if year_match else '2025'
-        mapping = get_item_mapping(conn, exercise_year)
-        
-        if mapping:
-            print(f"  > Using item mappings for TR{exercise_year} ({len(mapping)} items mapped)")
-
+    def _column_map(self, csv_path):
+        """{CSV header: table column} for the file, or None if unreadable or a critical column is missing."""
         # Intelligent Header Mapping
         try:
             # Read header only
@@ -73,15 +245,13 @@ class BaseParser:
             actual_cols = initial_df.columns.tolist()
         except Exception as e:
             print(f"❌ Error reading headers: {e}")
-            return
+            return None
 
-        use_cols = []
         db_rename_map = {}
 
         for db_col, candidates in self.col_mapping_rules.items():
             for candidate in candidates:
                 if candidate in actual_cols:
-                    use_cols.append(candidate)
                     db_rename_map[candidate] = db_col
                     break
         
@@ -90,36 +260,69 @@ class BaseParser:
         missing = [req for req in required if req not in db_rename_map.values()]
         if missing:
             print(f"❌ Critical columns missing in {csv_path}: {missing}. Skipping.")
-            return
+            return None
+        return db_rename_map
 
-        # Chunk Processing
+    def _read_chunks(self, csv_path, db_rename_map, mapping):
+        """Yields the file's rows in typed chunks, columns named as in the table."""
         chunk_size = 100000
+
+        for chunk in pd.read_csv(csv_path, usecols=list(db_rename_map), chunksize=chunk_size, dtype=str):
+            chunk.rename(columns=db_rename_map, inplace=True)
+
+            # Normalize Item ID
+            if mapping:
+                chunk['item_id'] = chunk['item_id'].map(mapping).fillna(chunk['item_id'])
+
+            # Normalize Period (YYYY-MM-DD month end, see utils.normalize_period)
+            if 'period' in chunk.columns:
+                chunk['period'] = normalize_periods(chunk['period'])
+
+            # Numeric Conversions
+            chunk['amount'] = pd.to_numeric(chunk['amount'], errors='coerce')
+            
+            # Apply specific integer conversions (handling NaNs as 0)
+            if self.dtype_conversions:
+                for col in self.dtype_conversions.get('int', []):
+                    if col in chunk.columns:
+                        chunk[col] = pd.to_numeric(chunk[col], errors='coerce').fillna(0).astype(int)
+                    else:
+                        chunk[col] = 0 # Default if missing
+            yield chunk
+
+    def _parse_job(self, conn, csv_path):
+        """The file's ParseJob (column map and item mapping), or None if its headers do not fit the table."""
+        file_name = os.path.basename(csv_path)
+
+        # Determine Exercise Year
+        year = exercise_year(file_name)
+        mapping = get_item_mapping(conn, year)
+        
+        if mapping:
+            print(f"  > {file_name}: using item mappings for TR{year} ({len(mapping)} items mapped)")
+
+        db_rename_map = self._column_map(csv_path)
+        if db_rename_map is None:
+            return None
+        return ParseJob(csv_path, self._read_chunks, db_rename_map, mapping)
+
+    def _write_file(self, conn, csv_path, file_id, batches):
+        """Inserts the file's parsed batches tagged with `file_id` in one transaction; returns the row count, or None if it failed."""
+        print(f"\n--- [{self.table_name.upper()}] Processing {os.path.basename(csv_path)} ---")
         total_rows = 0
+        start = time.perf_counter()
 
         try:
-            for chunk in pd.read_csv(csv_path, usecols=use_cols, chunksize=chunk_size, dtype=str):
-                chunk.rename(columns=db_rename_map, inplace=True)
-
-                # Normalize Item ID
-                if mapping:
-                    chunk['item_id'] = chunk['item_id'].map(mapping).fillna(chunk['item_id'])
-
-                # Numeric Conversions
-                chunk['amount'] = pd.to_numeric(chunk['amount'], errors='coerce')
-                
-                # Apply specific integer conversions (handling NaNs as 0)
-                if self.dtype_conversions:
-                    for col in self.dtype_conversions.get('int', []):
-                        if col in chunk.columns:
-                            chunk[col] = pd.to_numeric(chunk[col], errors='coerce').fillna(0).astype(int)
-                        else:
-                            chunk[col] = 0 # Default if missing
-                
-                chunk.to_sql(self.table_name, conn, if_exists='append', index=False)
-                total_rows += len(chunk)
+            for columns, arrays in batches:
+                insert_batch(conn, self.table_name, columns, arrays, {SOURCE_FILE_COLUMN: file_id})
+                total_rows += len(arrays[0])
                 print(f"  - Imported {total_rows} rows...", end='\r')
+            conn.commit()
             
-            print(f"\n✅ Success! Imported {total_rows} records.")
+            print(f"\n✅ Success! Imported {total_rows} records ({rows_per_second(total_rows, start)}).")
+            return total_rows
             
         except Exception as e:
+            conn.rollback()
             print(f"\n❌ Error processing file: {e}")
+            return None
@@ -0,0 +1,176 @@
+"""
+Bulk-load mode for the tr_* facts parsers.
+
+The parsers used to append each 100k-row chunk with DataFrame.to_sql: one
+commit per chunk, the default rollback journal and every index updated row
+by row. Now each chunk (parsed in this or a worker process, see
+parallel.py) goes through insert_batch(), one executemany on plain Python
+values, and a file is committed as one transaction. With BULK_LOAD, inside
+`bulk_load(conn, table)`:
+
+- DB_BULK_LOAD_PRAGMAS apply (WAL journal, synchronous=OFF, large page cache)
+- the table's indexes are dropped, then recreated from their SQL on exit
+- the previous PRAGMA values are restored on exit, also after an error
+
+    python -m eba_benchmarking.ingestion.parsers.bulk_load   # rows/sec per tr_* file, to_sql vs bulk
+"""
+import os
+import glob
+import time
+import sqlite3
+import tempfile
+from itertools import repeat
+from contextlib import contextmanager
+from eba_benchmarking.config import DB_NAME, BULK_LOAD, DB_BULK_LOAD_PRAGMAS
+
+
+def _pragma(conn, name):
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+def _set_pragmas(conn, pragmas):
+    for name, value in pragmas.items():
+        try:
+            conn.execute(f"PRAGMA {name} = {value}")
+        except sqlite3.OperationalError as e:
+            # e.g. leaving WAL while another process has the database open
+            print(f"  [WARN] Could not set PRAGMA {name} = {value}: {e}")
+
+
+def _table_indexes(conn, table):
+    """(name, CREATE statement) of the explicit indexes on `table`."""
+    return conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,)
+    ).fetchall()
+
+
+@contextmanager
+def bulk_load(conn, table):
+    """Bulk-load settings for loading `table` (a no-op unless BULK_LOAD). Uncommitted rows are rolled back on error."""
+    if not BULK_LOAD:
+        yield
+        return
+    conn.commit()
+    previous = {name: _pragma(conn, name) for name in DB_BULK_LOAD_PRAGMAS}
+    _set_pragmas(conn, DB_BULK_LOAD_PRAGMAS)
+    indexes = _table_indexes(conn, table)
+    for name, _ in indexes:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.commit()
+    try:
+        yield
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.commit()
+        start = time.perf_counter()
+        for _, sql in indexes:
+            conn.execute(sql)
+        conn.commit()
+        if indexes:
+            print(f"  > Rebuilt {len(indexes)} indexes on {table} in {time.perf_counter() - start:.1f}s")
+        _set_pragmas(conn, previous)
+
+
+def to_batch(df):
+    """(columns, NumPy arrays) of a parsed chunk: compact to pickle between processes."""
+    columns = list(df.columns)
+    return columns, [df[col].to_numpy() for col in columns]
+
+
+def insert_batch(conn, table, columns, arrays, constants=None):
+    """
+    Inserts one batch with a single executemany, plus `constants`
+    ({column: value} for every row). NaN is stored as NULL by SQLite.
+    """
+    constants = constants or {}
+    names = ', '.join(list(columns) + list(constants))
+    placeholders = ', '.join('?' * (len(columns) + len(constants)))
+    rows = zip(*[a.tolist() for a in arrays], *[repeat(v) for v in constants.values()])
+    conn.executemany(f"INSERT INTO {table} ({names}) VALUES ({placeholders})", rows)
+
+
+def insert_rows(conn, table, df):
+    """Inserts the rows of `df` (columns named as in `table`) with one executemany."""
+    insert_batch(conn, table, *to_batch(df))
+
+
+def rows_per_second(rows, start):
+    """'N rows/s' since perf_counter() value `start`."""
+    elapsed = time.perf_counter() - start
+    return f"{rows / elapsed:,.0f} rows/s" if elapsed > 0 else "n/a rows/s"
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+
+def _sources():
+    """(table, create SQL, index SQLs, files, column_map(path), read_chunks(path, column_map, mapping)) per tr_* table."""
+    from eba_benchmarking.ingestion.migrations import FACT_INDEXES
+    from eba_benchmarking.ingestion.parsers import tr_cre, tr_oth, tr_rest
+
+    for parser in (tr_cre.get_parser(), tr_oth.get_parser()):
+        yield (parser.table_name, parser.create_table_sql, parser.index_sqls, sorted(glob.glob(parser.file_pattern)),
+               parser._column_map, parser._read_chunks)
+    for table, (prefix, create_sql, mappings) in tr_rest.TABLES.items():
+        yield (table, create_sql, FACT_INDEXES[table], sorted(glob.glob(os.path.join(tr_rest.RAW_FOLDER, f"{prefix}*.csv"))),
+               lambda path, mappings=mappings: tr_rest.column_map(path, mappings), tr_rest.read_chunks)
+
+
+def _timed_load(directory, table, create_sql, index_sqls, chunks, bulk):
+    """Loads `chunks` into a fresh database in `directory`; returns (rows, seconds) including the index build."""
+    path = os.path.join(directory, f"bench_{'bulk' if bulk else 'to_sql'}.db")
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(create_sql)
+        for idx_sql in index_sqls:
+            conn.execute(idx_sql)
+        conn.commit()
+        rows = 0
+        start = time.perf_counter()
+        if bulk:
+            with bulk_load(conn, table):
+                for chunk in chunks:
+                    insert_rows(conn, table, chunk)
+                    rows += len(chunk)
+                conn.commit()
+        else:
+            for chunk in chunks:
+                chunk.to_sql(table, conn, if_exists='append', index=False)
+                rows += len(chunk)
+        return rows, time.perf_counter() - start
+    finally:
+        conn.close()
+        os.remove(path)
+
+
+def benchmark():
+    """rows/sec of every tr_* file loaded per chunk with to_sql (before) and in bulk-load mode (after)."""
+    from eba_benchmarking.utils import get_item_mapping
+    from eba_benchmarking.ingestion.parsers.base import exercise_year
+
+    source = sqlite3.connect(DB_NAME)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for table, create_sql, index_sqls, files, column_map, read_chunks in _sources():
+            for csv_path in files:
+                columns = column_map(csv_path)
+                if columns is None:
+                    continue
+                mapping = get_item_mapping(source, exercise_year(os.path.basename(csv_path)))
+                # Parse once so both runs time the database writes only
+                chunks = list(read_chunks(csv_path, columns, mapping))
+                before = _timed_load(directory, table, create_sql, index_sqls, chunks, bulk=False)
+                after = _timed_load(directory, table, create_sql, index_sqls, chunks, bulk=True)
+                results.append((os.path.basename(csv_path), before[0], before[0] / before[1], after[0] / after[1]))
+    source.close()
+
+    print(f"\n{'File':<40} {'Rows':>12} {'to_sql rows/s':>15} {'bulk rows/s':>15} {'Speedup':>8}")
+    for name, rows, before, after in results:
+        print(f"{name:<40} {rows:>12,} {before:>15,.0f} {after:>15,.0f} {after / before:>7.1f}x")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -3,7 +3,7 @@ import sqlite3
 import os
 import glob
 from eba_benchmarking.config import ROOT_DIR, DB_NAME
-from eba_benchmarking.utils import normalize_period
+from eba_benchmarking.utils import normalize_periods
 
 def main():
     print("--- [KRI] Processing EBA Risk Dashboard Data Annex ---")
@@ -29,7 +29,7 @@ def main():
         
         # 4. Standardize Data
         print("  > Normalizing periods and cleaning data...")
-        df['period'] = df['period'].astype(str).apply(normalize_period)
+        df['period'] = normalize_periods(df['period'].astype(str))
         
         # Ensure country is string and uppercase
         df['country'] = df['country'].astype(str).str.upper().str.strip()
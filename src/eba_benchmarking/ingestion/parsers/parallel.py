@@ -0,0 +1,121 @@
+"""
+Parallel CSV parsing for the tr_* parsers, with the database writes on one connection.
+
+Reading a CSV chunk, mapping item IDs and the numeric conversions used to
+run on the thread that also writes to SQLite, one file after the other.
+parse_files() hands every file to a worker process (at most INGEST_WORKERS
+at a time). A worker runs the parser's read_chunks() and sends each chunk
+as a batch of NumPy column arrays through its own queue. The queue holds at
+most INGEST_QUEUE_SIZE batches, so a worker waits while the writer is
+behind. Memory stays below roughly INGEST_WORKERS x INGEST_QUEUE_SIZE
+chunks.
+
+The caller is the only writer. It receives the files in job order and
+writes each one as one transaction while the next files are already being
+parsed:
+
+    for job, batches in parse_files(jobs):
+        for columns, arrays in batches:      # raises if the worker failed
+            insert_batch(conn, table, columns, arrays)
+        conn.commit()
+
+With INGEST_WORKERS <= 1, or a single file, files are parsed inline.
+"""
+import queue
+import traceback
+import multiprocessing as mp
+from collections import namedtuple
+from eba_benchmarking.config import INGEST_WORKERS, INGEST_QUEUE_SIZE
+from eba_benchmarking.ingestion.parsers.bulk_load import to_batch
+
+# read_chunks(path, column_map, mapping) yields typed DataFrame chunks; it
+# must be picklable (a module-level function or a method of a picklable parser)
+ParseJob = namedtuple('ParseJob', ['path', 'read_chunks', 'column_map', 'mapping'])
+
+# Seconds between liveness checks of a worker while waiting for its next batch
+POLL_SECONDS = 1.0
+
+
+class ParseError(Exception):
+    """A worker failed to parse a file; carries the worker's traceback."""
+
+
+def _parse_worker(job, out):
+    try:
+        rows = 0
+        for chunk in job.read_chunks(job.path, job.column_map, job.mapping):
+            out.put(('batch', to_batch(chunk)))
+            rows += len(chunk)
+        out.put(('done', rows))
+    except Exception:
+        out.put(('error', traceback.format_exc()))
+
+
+def _inline_batches(job):
+    for chunk in job.read_chunks(job.path, job.column_map, job.mapping):
+        yield to_batch(chunk)
+
+
+def _worker_batches(process, out):
+    """Batches of one worker until it reports done; stops the worker if the caller gives up early."""
+    finished = False
+    try:
+        while True:
+            try:
+                kind, payload = out.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                if process.is_alive():
+                    continue
+                try:
+                    kind, payload = out.get(timeout=POLL_SECONDS)
+                except queue.Empty:
+                    raise ParseError(f"worker exited with code {process.exitcode}") from None
+            if kind == 'batch':
+                yield payload
+            elif kind == 'done':
+                finished = True
+                return
+            else:
+                finished = True
+                raise ParseError(payload)
+    finally:
+        if not finished:
+            process.terminate()
+        process.join()
+
+
+def parse_files(jobs, workers=INGEST_WORKERS, queue_size=INGEST_QUEUE_SIZE):
+    """
+    Yields (job, batches) in the order of `jobs`, where batches yields the
+    file's (columns, arrays) and raises ParseError if its parse failed.
+    Consume each file's batches before moving on to the next file.
+    """
+    jobs = list(jobs)
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield job, _inline_batches(job)
+        return
+
+    ctx = mp.get_context()
+    started = []
+
+    def start(job):
+        out = ctx.Queue(maxsize=queue_size)
+        process = ctx.Process(target=_parse_worker, args=(job, out), daemon=True)
+        process.start()
+        started.append((process, out))
+
+    try:
+        for job in jobs[:workers]:
+            start(job)
+        for i, job in enumerate(jobs):
+            process, out = started[i]
+            batches = _worker_batches(process, out)
+            yield job, batches
+            batches.close()
+            if i + workers < len(jobs):
+                start(jobs[i + workers])
+    finally:
+        for process, _ in started:
+            if process.is_alive():
+                process.terminate()
@@ -1,6 +1,7 @@
 from eba_benchmarking.ingestion.parsers.base import BaseParser
+from eba_benchmarking.ingestion.migrations import FACT_INDEXES
 
-def main():
+def get_parser():
     col_mapping_rules = {
         'lei': ['LEI_code', 'LEI_Code', 'lei_code', 'LEI'],
         'period': ['Period', 'period', 'PERIOD'],
@@ -18,7 +19,7 @@ def main():
     CREATE TABLE IF NOT EXISTS facts_cre (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         lei TEXT,
-        period INTEGER,
+        period TEXT,
         item_id TEXT,
         portfolio INTEGER,
         country TEXT,
@@ -32,17 +33,13 @@ def main():
     )
     '''
 
-    indexes = [
-        "CREATE INDEX IF NOT EXISTS idx_cre_lei ON facts_cre(lei)",
-        "CREATE INDEX IF NOT EXISTS idx_cre_item ON facts_cre(item_id)",
-        "CREATE INDEX IF NOT EXISTS idx_cre_period ON facts_cre(period)"
-    ]
+    indexes = FACT_INDEXES['facts_cre']
 
     dtype_conversions = {
         'int': ['portfolio', 'exposure', 'status', 'perf_status', 'nace_codes']
     }
 
-    parser = BaseParser(
+    return BaseParser(
         table_name='facts_cre',
         file_pattern_prefix='tr_cre',
         col_mapping_rules=col_mapping_rules,
@@ -50,8 +47,9 @@ def main():
         index_sqls=indexes,
         dtype_conversions=dtype_conversions
     )
-    
-    parser.run()
+
+def main():
+    get_parser().run()
 
 if __name__ == '__main__':
     main()
@@ -1,6 +1,7 @@
 from eba_benchmarking.ingestion.parsers.base import BaseParser
+from eba_benchmarking.ingestion.migrations import FACT_INDEXES
 
-def main():
+def get_parser():
     col_mapping_rules = {
         'lei': ['LEI_code', 'LEI_Code', 'lei'],
         'period': ['Period', 'period'],
@@ -30,19 +31,14 @@ def main():
     )
     '''
 
-    indexes = [
-        "CREATE INDEX IF NOT EXISTS idx_oth_lei ON facts_oth(lei)",
-        "CREATE INDEX IF NOT EXISTS idx_oth_item ON facts_oth(item_id)",
-        "CREATE INDEX IF NOT EXISTS idx_oth_instrument ON facts_oth(financial_instruments)",
-        "CREATE INDEX IF NOT EXISTS idx_oth_period ON facts_oth(period)"
-    ]
+    indexes = FACT_INDEXES['facts_oth']
 
     # Note: 'exposure', 'assets_fv' etc are integers in OTH too, but base parser handles them if in 'int' list
     dtype_conversions = {
         'int': ['assets_fv', 'assets_stages', 'exposure', 'financial_instruments']
     }
 
-    parser = BaseParser(
+    return BaseParser(
         table_name='facts_oth',
         file_pattern_prefix='tr_oth',
         col_mapping_rules=col_mapping_rules,
@@ -50,8 +46,9 @@ def main():
         index_sqls=indexes,
         dtype_conversions=dtype_conversions
     )
-    
-    parser.run()
+
+def main():
+    get_parser().run()
 
 if __name__ == '__main__':
     main()
@@ -3,26 +3,78 @@ import sqlite3
 import os
 import glob
 import re
+import time
 from eba_benchmarking.config import ROOT_DIR, DB_NAME
-from eba_benchmarking.utils import get_item_mapping
+from eba_benchmarking.utils import get_item_mapping, normalize_periods
+from eba_benchmarking.ingestion.migrations import FACT_INDEXES
+from eba_benchmarking.ingestion.processors.compact_facts import drop_compact_layout
+from eba_benchmarking.ingestion.processors.export_columnar import invalidate_snapshot
+from eba_benchmarking.ingestion.parsers.bulk_load import bulk_load, insert_batch, rows_per_second
+from eba_benchmarking.ingestion.parsers.parallel import ParseJob, parse_files
+from eba_benchmarking.data.versions import bump_data_versions
 
 # --- CONFIGURATION ---
 RAW_FOLDER = os.path.join(ROOT_DIR, 'data', 'raw')
 
-def run_parser(conn, csv_path, table_name, specific_mappings, mapping=None):
+MRK_SQL = '''
+    CREATE TABLE IF NOT EXISTS facts_mrk (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        lei TEXT,
+        period TEXT,
+        item_id TEXT,
+        portfolio INTEGER,
+        mkt_modprod INTEGER,
+        mkt_risk INTEGER,
+        amount REAL,
+        FOREIGN KEY(lei) REFERENCES institutions(lei),
+        FOREIGN KEY(item_id) REFERENCES dictionary(item_id)
+    )
+    '''
+
+SOV_SQL = '''
+    CREATE TABLE IF NOT EXISTS facts_sov (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        lei TEXT,
+        period TEXT,
+        item_id TEXT,
+        country TEXT,
+        maturity INTEGER,
+        accounting_portfolio INTEGER,
+        amount REAL,
+        FOREIGN KEY(lei) REFERENCES institutions(lei),
+        FOREIGN KEY(item_id) REFERENCES dictionary(item_id)
+    )
+    '''
+
+MRK_MAP = {
+    'portfolio': ['Portfolio', 'portfolio'],
+    'mkt_modprod': ['MKT_Modprod', 'MKT_modprod', 'mkt_modprod'],
+    'mkt_risk': ['Mkt_risk', 'Mkt_Risk', 'mkt_risk']
+}
+
+SOV_MAP = {
+    'country': ['Country', 'country', 'Ctry'],
+    'maturity': ['Maturity', 'maturity'],
+    'accounting_portfolio': ['Accounting_portfolio', 'Acc_Portfolio', 'accounting_portfolio']
+}
+
+# table -> (file prefix, schema, specific column mappings)
+TABLES = {
+    'facts_mrk': ('tr_mrk', MRK_SQL, MRK_MAP),
+    'facts_sov': ('tr_sov', SOV_SQL, SOV_MAP),
+}
+
+def column_map(csv_path, specific_mappings):
     """
-    Parses a CSV and inserts it into the specified DB table.
+    Returns {CSV header: DB column} for the file, or None if it cannot be read or lacks essential columns.
     """
-    cursor = conn.cursor()
-    print(f"--- Processing {os.path.basename(csv_path)} ---")
-    
     # 1. Inspect Headers
     try:
         initial_df = pd.read_csv(csv_path, nrows=0)
         actual_cols = initial_df.columns.tolist()
     except Exception as e:
-        print(f"  [ERROR] Could not read headers: {e}")
-        return
+        print(f"  [ERROR] Could not read headers of {os.path.basename(csv_path)}: {e}")
+        return None
 
     # 2. Build Column Map
     base_mappings = {
@@ -33,47 +85,64 @@ def run_parser(conn, csv_path, table_name, specific_mappings, mapping=None):
     }
     all_mappings = {**base_mappings, **specific_mappings}
     
-    use_cols = []
     db_rename_map = {}
     
     for db_col, candidates in all_mappings.items():
         for candidate in candidates:
             if candidate in actual_cols:
-                use_cols.append(candidate)
                 db_rename_map[candidate] = db_col
                 break
     
     if 'lei' not in db_rename_map.values() or 'amount' not in db_rename_map.values() or 'item_id' not in db_rename_map.values():
-         print(f"  [SKIP] Missing essential columns. Skipping file.")
-         return
+         print(f"  [SKIP] Missing essential columns in {os.path.basename(csv_path)}. Skipping file.")
+         return None
+    return db_rename_map
 
-    # 3. Process Data
+def read_chunks(csv_path, db_rename_map, mapping=None):
+    """
+    Yields the CSV rows in typed chunks, columns named as in the DB table.
+    """
     chunk_size = 100000
+    int_dims = [col for col in db_rename_map.values() 
+                if col not in ['lei', 'period', 'item_id', 'amount', 'country']]
+
+    for chunk in pd.read_csv(csv_path, usecols=list(db_rename_map), chunksize=chunk_size, dtype=str):
+        chunk.rename(columns=db_rename_map, inplace=True)
+        
+        # Normalize Item ID
+        if mapping:
+            chunk['item_id'] = chunk['item_id'].map(mapping).fillna(chunk['item_id'])
+
+        if 'period' in chunk.columns:
+            chunk['period'] = normalize_periods(chunk['period'])
+            
+        chunk['amount'] = pd.to_numeric(chunk['amount'], errors='coerce')
+        
+        for col in int_dims:
+            chunk[col] = pd.to_numeric(chunk[col], errors='coerce').fillna(0).astype(int)
+        yield chunk
+
+def write_file(conn, csv_path, table_name, batches):
+    """
+    Inserts the parsed batches of one CSV into the specified DB table (one transaction per file).
+    """
+    print(f"--- Processing {os.path.basename(csv_path)} ---")
+
+    # 3. Process Data
     total_rows = 0
+    start = time.perf_counter()
     
     try:
-        for chunk in pd.read_csv(csv_path, usecols=use_cols, chunksize=chunk_size, dtype=str):
-            chunk.rename(columns=db_rename_map, inplace=True)
-            
-            # Normalize Item ID
-            if mapping:
-                chunk['item_id'] = chunk['item_id'].map(mapping).fillna(chunk['item_id'])
-                
-            chunk['amount'] = pd.to_numeric(chunk['amount'], errors='coerce')
-            
-            int_dims = [col for col in db_rename_map.values() 
-                        if col not in ['lei', 'period', 'item_id', 'amount', 'country']]
-            
-            for col in int_dims:
-                chunk[col] = pd.to_numeric(chunk[col], errors='coerce').fillna(0).astype(int)
-
-            chunk.to_sql(table_name, conn, if_exists='append', index=False)
-            total_rows += len(chunk)
+        for columns, arrays in batches:
+            insert_batch(conn, table_name, columns, arrays)
+            total_rows += len(arrays[0])
             print(f"    - Imported {total_rows} rows...", end='\r')
+        conn.commit()
             
-        print(f"\n  ✅ Success! Imported {total_rows} records into '{table_name}'.")
+        print(f"\n  ✅ Success! Imported {total_rows} records into '{table_name}' ({rows_per_second(total_rows, start)}).")
 
     except Exception as e:
+        conn.rollback()
         print(f"\n  [ERROR] Processing failed: {e}")
 
 def main():
@@ -82,73 +151,41 @@ def main():
 
     # Clear tables for fresh import (Idempotency)
     print("--- [MRK/SOV] Clearing tables for fresh import ---")
+    for table in TABLES:
+        drop_compact_layout(cursor, table)
+        invalidate_snapshot(table)
     cursor.execute('DROP TABLE IF EXISTS facts_mrk')
     cursor.execute('DROP TABLE IF EXISTS facts_sov')
 
     # Schemas
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS facts_mrk (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        lei TEXT,
-        period INTEGER,
-        item_id TEXT,
-        portfolio INTEGER,
-        mkt_modprod INTEGER,
-        mkt_risk INTEGER,
-        amount REAL,
-        FOREIGN KEY(lei) REFERENCES institutions(lei),
-        FOREIGN KEY(item_id) REFERENCES dictionary(item_id)
-    )
-    ''')
-
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS facts_sov (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        lei TEXT,
-        period INTEGER,
-        item_id TEXT,
-        country TEXT,
-        maturity INTEGER,
-        accounting_portfolio INTEGER,
-        amount REAL,
-        FOREIGN KEY(lei) REFERENCES institutions(lei),
-        FOREIGN KEY(item_id) REFERENCES dictionary(item_id)
-    )
-    ''')
+    for prefix, create_sql, _ in TABLES.values():
+        cursor.execute(create_sql)
     conn.commit()
 
-    # --- 1. Process MRK files ---
-    mrk_files = glob.glob(os.path.join(RAW_FOLDER, 'tr_mrk*.csv'))
-    mrk_map = {
-        'portfolio': ['Portfolio', 'portfolio'],
-        'mkt_modprod': ['MKT_Modprod', 'MKT_modprod', 'mkt_modprod'],
-        'mkt_risk': ['Mkt_risk', 'Mkt_Risk', 'mkt_risk']
-    }
-    for f in mrk_files:
-        year_match = re.search(r'20\d{2}', os.path.basename(f))
-        exercise_year = year_match.group(0) if year_match else '2025'
-        mapping = get_item_mapping(conn, exercise_year)
-        run_parser(conn, f, 'facts_mrk', mrk_map, mapping)
-
-    # --- 2. Process SOV files ---
-    sov_files = glob.glob(os.path.join(RAW_FOLDER, 'tr_sov*.csv'))
-    sov_map = {
-        'country': ['Country', 'country', 'Ctry'],
-        'maturity': ['Maturity', 'maturity'],
-        'accounting_portfolio': ['Accounting_portfolio', 'Acc_Portfolio', 'accounting_portfolio']
-    }
-    for f in sov_files:
-        year_match = re.search(r'20\d{2}', os.path.basename(f))
-        exercise_year = year_match.group(0) if year_match else '2025'
-        mapping = get_item_mapping(conn, exercise_year)
-        run_parser(conn, f, 'facts_sov', sov_map, mapping)
+    # --- Process MRK, then SOV files ---
+    for table, (prefix, _, specific_mappings) in TABLES.items():
+        jobs = []
+        for f in glob.glob(os.path.join(RAW_FOLDER, f'{prefix}*.csv')):
+            year_match = re.search(r'20\d{2}', os.path.basename(f))
+            exercise_year = year_match.group(0) if year_match else '2025'
+            mapping = get_item_mapping(conn, exercise_year)
+            db_rename_map = column_map(f, specific_mappings)
+            if db_rename_map is not None:
+                jobs.append(ParseJob(f, read_chunks, db_rename_map, mapping))
+
+        # Files are parsed in worker processes while this connection writes
+        with bulk_load(conn, table):
+            for job, batches in parse_files(jobs):
+                write_file(conn, job.path, table, batches)
 
     # Indexes
-    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_facts_mrk_lei ON facts_mrk(lei)")
-    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_facts_sov_lei ON facts_sov(lei)")
+    for table in TABLES:
+        for idx_sql in FACT_INDEXES[table]:
+            cursor.execute(idx_sql)
     conn.commit()
+    bump_data_versions(conn, list(TABLES))
     conn.close()
     print("\nBatch job complete.")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
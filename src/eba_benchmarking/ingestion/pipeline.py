@@ -25,6 +25,12 @@ import eba_benchmarking.ingestion.fetchers.bog as bog
 import eba_benchmarking.ingestion.parsers.kri as kri_parser
 import eba_benchmarking.ingestion.parsers.map_kris as map_kris
 import eba_benchmarking.ingestion.processors.cleanup_db as cleanup_db
+import eba_benchmarking.ingestion.migrations as migrations
+import eba_benchmarking.ingestion.processors.compact_facts as compact_facts
+import eba_benchmarking.ingestion.processors.build_mart as build_mart
+import eba_benchmarking.ingestion.processors.export_columnar as export_columnar
+import eba_benchmarking.ingestion.processors.stamp_versions as stamp_versions
+from eba_benchmarking.config import COMPACT_FACTS_LAYOUT, COLUMNAR_SNAPSHOTS, COLUMNAR_TABLES
 
 # Import Pillar 3 parser
 try:
@@ -40,6 +46,11 @@ def run_pipeline():
     print("==========================================\n")
     start_time = time.time()
 
+    # Steps below rewrite tables in place (e.g. classification UPDATEs keep rowids),
+    # so columnar snapshots are dropped up front and re-exported at the end
+    for table in COLUMNAR_TABLES:
+        export_columnar.invalidate_snapshot(table)
+
     steps = [
         ("Initializing Database & Metadata", db_init.main),
         ("Generating Commercial Names", gen_com_names.main),
@@ -57,12 +68,23 @@ def run_pipeline():
         ("Parsing EBA Country KRIs (Annex)", kri_parser.main),
         ("Mapping KRIs to Dictionary", map_kris.main),
         ("Cleaning and Normalizing Database", cleanup_db.main),
+        ("Applying Schema Migrations & Indexes", migrations.main),
     ]
+
+    # Optional compact layout must precede the mart so its source signature matches
+    if COMPACT_FACTS_LAYOUT:
+        steps.append(("Compacting Facts Tables", compact_facts.main))
+    steps.append(("Building Bank Metrics Mart", build_mart.main))
+    if COLUMNAR_SNAPSHOTS:
+        steps.append(("Exporting Columnar Snapshots", export_columnar.main))
     
     # Add Pillar 3 parsing if available
     if PILLAR3_AVAILABLE:
         steps.append(("Parsing Pillar 3 Reports (PDFs & Excel)", run_pillar3_parser))
 
+    # Last: bump the data version of every table the steps above changed
+    steps.append(("Stamping Data Versions", stamp_versions.main))
+
     for title, func in steps:
         print(f"\n--- [STEP] {title} ---")
         try:
@@ -0,0 +1,80 @@
+import sqlite3
+import pandas as pd
+from datetime import datetime
+from eba_benchmarking.config import DB_NAME
+from eba_benchmarking.data.benchmarking import compute_all_benchmarking_metrics, compute_percentile_cube
+from eba_benchmarking.data.mart import MART_TABLE, MART_INFO_TABLE, PERCENTILES_TABLE, MART_SOURCE_TABLES, get_source_signature
+from eba_benchmarking.data.versions import stamp_data_versions
+
+
+def _dedupe_columns(df):
+    """SQLite column names are case-insensitive: keep the first of any clashing names."""
+    seen = set()
+    keep = []
+    for col in df.columns:
+        key = str(col).lower()
+        if key in seen:
+            print(f"  - Dropping duplicate column '{col}'")
+            continue
+        seen.add(key)
+        keep.append(col)
+    return df[keep]
+
+
+def _write_mart_table(conn, table, df, signature, index_cols):
+    """Replaces `table` with df and records the source signature it was built from."""
+    # Invalidate first so a failed rebuild is never read as fresh
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {MART_INFO_TABLE} (table_name TEXT PRIMARY KEY, source_signature TEXT, built_at TEXT, row_count INTEGER)")
+    conn.execute(f"DELETE FROM {MART_INFO_TABLE} WHERE table_name = ?", (table,))
+    conn.commit()
+
+    df.to_sql(table, conn, if_exists='replace', index=False)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{'_'.join(index_cols)} ON {table}({', '.join(index_cols)})")
+    conn.execute(
+        f"INSERT INTO {MART_INFO_TABLE} (table_name, source_signature, built_at, row_count) VALUES (?, ?, ?, ?)",
+        (table, signature, datetime.now().isoformat(timespec='seconds'), len(df))
+    )
+    conn.commit()
+
+
+def build_percentiles(conn, df, signature):
+    """Ranks every bank within its own peer groups for every period of the mart frame."""
+    df_inst = pd.read_sql("SELECT lei, country_iso, region, size_category FROM institutions", conn)
+    df_cube = compute_percentile_cube(df, df_inst)
+    if df_cube.empty:
+        print(f"⚠️ No percentiles computed. Skipping {PERCENTILES_TABLE}.")
+        return
+    _write_mart_table(conn, PERCENTILES_TABLE, df_cube, signature, ['lei', 'period', 'peer_key'])
+    print(f"  > {PERCENTILES_TABLE}: {len(df_cube)} rows ({df_cube['lei'].nunique()} banks, {df_cube['period'].nunique()} periods)")
+
+
+def main():
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        print("--- Building Bank Metrics Mart ---")
+        leis = pd.read_sql("SELECT lei FROM institutions", conn)['lei'].tolist()
+        if not leis:
+            print("⚠️ No institutions found. Skipping mart build.")
+            return
+
+        # Stamp first so the signature covers the steps that ran since the last stamp;
+        # it is taken before computing so concurrent (stamped) writes mark the mart stale
+        stamp_data_versions(conn, MART_SOURCE_TABLES)
+        signature = get_source_signature(conn)
+
+        df = compute_all_benchmarking_metrics(leis)
+        if df.empty:
+            print("⚠️ No metrics computed. Skipping mart build.")
+            return
+        df = _dedupe_columns(df)
+
+        _write_mart_table(conn, MART_TABLE, df, signature, ['lei', 'period'])
+        print(f"  > {MART_TABLE}: {len(df)} rows ({df['lei'].nunique()} banks, {df['period'].nunique()} periods)")
+
+        build_percentiles(conn, df, signature)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
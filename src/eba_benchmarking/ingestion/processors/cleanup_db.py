@@ -1,32 +1,104 @@
+"""
+Normalizes legacy period/date values in place.
+
+The tr_* parsers and the fetchers write normalized periods (YYYY-MM-DD month
+end, see utils.normalize_period), so this step only fixes rows loaded before
+that. Instead of reading and rewriting whole tables, each column's distinct
+values are normalized in Python and applied with one UPDATE through a small
+mapping table, which keeps the table's schema, indexes and rowids. Changed
+tables get their data version bumped, since an in-place UPDATE leaves row
+counts as they were (see data/versions.py).
+"""
 import sqlite3
-import pandas as pd
 from eba_benchmarking.config import DB_NAME
 from eba_benchmarking.utils import normalize_period
+from eba_benchmarking.data.versions import bump_data_versions
+
+def _object_type(conn, name):
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+def period_mapping(conn, table_name, date_col):
+    """
+    Returns ({raw value: normalized value} for the values that change, set of values already normalized).
+    """
+    raw_values = [r[0] for r in conn.execute(f"SELECT DISTINCT {date_col} FROM {table_name} WHERE {date_col} IS NOT NULL")]
+    mapping = {}
+    unchanged = set()
+    for raw in raw_values:
+        normalized = normalize_period(raw)
+        if normalized == raw:
+            unchanged.add(raw)
+        else:
+            mapping[raw] = normalized
+    return mapping, unchanged
+
+def _has_collisions(mapping, unchanged):
+    """True if normalizing merges distinct values, so rows may become duplicates."""
+    targets = [v for v in mapping.values() if v is not None]
+    return len(set(targets)) < len(targets) or any(t in unchanged for t in targets)
 
 def cleanup_table(conn, table_name, date_col):
+    """Normalizes `date_col` of `table_name` in place; returns True if rows changed."""
     print(f"Cleaning table: {table_name}...")
     try:
-        df = pd.read_sql(f"SELECT * FROM {table_name}", conn)
-        if df.empty:
-            print(f"  - Table {table_name} is empty.")
-            return
-        
-        orig_count = len(df)
-        df[date_col] = df[date_col].apply(normalize_period)
-        
-        # Deduplicate after normalization (important if we collapsed periods)
-        # We find identifying columns (all except value?)
-        identifying_cols = [c for c in df.columns if c != 'value']
-        df = df.drop_duplicates(subset=identifying_cols)
-        
-        df.to_sql(table_name, conn, if_exists='replace', index=False)
-        print(f"  - Success. {orig_count} -> {len(df)} records.")
+        object_type = _object_type(conn, table_name)
+        if object_type is None:
+            print(f"  - Table {table_name} does not exist.")
+            return False
+        if object_type == 'view':
+            # Compact layout (see compact_facts.py): rows were normalized when loaded
+            print(f"  - {table_name} is a view, skipped.")
+            return False
+
+        mapping, unchanged = period_mapping(conn, table_name, date_col)
+        if not mapping:
+            print(f"  - Periods already normalized ({len(unchanged)} values).")
+            return False
+
+        conn.execute("DROP TABLE IF EXISTS temp.period_map")
+        # Untyped columns keep INTEGER and TEXT raw values exactly as stored
+        conn.execute("CREATE TEMP TABLE period_map (raw PRIMARY KEY, normalized)")
+        conn.executemany("INSERT INTO temp.period_map VALUES (?, ?)", mapping.items())
+
+        # Deduplicate on the normalized values (important if we collapse periods), keeping
+        # the first row of each group like drop_duplicates did (e.g. the first day of a month
+        # of a daily ECB series). Identifying columns are all except value; tables with an
+        # id never have duplicates.
+        removed = 0
+        cols = [c[1] for c in conn.execute(f"PRAGMA table_info({table_name})").fetchall()]
+        if _has_collisions(mapping, unchanged) and 'id' not in cols:
+            identifying_cols = ', '.join(
+                f"CASE WHEN m.raw IS NULL THEN t.{c} ELSE m.normalized END" if c == date_col else f"t.{c}"
+                for c in cols if c != 'value'
+            )
+            removed = conn.execute(f"""
+                DELETE FROM {table_name} WHERE rowid NOT IN (
+                    SELECT MIN(t.rowid) FROM {table_name} t
+                    LEFT JOIN temp.period_map m ON m.raw = t.{date_col}
+                    GROUP BY {identifying_cols}
+                )
+            """).rowcount
+
+        # OR REPLACE only guards keys narrower than the identifying columns
+        updated = conn.execute(f"""
+            UPDATE OR REPLACE {table_name}
+            SET {date_col} = (SELECT normalized FROM temp.period_map WHERE raw = {table_name}.{date_col})
+            WHERE {date_col} IN (SELECT raw FROM temp.period_map)
+        """).rowcount
+
+        conn.execute("DROP TABLE temp.period_map")
+        conn.commit()
+        print(f"  - Success. {len(mapping)} period values normalized, {updated} records updated, {removed} duplicates removed.")
+        return updated > 0 or removed > 0
     except Exception as e:
+        conn.rollback()
         print(f"  - Error cleaning {table_name}: {e}")
+        return False
 
 def main():
     conn = sqlite3.connect(DB_NAME)
-    
+
     # List of (table, date_column)
     tasks = [
         ('macro_economics', 'period'),
@@ -40,10 +112,12 @@ def main():
         ('facts_mrk', 'period'),
         ('facts_sov', 'period')
     ]
-    
-    for table, col in tasks:
-        cleanup_table(conn, table, col)
-        
+
+    changed = [table for table, col in tasks if cleanup_table(conn, table, col)]
+    if changed:
+        bump_data_versions(conn, changed)
+        print(f"  > Data versions bumped: {', '.join(changed)}")
+
     conn.close()
     print("\nDatabase cleanup complete.")
 
@@ -0,0 +1,215 @@
+"""
+Optional dictionary-encoded layout for the facts tables.
+
+Each configured table (COMPACT_FACTS_TABLES) is rewritten as
+`<table>_compact`: LEI, item and period are replaced by integer surrogate keys
+(key_lei / key_item / key_period) and rows are clustered WITHOUT ROWID on
+(lei_id, item_key, period_id, seq). The unused AUTOINCREMENT `id` is dropped.
+A view with the original name and columns keeps the SQL in data/* and
+p3_explorer.py working unchanged.
+
+    python -m eba_benchmarking.ingestion.processors.compact_facts            # compact + report
+    python -m eba_benchmarking.ingestion.processors.compact_facts --expand   # back to row layout
+
+Rows with a NULL lei, item_id or period are not carried over: no data-layer
+query can select them.
+"""
+import os
+import sys
+import time
+import sqlite3
+import statistics
+from eba_benchmarking.config import DB_NAME, COMPACT_FACTS_TABLES, COMPACT_TABLE_SUFFIX
+from eba_benchmarking.ingestion.migrations import get_audit_statements
+
+KEY_COLUMNS = ['lei', 'period', 'item_id']
+KEY_TABLES = {
+    'lei': ('key_lei', 'lei_id'),
+    'item_id': ('key_item', 'item_key'),
+    'period': ('key_period', 'period_id'),
+}
+
+
+def _object_type(conn, name):
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def _dimension_columns(conn, table):
+    """Returns [(column, declared_type)] of the table, minus id, amount and the key columns."""
+    cols = conn.execute(f"PRAGMA table_info({table})").fetchall()
+    return [(c[1], c[2] or '') for c in cols if c[1] not in KEY_COLUMNS + ['id', 'amount']]
+
+
+def drop_compact_layout(cursor, table):
+    """Removes the compatibility view and compact table so `table` can be recreated as a plain table."""
+    cursor.execute(f"DROP VIEW IF EXISTS {table}")
+    cursor.execute(f"DROP TABLE IF EXISTS {table}{COMPACT_TABLE_SUFFIX}")
+
+
+def _ensure_key_tables(conn):
+    for source_col, (key_table, key_col) in KEY_TABLES.items():
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {key_table} (
+                {key_col} INTEGER PRIMARY KEY,
+                {source_col} TEXT NOT NULL UNIQUE
+            )
+        """)
+
+
+def compact_table(conn, table):
+    """Rewrites a plain facts table into the compact layout behind a view of the same name."""
+    compact = f"{table}{COMPACT_TABLE_SUFFIX}"
+    dims = _dimension_columns(conn, table)
+    dim_names = [d for d, _ in dims]
+
+    _ensure_key_tables(conn)
+    # Sorted inserts give key order == value order (periods compare chronologically)
+    for source_col, (key_table, _) in KEY_TABLES.items():
+        conn.execute(f"""
+            INSERT OR IGNORE INTO {key_table} ({source_col})
+            SELECT DISTINCT CAST({source_col} AS TEXT) FROM {table}
+            WHERE {source_col} IS NOT NULL ORDER BY 1
+        """)
+
+    dim_defs = ''.join(f"{d} {t},\n                " for d, t in dims)
+    conn.execute(f"DROP TABLE IF EXISTS {compact}")
+    conn.execute(f"""
+        CREATE TABLE {compact} (
+                lei_id INTEGER NOT NULL,
+                item_key INTEGER NOT NULL,
+                period_id INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                {dim_defs}amount REAL,
+                PRIMARY KEY (lei_id, item_key, period_id, seq)
+        ) WITHOUT ROWID
+    """)
+
+    # seq keeps rows that share (lei, item, period) distinct; dimensions stay nullable
+    dim_select = ''.join(f"f.{d}, " for d in dim_names)
+    conn.execute(f"""
+        INSERT INTO {compact}
+        SELECT l.lei_id, i.item_key, p.period_id,
+               ROW_NUMBER() OVER (PARTITION BY l.lei_id, i.item_key, p.period_id),
+               {dim_select}f.amount
+        FROM {table} f
+        JOIN key_lei l ON l.lei = CAST(f.lei AS TEXT)
+        JOIN key_item i ON i.item_id = CAST(f.item_id AS TEXT)
+        JOIN key_period p ON p.period = CAST(f.period AS TEXT)
+        ORDER BY 1, 2, 3
+    """)
+    # Item-first access (e.g. one item across all banks)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{compact}_item ON {compact}(item_key, lei_id, period_id)")
+
+    conn.execute(f"DROP TABLE {table}")
+    view_dims = ''.join(f"c.{d} AS {d}, " for d in dim_names)
+    conn.execute(f"""
+        CREATE VIEW {table} AS
+        SELECT l.lei AS lei, p.period AS period, i.item_id AS item_id, {view_dims}c.amount AS amount
+        FROM {compact} c
+        JOIN key_lei l ON l.lei_id = c.lei_id
+        JOIN key_item i ON i.item_key = c.item_key
+        JOIN key_period p ON p.period_id = c.period_id
+    """)
+
+
+def expand_table(conn, table):
+    """Materializes the compatibility view back into a plain row-layout table."""
+    tmp = f"{table}__expanded"
+    conn.execute(f"DROP TABLE IF EXISTS {tmp}")
+    conn.execute(f"CREATE TABLE {tmp} AS SELECT * FROM {table}")
+    drop_compact_layout(conn, table)
+    conn.execute(f"ALTER TABLE {tmp} RENAME TO {table}")
+
+# =============================================================================
+# SIZE & LATENCY REPORT
+# =============================================================================
+
+def measure_sizes(conn, tables):
+    """Bytes on disk per facts table, including its indexes and compact table (needs dbstat)."""
+    try:
+        rows = conn.execute("""
+            SELECT m.tbl_name, SUM(s.pgsize)
+            FROM dbstat s JOIN sqlite_master m ON m.name = s.name
+            GROUP BY m.tbl_name
+        """).fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    by_table = dict(rows)
+    return {t: by_table.get(t, 0) + by_table.get(f"{t}{COMPACT_TABLE_SUFFIX}", 0) for t in tables}
+
+
+def measure_latency(conn, tables, repeats=5):
+    """Median wall time (ms) of the audited data-layer queries (see migrations.py) that hit `tables`."""
+    timings = {}
+    for name, table, query, params in get_audit_statements(conn):
+        if table not in tables:
+            continue
+        runs = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            conn.execute(query, params).fetchall()
+            runs.append((time.perf_counter() - start) * 1000)
+        timings[name] = statistics.median(runs)
+    return timings
+
+
+def print_report(before, after):
+    """Prints the before/after size and latency comparison."""
+    print("\n  Size (MB)                 row layout   compact")
+    for key in before['sizes']:
+        b, a = before['sizes'][key] / 1e6, after['sizes'].get(key, 0) / 1e6
+        print(f"  {key:<24} {b:>11.1f} {a:>9.1f}")
+    print(f"  {'DB file':<24} {before['file'] / 1e6:>11.1f} {after['file'] / 1e6:>9.1f}")
+
+    print("\n  Latency (ms, median)      row layout   compact")
+    for key, b in before['latency'].items():
+        a = after['latency'].get(key)
+        a_str = f"{a:>9.2f}" if a is not None else f"{'-':>9}"
+        print(f"  {key:<24} {b:>11.2f} {a_str}")
+
+
+def _snapshot(conn, tables):
+    return {
+        'sizes': measure_sizes(conn, tables),
+        'latency': measure_latency(conn, tables),
+        'file': os.path.getsize(DB_NAME),
+    }
+
+
+def main(expand=False):
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        if expand:
+            print("--- Restoring Row Layout for Facts Tables ---")
+            for table in COMPACT_FACTS_TABLES:
+                if _object_type(conn, table) == 'view':
+                    print(f"  - Expanding {table}...")
+                    with conn:
+                        expand_table(conn, table)
+            return
+
+        print("--- Compacting Facts Tables ---")
+        tables = [t for t in COMPACT_FACTS_TABLES if _object_type(conn, t) == 'table']
+        if not tables:
+            print("  - Nothing to compact (tables missing or already compact).")
+            return
+
+        before = _snapshot(conn, tables)
+        for table in tables:
+            print(f"  - Compacting {table}...")
+            with conn:
+                compact_table(conn, table)
+
+        print("  - Running ANALYZE and VACUUM...")
+        conn.execute("ANALYZE")
+        conn.commit()
+        conn.execute("VACUUM")
+        after = _snapshot(conn, tables)
+        print_report(before, after)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main(expand='--expand' in sys.argv)
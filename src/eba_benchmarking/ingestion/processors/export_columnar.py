@@ -0,0 +1,136 @@
+"""
+Columnar snapshots of the facts tables and institutions.
+
+Each table in COLUMNAR_TABLES is written to COLUMNAR_DIR/<table>/ as Parquet:
+facts tables as one file per period (`period=<YYYY-MM-DD>/part-0.parquet`,
+hive-style) with rows sorted by item_id, lei so row-group statistics prune
+item/LEI filters; institutions as a single file. `_snapshot.json` records
+the source table's data version at export time (tables are stamped first,
+see data/versions.py). data/base.py:read_columnar() only serves a snapshot
+while that version is still current, so any stamped change to a table
+invalidates its snapshot without further bookkeeping.
+
+A table's directory is built next to the live one and swapped in at the end,
+so readers never see a half-written snapshot.
+
+    python -m eba_benchmarking.ingestion.processors.export_columnar
+"""
+import os
+import json
+import shutil
+import sqlite3
+from datetime import datetime
+import pandas as pd
+from eba_benchmarking.config import DB_NAME, COLUMNAR_DIR, COLUMNAR_TABLES
+from eba_benchmarking.data.mart import get_table_signature
+from eba_benchmarking.data.versions import stamp_data_versions
+from eba_benchmarking.data.base import SNAPSHOT_FILE
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    pa = pq = None
+    PYARROW_AVAILABLE = False
+
+PARTITION_COLUMN = 'period'
+
+
+def snapshot_path(table):
+    return os.path.join(COLUMNAR_DIR, table)
+
+
+def invalidate_snapshot(table):
+    """Removes the snapshot manifest so readers fall back to SQLite until the next export."""
+    manifest = os.path.join(snapshot_path(table), SNAPSHOT_FILE)
+    if os.path.exists(manifest):
+        os.remove(manifest)
+
+
+def _columns(conn, table):
+    return [c[1] for c in conn.execute(f"PRAGMA table_info({table})").fetchall() if c[1] != 'id']
+
+
+def _write_parquet(df, path):
+    # Keys as strings so filters compare like the TEXT-affinity SQL does
+    for col in ('lei', 'item_id'):
+        if col in df.columns:
+            df[col] = df[col].astype('string')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path, compression='zstd')
+
+
+def _export_facts(conn, table, cols, target):
+    """One Parquet file per period, rows ordered by item_id, lei. Returns (rows, periods)."""
+    select = ', '.join(c for c in cols if c != PARTITION_COLUMN)
+    periods = [r[0] for r in conn.execute(
+        f"SELECT DISTINCT {PARTITION_COLUMN} FROM {table} WHERE {PARTITION_COLUMN} IS NOT NULL ORDER BY 1"
+    ).fetchall()]
+    rows = 0
+    for period in periods:
+        df = pd.read_sql(
+            f"SELECT {select} FROM {table} WHERE {PARTITION_COLUMN} = ? ORDER BY item_id, lei",
+            conn, params=[period]
+        )
+        _write_parquet(df, os.path.join(target, f"{PARTITION_COLUMN}={period}", 'part-0.parquet'))
+        rows += len(df)
+    return rows, [str(p) for p in periods]
+
+
+def export_table(conn, table):
+    """Writes one table's snapshot and swaps it into COLUMNAR_DIR. Returns the row count."""
+    target = snapshot_path(table)
+    staging, retired = f"{target}.tmp", f"{target}.old"
+    shutil.rmtree(staging, ignore_errors=True)
+
+    # Signature is taken before reading so concurrent writes mark the snapshot stale
+    signature = get_table_signature(conn, table)
+    cols = _columns(conn, table)
+    if PARTITION_COLUMN in cols:
+        rows, periods = _export_facts(conn, table, cols, staging)
+    else:
+        df = pd.read_sql(f"SELECT {', '.join(cols)} FROM {table} ORDER BY lei", conn)
+        _write_parquet(df, os.path.join(staging, 'part-0.parquet'))
+        rows, periods = len(df), []
+
+    os.makedirs(staging, exist_ok=True)
+    with open(os.path.join(staging, SNAPSHOT_FILE), 'w') as f:
+        json.dump({
+            'table': table,
+            'source_signature': signature,
+            'exported_at': datetime.now().isoformat(timespec='seconds'),
+            'rows': rows,
+            'periods': periods,
+        }, f, indent=2)
+
+    shutil.rmtree(retired, ignore_errors=True)
+    if os.path.exists(target):
+        os.rename(target, retired)
+    os.rename(staging, target)
+    shutil.rmtree(retired, ignore_errors=True)
+    return rows
+
+
+def main():
+    print("--- Exporting Columnar Snapshots ---")
+    if not PYARROW_AVAILABLE:
+        print("⚠️ pyarrow not installed. Skipping columnar export (pip install pyarrow).")
+        return
+
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        stamp_data_versions(conn, COLUMNAR_TABLES)
+        for table in COLUMNAR_TABLES:
+            if get_table_signature(conn, table) is None:
+                print(f"  - {table}: missing, skipping")
+                invalidate_snapshot(table)
+                continue
+            rows = export_table(conn, table)
+            print(f"  > {table}: {rows} rows -> {snapshot_path(table)}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
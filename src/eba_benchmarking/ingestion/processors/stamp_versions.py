@@ -0,0 +1,32 @@
+"""
+Stamps the `data_version` table after the pipeline has written.
+
+Every table whose fingerprint changed since the last stamp gets its version
+bumped (see data/versions.py), so cached data functions reading it miss once
+and recompute, while entries built only from unchanged tables keep hitting.
+
+    python -m eba_benchmarking.ingestion.processors.stamp_versions
+"""
+import sqlite3
+from eba_benchmarking.config import DB_NAME
+from eba_benchmarking.data.versions import stamp_data_versions, VERSION_TABLE, GLOBAL_VERSION
+
+
+def main():
+    print("--- Stamping Data Versions ---")
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        changed = stamp_data_versions(conn)
+        if not changed:
+            print("  - No table changed since the last stamp.")
+            return
+        for table in changed:
+            print(f"  > {table}")
+        row = conn.execute(f"SELECT version, fingerprint FROM {VERSION_TABLE} WHERE table_name = ?", (GLOBAL_VERSION,)).fetchone()
+        print(f"  > Global data version {row[0]} ({row[1][:12]})")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
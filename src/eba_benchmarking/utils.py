@@ -1,11 +1,27 @@
 import pandas as pd
+import numpy as np
 import re
+import calendar
+from functools import lru_cache
 
-def normalize_period(period_str):
-    """
-    Standardizes inconsistent period strings into 'YYYY-MM-DD' (Month End).
-    Supports: YYYY, YYYY-MM, YYYY-QX, YYYY-MXX, YYYY-MM-DD
-    """
+# Period formats handled by normalize_period, compiled once
+_QUARTER_RE = re.compile(r'^(\d{4})-Q([1-4])$')
+_EUROSTAT_MONTH_RE = re.compile(r'^(\d{4})-M(\d{2})$')
+_YEAR_RE = re.compile(r'^\d{4}$')
+_YEAR_MONTH_COMPACT_RE = re.compile(r'^(\d{4})(\d{2})$')
+_YEAR_MONTH_RE = re.compile(r'^(\d{4})-(\d{2})$')
+
+PERIOD_CACHE_SIZE = 4096
+
+def _month_end(year, month):
+    """'YYYY-MM-DD' of the last day of the month, ValueError for an invalid month."""
+    year, month = int(year), int(month)
+    if not 1 <= month <= 12:
+        raise ValueError(f"month {year}-{month} out of range")
+    return f"{year:04d}-{month:02d}-{calendar.monthrange(year, month)[1]:02d}"
+
+@lru_cache(maxsize=PERIOD_CACHE_SIZE, typed=True)
+def _normalize_period_cached(period_str):
     if pd.isna(period_str) or not str(period_str).strip():
         return None
     
@@ -13,38 +29,88 @@ def normalize_period(period_str):
     
     try:
         # 1. Handle Quarterly (YYYY-QX)
-        if re.match(r'^\d{4}-Q[1-4]$', p):
-            year, q = p.split('-Q')
-            month = int(q) * 3
-            return pd.Timestamp(year=int(year), month=month, day=1).replace(day=pd.Timestamp(year=int(year), month=month, day=1).days_in_month).strftime('%Y-%m-%d')
+        m = _QUARTER_RE.match(p)
+        if m:
+            return _month_end(m.group(1), int(m.group(2)) * 3)
         
         # 2. Handle Eurostat Monthly (YYYY-MXX)
-        if re.match(r'^\d{4}-M\d{2}$', p):
-            year, month = p.split('-M')
-            return pd.Timestamp(year=int(year), month=int(month), day=1).replace(day=pd.Timestamp(year=int(year), month=int(month), day=1).days_in_month).strftime('%Y-%m-%d')
+        m = _EUROSTAT_MONTH_RE.match(p)
+        if m:
+            return _month_end(m.group(1), m.group(2))
         
         # 3. Handle Yearly (YYYY)
-        if re.match(r'^\d{4}$', p):
+        if _YEAR_RE.match(p):
             return f"{p}-12-31"
         
         # 4. Handle YYYYMM (e.g., 201412)
-        if re.match(r'^\d{6}$', p):
-            year = int(p[:4])
-            month = int(p[4:])
-            return pd.Timestamp(year=year, month=month, day=1).replace(day=pd.Timestamp(year=year, month=month, day=1).days_in_month).strftime('%Y-%m-%d')
+        m = _YEAR_MONTH_COMPACT_RE.match(p)
+        if m:
+            return _month_end(m.group(1), m.group(2))
 
         # 5. Handle YYYY-MM
-        if re.match(r'^\d{4}-\d{2}$', p):
-            year, month = p.split('-')
-            return pd.Timestamp(year=int(year), month=int(month), day=1).replace(day=pd.Timestamp(year=int(year), month=int(month), day=1).days_in_month).strftime('%Y-%m-%d')
+        m = _YEAR_MONTH_RE.match(p)
+        if m:
+            return _month_end(m.group(1), m.group(2))
             
-        # 5. Default: Try pandas to_datetime and force to month end
+        # 6. Default: Try pandas to_datetime and force to month end
         dt = pd.to_datetime(p)
         return dt.replace(day=dt.days_in_month).strftime('%Y-%m-%d')
         
     except:
         return p # Return original if parsing fails
 
+def normalize_period(period_str):
+    """
+    Standardizes inconsistent period strings into 'YYYY-MM-DD' (Month End).
+    Supports: YYYY, YYYY-MM, YYYY-QX, YYYY-MXX, YYYY-MM-DD
+    Results are memoized (LRU of PERIOD_CACHE_SIZE values).
+    """
+    try:
+        return _normalize_period_cached(period_str)
+    except TypeError:
+        # Unhashable input: not cacheable
+        return _normalize_period_cached.__wrapped__(period_str)
+
+def normalize_periods(values):
+    """
+    Vectorized normalize_period over a Series: each distinct value is
+    normalized once and the results are mapped back through its factorized
+    (categorical) codes. Missing values become None.
+    """
+    if not isinstance(values, pd.Series):
+        values = pd.Series(values)
+    codes, uniques = pd.factorize(values)
+    # Code -1 (missing) picks the trailing None
+    normalized = np.array([normalize_period(v) for v in uniques] + [None], dtype=object)
+    # dtype=object: pandas 3 would infer the string dtype and turn None into NaN
+    return pd.Series(normalized[codes], index=values.index, name=values.name, dtype=object)
+
+# (input, output of the original per-row implementation) for check_normalize_periods(),
+# generated with it on pandas 2.0.3 and 3.0.6. Full dates outside the pd.Timestamp
+# range are left out: the original's output for them depends on the pandas version.
+PERIOD_GOLDEN_CASES = [
+    ('2024-Q1', '2024-03-31'), ('2024-Q2', '2024-06-30'), ('2024-Q3', '2024-09-30'), ('2024-Q4', '2024-12-31'),
+    (' 2023-Q1 ', '2023-03-31'), ('1500-Q1', '1500-03-31'), ('1500-03', '1500-03-31'), ('2262-Q2', '2262-06-30'),
+    ('2262-06', '2262-06-30'), ('1677-01', '1677-01-31'), ('2262-09', '2262-09-30'), ('2262-Q4', '2262-12-31'),
+    ('2024-M02', '2024-02-29'), ('2023-M02', '2023-02-28'), ('2024-M11', '2024-11-30'), ('2024-M13', '2024-M13'),
+    ('2024', '2024-12-31'), (2024, '2024-12-31'), ('1999', '1999-12-31'),
+    ('202412', '2024-12-31'), (202406, '2024-06-30'), ('200002', '2000-02-29'), ('190002', '1900-02-28'), ('202400', '202400'),
+    ('2024-01', '2024-01-31'), ('2024-02', '2024-02-29'), ('2100-02', '2100-02-28'), ('2024-13', '2024-13'),
+    ('2024-12-31', '2024-12-31'), ('2024-06-15', '2024-06-30'), ('2024-05-15 10:30:00', '2024-05-31'), ('20241231', '2024-12-31'),
+    ('not a period', 'not a period'), ('', None), ('   ', None), (None, None), (float('nan'), None),
+]
+
+def check_normalize_periods():
+    """Compares normalize_period and normalize_periods with PERIOD_GOLDEN_CASES; returns the mismatches."""
+    inputs = [raw for raw, _ in PERIOD_GOLDEN_CASES]
+    series = normalize_periods(pd.Series(inputs, dtype=object)).tolist()
+    mismatches = []
+    for (raw, expected), vectorized in zip(PERIOD_GOLDEN_CASES, series):
+        scalar = normalize_period(raw)
+        if scalar != expected or vectorized != expected:
+            mismatches.append((raw, expected, scalar, vectorized))
+    return mismatches
+
 def get_item_mapping(conn, year):
     """
     Returns a dict mapping {original_id: canonical_id} for a specific exercise year.
@@ -80,3 +146,9 @@ def format_value(val, unit=None, decimals=2):
          return f"{val*100:,.{decimals}f}%"
     else:
          return f"{val:,.{decimals}f}"
+
+if __name__ == "__main__":
+    mismatches = check_normalize_periods()
+    for raw, expected, scalar, vectorized in mismatches:
+        print(f"{raw!r}: expected {expected!r}, normalize_period {scalar!r}, normalize_periods {vectorized!r}")
+    print(f"{len(PERIOD_GOLDEN_CASES) - len(mismatches)}/{len(PERIOD_GOLDEN_CASES)} golden periods match")